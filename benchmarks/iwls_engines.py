@@ -0,0 +1,73 @@
+"""
+Compare the NumPy and Numba iwls engines on many small fits.
+
+Usage: python benchmarks/iwls_engines.py [n] [k] [fits]
+
+Fits `fits` GLMs of n observations and k columns (including the constant)
+for each built-in family with GLM.fit(engine=...), then the same number of
+local (GWR-style) fits with iwls(..., wi=...), and prints the time per fit.
+The first Numba call compiles the kernel and is excluded.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from spglm._numba import HAS_NUMBA
+from spglm.family import Binomial, Gamma, Gaussian, Poisson
+from spglm.glm import GLM
+from spglm.iwls import iwls
+
+
+def data(family, n, k, rng):
+    X = rng.normal(size=(n, k - 1)) * 0.3
+    eta = 1.0 + X @ rng.normal(size=k - 1) * 0.3
+    if isinstance(family, Poisson):
+        y = rng.poisson(np.exp(eta))
+    elif isinstance(family, Binomial):
+        y = rng.binomial(1, 1 / (1 + np.exp(-eta)))
+    elif isinstance(family, Gamma):
+        y = rng.gamma(2.0, 0.5 / eta)  # canonical link: mu = 1 / eta
+    else:
+        y = eta + rng.normal(size=n)
+    return y.reshape((-1, 1)) * 1.0, X
+
+
+def per_fit(func, fits):
+    func()
+    start = time.perf_counter()
+    for _ in range(fits):
+        func()
+    return (time.perf_counter() - start) / fits
+
+
+def main(n=500, k=5, fits=500):
+    if not HAS_NUMBA:
+        print("Numba is not installed; engine='numba' falls back to NumPy.")
+    rng = np.random.default_rng(0)
+    print(f"n={n} k={k}, {fits} fits; microseconds per fit")
+    print(f"{'family':<10} {'fit':<5} {'numpy':>10} {'numba':>10} {'speedup':>8}")
+    for family in (Gaussian(), Poisson(), Binomial(), Gamma()):
+        y, X = data(family, n, k, rng)
+        model = GLM(y, X, family=family)
+        offset = np.ones_like(y)
+        wi = rng.uniform(size=(n, 1))
+
+        def glm(engine, model=model):
+            return model.fit(engine=engine)
+
+        def gwr(engine, family=family, y=y, x=model.X, offset=offset, wi=wi):
+            return iwls(y, x, family, offset, None, wi=wi, engine=engine)
+
+        for label, fit in (("glm", glm), ("gwr", gwr)):
+            numpy_t = per_fit(lambda fit=fit: fit("numpy"), fits)
+            numba_t = per_fit(lambda fit=fit: fit("numba"), fits)
+            print(
+                f"{type(family).__name__:<10} {label:<5} {numpy_t * 1e6:>10.1f} "
+                f"{numba_t * 1e6:>10.1f} {numpy_t / numba_t:>7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
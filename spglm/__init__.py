@@ -2,9 +2,15 @@ import contextlib
 from importlib.metadata import PackageNotFoundError, version
 
 from . import (
+    design,
+    distributed,
     family,
     glm,
     iwls,
+    optimize,
+    profiling,
+    solvers,
+    streaming,
     utils,
 )
 
@@ -0,0 +1,283 @@
+"""
+Numba compiled iwls iteration for the built-in families and links.
+
+The whole iteration (fitted values, weights, working response and the
+accumulation of X'WX and X'Wz) runs as one compiled loop over the
+observations, so a fit costs a handful of Python calls however many
+iterations it takes. Families and links are passed to the compiled code as
+integer codes; anything that cannot be expressed by them (user defined
+families, links or variance functions) is left to the NumPy path. The
+normal equations are solved by Cholesky on every iteration, so only fits
+with solver='cholesky' run here.
+"""
+
+import numpy as np
+
+from . import family as F  # noqa: N812
+from . import links as L  # noqa: N812
+from . import varfuncs as V  # noqa: N812
+
+try:
+    from numba import njit
+
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+FLOAT_EPS = np.finfo(float).eps
+
+LINK_LOG, LINK_LOGIT, LINK_POWER = 0, 1, 2
+VAR_CONSTANT, VAR_POWER, VAR_BINOMIAL = 0, 1, 2
+# the criteria of iwls._conv_value that need no deviance
+CRITERIA = {"min_diff": 0, "max_diff": 1, "rel_diff": 2, "gradient": 3}
+CRIT_MIN, CRIT_MAX, CRIT_REL, CRIT_GRADIENT = 0, 1, 2, 3
+
+_FAMILIES = (F.Gaussian, F.Poisson, F.QuasiPoisson, F.Gamma, F.Binomial)
+
+
+def family_codes(family):
+    """
+    Integer codes of a family's link and variance function for the compiled
+    iteration.
+
+    Parameters
+    ----------
+    family      : family object
+
+    Returns
+    -------
+    codes       : tuple
+                  (link, link power, variance, variance parameter, whether
+                  the offset scales mu), or None if the family, link or
+                  variance function is not one of the built-in ones
+    """
+    if type(family) not in _FAMILIES:
+        return None
+    link, variance = family.link, family.variance
+    if type(link) in (L.Log, L.log):
+        link_code, power = LINK_LOG, 0.0
+    elif type(link) in (L.Logit, L.logit):
+        link_code, power = LINK_LOGIT, 0.0
+    elif isinstance(link, L.Power):
+        link_code, power = LINK_POWER, float(link.power)
+    else:
+        return None
+    if type(variance) is V.VarianceFunction:
+        var_code, param = VAR_CONSTANT, 0.0
+    elif type(variance) is V.Power:
+        var_code, param = VAR_POWER, float(variance.power)
+    elif type(variance) is V.Binomial:
+        var_code, param = VAR_BINOMIAL, float(variance.n)
+    else:
+        return None
+    return link_code, power, var_code, param, isinstance(family, F.Poisson)
+
+
+def _inverse(code, power, v):
+    if code == LINK_LOG:
+        return np.exp(v)
+    if code == LINK_LOGIT:
+        return 1.0 / (1.0 + np.exp(-v))
+    # the common powers without a call to pow
+    if power == 1.0:
+        return v
+    if power == -1.0:
+        return 1.0 / v
+    return v ** (1.0 / power)
+
+
+def _deriv(code, power, mu):
+    if code == LINK_LOG:
+        return 1.0 / max(mu, FLOAT_EPS)
+    if code == LINK_LOGIT:
+        p = min(max(mu, FLOAT_EPS), 1.0 - FLOAT_EPS)
+        return 1.0 / (p * (1 - p))
+    if power == 1.0:
+        return 1.0
+    if power == -1.0:
+        return -1.0 / (mu * mu)
+    return power * mu ** (power - 1)
+
+
+def _variance(code, param, mu):
+    if code == VAR_CONSTANT:
+        return 1.0
+    if code == VAR_POWER:
+        if param == 1.0:
+            return abs(mu)
+        if param == 2.0:
+            return mu * mu
+        return abs(mu) ** param
+    p = min(max(mu / param, FLOAT_EPS), 1 - FLOAT_EPS)
+    return p * (1 - p) * param
+
+
+def _cho_solve(a, b):
+    """
+    Solve a x = b for a symmetric positive definite a through its Cholesky
+    factor, as the 'cholesky' solver does.
+    """
+    c = np.linalg.cholesky(a)
+    k = b.shape[0]
+    x = np.empty(k)
+    for i in range(k):
+        s = b[i]
+        for j in range(i):
+            s -= c[i, j] * x[j]
+        x[i] = s / c[i, i]
+    for i in range(k - 1, -1, -1):
+        s = x[i]
+        for j in range(i + 1, k):
+            s -= c[j, i] * x[j]
+        x[i] = s / c[i, i]
+    return x
+
+
+def _iwls(
+    y,
+    x,
+    offset,
+    wi,
+    betas,
+    v,
+    mu,
+    w,
+    z,
+    codes,
+    tol,
+    max_iter,
+    criterion,
+    warm,
+):
+    """
+    iwls iterations from the linear predictor v and fitted values mu.
+
+    v, mu, w (weights) and z are overwritten with the values of the final
+    iteration. wi holds GWR kernel weights (ones for a GLM). warm is True if
+    v is X times the starting betas, so that the score is defined on the
+    first iteration. Returns the betas, the number of iterations, the final
+    X'WX and the final value of the criterion.
+    """
+    link, power, var, param, scale_offset = codes
+    n, k = x.shape
+    xw = np.empty((k, n))
+    xtwx = np.empty((k, k))
+    n_iter = 0
+    diff = 1.0e6
+    while diff > tol and n_iter < max_iter:
+        n_iter += 1
+        for i in range(n):
+            d = _deriv(link, power, mu[i])
+            w[i] = 1.0 / (d * d * _variance(var, param, mu[i]))
+            z[i] = v[i] + d * (y[i] - mu[i])
+            wt = w[i] * wi[i]
+            for a in range(k):
+                xw[a, i] = x[i, a] * wt
+        # the cross-products go to BLAS
+        xtwx = np.dot(xw, x)
+        xtwz = np.dot(xw, z)
+        n_betas = _cho_solve(xtwx, xtwz)
+        if criterion == CRIT_GRADIENT:
+            if n_iter > 1 or warm:
+                diff = np.max(np.abs(xtwz - np.dot(xtwx, betas))) / n
+            else:
+                diff = np.inf
+        else:
+            change = np.abs(n_betas - betas)
+            if criterion == CRIT_MIN:
+                diff = np.min(change)
+            elif criterion == CRIT_MAX:
+                diff = np.max(change)
+            else:
+                diff = np.max(change / np.maximum(np.abs(n_betas), 1.0))
+        betas = n_betas
+        for i in range(n):
+            s = 0.0
+            for a in range(k):
+                s += x[i, a] * betas[a]
+            v[i] = s
+            mu[i] = _inverse(link, power, s)
+            if scale_offset:
+                mu[i] *= offset[i]
+    return betas, n_iter, xtwx, diff
+
+
+if HAS_NUMBA:
+    _inverse = njit(cache=True)(_inverse)
+    _deriv = njit(cache=True)(_deriv)
+    _variance = njit(cache=True)(_variance)
+    _cho_solve = njit(cache=True)(_cho_solve)
+    _iwls = njit(cache=True)(_iwls)
+
+
+def iwls_numba(
+    y,
+    x,
+    family,
+    offset,
+    wi,
+    betas,
+    v,
+    mu,
+    tol,
+    max_iter,
+    criterion="min_diff",
+    warm=False,
+):
+    """
+    Run the compiled iwls iterations; see iwls.iwls for the arguments.
+    criterion is any of iwls's but 'deviance', and warm is True if v and mu
+    come from initial betas.
+
+    Returns
+    -------
+    betas       : array
+                  k*1, estimated coefficients
+    v, mu, w, z : array
+                  n*1, linear predictor, fitted values, square root of the
+                  iwls weights and working response of the final iteration
+    xtwx        : array
+                  k*k, X'WX of the final iteration
+    n_iter      : integer
+                  number of iterations
+    diff        : float
+                  final value of the convergence criterion
+    """
+    n = x.shape[0]
+    w, z = np.empty(n), np.empty(n)
+    v = np.ascontiguousarray(v, dtype=float).reshape(n).copy()
+    mu = np.ascontiguousarray(mu, dtype=float).reshape(n).copy()
+    wi = np.ones(n) if wi is None else np.asarray(wi, dtype=float).reshape(n)
+    try:
+        betas, n_iter, xtwx, diff = _iwls(
+            np.asarray(y, dtype=float).reshape(n),
+            np.ascontiguousarray(x, dtype=float),
+            np.asarray(offset, dtype=float).reshape(n),
+            wi,
+            np.asarray(betas, dtype=float).reshape(-1),
+            v,
+            mu,
+            w,
+            z,
+            family_codes(family),
+            tol,
+            max_iter,
+            CRITERIA[criterion],
+            warm,
+        )
+    except np.linalg.LinAlgError as e:
+        raise np.linalg.LinAlgError(
+            "X'WX is not positive definite; the design may be rank "
+            "deficient. Use solver='qr' or solver='svd'."
+        ) from e
+    shape = (n, 1)
+    return (
+        betas.reshape((-1, 1)),
+        v.reshape(shape),
+        mu.reshape(shape),
+        np.sqrt(w).reshape(shape),
+        z.reshape(shape),
+        xtwx,
+        n_iter,
+        diff,
+    )
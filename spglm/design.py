@@ -0,0 +1,377 @@
+"""
+Structured design matrices for the IWLS routine.
+
+A design that is never held as an n*k array gives iwls the two products an
+iteration needs: the linear predictor X b, and the weighted cross-products
+X'WX and X'Wz, computed from whatever compact form it keeps. The normal
+equations are then solved from X'WX (see solvers.py).
+"""
+
+import numpy as np
+from scipy import sparse as sp
+
+__all__ = ["Design", "CategoricalDesign", "ODDesign"]
+
+
+class Design:
+    """
+    A generic structured design matrix.
+
+    `Design` does nothing, but lays out the methods expected of any
+    subclass, which also sets `shape` to (n, k).
+    """
+
+    shape = None
+
+    def dot(self, betas):
+        """
+        The linear predictor X b.
+
+        Parameters
+        ----------
+        betas : array
+            k*1, coefficients
+
+        Returns
+        -------
+        v : array
+            n*1, linear predictor
+        """
+        raise NotImplementedError
+
+    def normal_eq(self, w, z):
+        """
+        The weighted cross-products of the normal equations.
+
+        Parameters
+        ----------
+        w : array
+            n*1, iwls weights (not their square roots)
+        z : array
+            n*1, working response
+
+        Returns
+        -------
+        xtx : array
+            k*k, X'WX
+        xtz : array
+            k*1, X'Wz
+        """
+        raise NotImplementedError
+
+    def gram(self):
+        """
+        The unweighted cross-product X'X.
+        """
+        n = self.shape[0]
+        return self.normal_eq(np.ones((n, 1)), np.zeros((n, 1)))[0]
+
+    def toarray(self):
+        """
+        The design as a dense n*k array; for small designs and checks only.
+        """
+        k = self.shape[1]
+        return np.hstack([self.dot(col.reshape((-1, 1))) for col in np.eye(k)])
+
+
+class CategoricalDesign(Design):
+    """
+    A design of dense columns and of categorical factors held as integer
+    codes.
+
+    Each factor stands for the 0/1 dummy columns of its levels, which are
+    never formed: X b gathers the coefficient of each observation's level
+    with `take`, and the blocks of X'WX and X'Wz that involve a factor are
+    grouped sums by `np.bincount`. A factor costs the bytes of its codes
+    (e.g. 1 per row for int8) rather than 8 per row and level.
+
+    Parameters
+    ----------
+    X           : array
+                  n*p, dense columns, e.g. a constant and continuous
+                  covariates; may have no columns
+    codes       : array or list of arrays
+                  n*c array, or list of c length n arrays, of non-negative
+                  integer codes (any integer dtype) of the level of each
+                  observation in each of c factors; the codes of a factor
+                  run from 0 to its number of levels less one
+    full_first  : boolean
+                  if True the first factor has a column for every level, for
+                  a design without a constant; otherwise (default) level 0
+                  of every factor is the reference and has no column
+
+    Attributes
+    ----------
+    codes       : list
+                  the codes of each factor, in their given dtype
+    n_levels    : list
+                  number of levels of each factor
+    columns     : list
+                  for each factor, the slice of its columns in X
+    shape       : tuple
+                  (n, k), with k = p plus the columns of the factors
+    """
+
+    def __init__(self, X, codes, full_first=False):  # noqa: N803
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape((-1, 1))
+        n = X.shape[0]
+        if isinstance(codes, np.ndarray) and codes.ndim == 2:
+            codes = list(codes.T)
+        elif isinstance(codes, np.ndarray):
+            codes = [codes]
+        self.codes = []
+        self.n_levels = []
+        self.columns = []
+        start = X.shape[1]
+        for j, c in enumerate(codes):
+            c = np.asarray(c).reshape(-1)
+            if not np.issubdtype(c.dtype, np.integer):
+                raise ValueError(f"codes should be integers. (got {c.dtype})")
+            if len(c) != n:
+                raise ValueError("codes should have one entry per row of X")
+            if n and c.min() < 0:
+                raise ValueError("codes should be non-negative")
+            n_level = int(c.max()) + 1 if n else 0
+            stop = start + n_level - (0 if full_first and j == 0 else 1)
+            self.codes.append(c)
+            self.n_levels.append(n_level)
+            self.columns.append(slice(start, stop))
+            start = stop
+        self.X = X
+        self.full_first = full_first
+        self.shape = (n, start)
+
+    def _drop(self, j):
+        # leading levels without a column
+        return 0 if self.full_first and j == 0 else 1
+
+    def dot(self, betas):
+        betas = np.asarray(betas).reshape(-1)
+        p = self.X.shape[1]
+        v = np.dot(self.X, betas[:p]).reshape((-1, 1))
+        for j, c in enumerate(self.codes):
+            coef = np.zeros(self.n_levels[j])
+            coef[self._drop(j) :] = betas[self.columns[j]]
+            v[:, 0] += np.take(coef, c)
+        return v
+
+    def normal_eq(self, w, z):
+        w = np.asarray(w, dtype=np.float64).reshape(-1)
+        wz = w * np.asarray(z).reshape(-1)
+        p = self.X.shape[1]
+        k = self.shape[1]
+        xtx = np.zeros((k, k))
+        xtz = np.empty((k, 1))
+        xw = self.X * w[:, None]
+        xtx[:p, :p] = np.dot(xw.T, self.X)
+        xtz[:p, 0] = np.dot(self.X.T, wz)
+        for i, c in enumerate(self.codes):
+            cols, m, drop = self.columns[i], self.n_levels[i], self._drop(i)
+            diag = np.arange(cols.start, cols.stop)
+            xtx[diag, diag] = np.bincount(c, w, m)[drop:]
+            xtz[cols, 0] = np.bincount(c, wz, m)[drop:]
+            for j in range(p):
+                xtx[j, cols] = np.bincount(c, xw[:, j], m)[drop:]
+                xtx[cols, j] = xtx[j, cols]
+            for h in range(i + 1, len(self.codes)):
+                # the weight of each pair of levels of the two factors
+                mh = self.n_levels[h]
+                pairs = c.astype(np.intp) * mh + self.codes[h]
+                block = np.bincount(pairs, w, m * mh).reshape((m, mh))
+                block = block[drop:, self._drop(h) :]
+                xtx[cols, self.columns[h]] = block
+                xtx[self.columns[h], cols] = block.T
+        return xtx, xtz
+
+
+class ODDesign(Design):
+    """
+    The design of a spatial interaction model, with a row for every pair of
+    an origin and a destination, held as the origin and destination tables.
+
+    The row of the pair (i, j), at position i * N_d + j, is
+    [1, origins[i], destinations[j], decay(i)[j]], the constant being
+    optional. The N_o*N_d*k matrix is never formed: X b is the sum of the
+    origin and destination terms, broadcast, and the distance term, and
+    X'WX and X'Wz reduce the N_o*N_d weights to row and column sums for the
+    blocks of the origin and destination columns (with O'WD = O'(WD) for
+    their cross block). The distance terms are computed for a block of
+    origins at a time, so that, besides the n-length vectors of iwls, no
+    N_o*N_d array is formed.
+
+    For the largest problems, where the n-length vectors of an in-memory
+    iwls fit do not fit either, `chunks` yields the rows of a block of
+    origins at a time, with their flows, for StreamingGLM.
+
+    Parameters
+    ----------
+    origins     : array
+                  N_o*p_o, attributes of the origins (e.g. log populations)
+    destinations: array
+                  N_d*p_d, attributes of the destinations
+    decay       : callable
+                  decay(i) returns the len(i)*N_d distance terms (e.g. log
+                  distances) between the origins of the index array i and
+                  every destination
+    constant    : boolean
+                  if True (default) the first column is a constant
+    memory      : integer
+                  approximate working memory in bytes for a block of
+                  origins. Default is 64MB.
+
+    Attributes
+    ----------
+    shape       : tuple
+                  (N_o * N_d, k), with k = constant + p_o + p_d + 1
+    """
+
+    def __init__(self, origins, destinations, decay, constant=True, memory=2**26):
+        origins = np.asarray(origins, dtype=np.float64)
+        destinations = np.asarray(destinations, dtype=np.float64)
+        self.origins = origins.reshape((len(origins), -1))
+        self.destinations = destinations.reshape((len(destinations), -1))
+        self.decay = decay
+        self.constant = constant
+        self.memory = memory
+        n_o, p_o = self.origins.shape
+        n_d, p_d = self.destinations.shape
+        c = int(constant)
+        self._o = slice(c, c + p_o)
+        self._d = slice(c + p_o, c + p_o + p_d)
+        self.shape = (n_o * n_d, c + p_o + p_d + 1)
+
+    def _blocks(self, per_pair=1):
+        # slices of origins whose pairs, with per_pair floats each, fit memory
+        n_o, n_d = len(self.origins), len(self.destinations)
+        rows = max(1, int(self.memory // (8 * n_d * (per_pair + 1))))
+        for start in range(0, n_o, rows):
+            yield slice(start, min(start + rows, n_o))
+
+    def _distance(self, rows):
+        i = np.arange(rows.start, rows.stop)
+        dist = np.asarray(self.decay(i), dtype=np.float64)
+        return dist.reshape((len(i), len(self.destinations)))
+
+    def _split(self, betas):
+        betas = np.asarray(betas, dtype=np.float64).reshape(-1)
+        const = betas[0] if self.constant else 0.0
+        return const, betas[self._o], betas[self._d], betas[-1]
+
+    def dot(self, betas):
+        const, b_o, b_d, b_dist = self._split(betas)
+        n_d = len(self.destinations)
+        v = np.empty((len(self.origins), n_d))
+        v_o = const + np.dot(self.origins, b_o)
+        v_d = np.dot(self.destinations, b_d)
+        for rows in self._blocks():
+            block = v[rows]
+            np.multiply(self._distance(rows), b_dist, out=block)
+            block += v_o[rows, None]
+            block += v_d
+        return v.reshape((-1, 1))
+
+    def normal_eq(self, w, z):
+        n_o, n_d = len(self.origins), len(self.destinations)
+        w = np.asarray(w, dtype=np.float64).reshape((n_o, n_d))
+        wz = w * np.asarray(z).reshape((n_o, n_d))
+        orig, dest = self.origins, self.destinations
+        k = self.shape[1]
+        xtx = np.zeros((k, k))
+        xtz = np.zeros((k, 1))
+        # the weights, and the weights times the distance terms and their
+        # squares, summed over the rows and the columns of the OD matrix
+        w_o, w_d = w.sum(axis=1), w.sum(axis=0)
+        wg_o, wg_d = np.empty(n_o), np.zeros(n_d)
+        wgg = wzg = 0.0
+        for rows in self._blocks(3):
+            g = self._distance(rows)
+            wg = w[rows] * g
+            wg_o[rows] = wg.sum(axis=1)
+            wg_d += wg.sum(axis=0)
+            wgg += np.sum(wg * g)
+            wzg += np.sum(wz[rows] * g)
+        o, d = self._o, self._d
+        xtx[o, o] = np.dot(orig.T * w_o, orig)
+        xtx[d, d] = np.dot(dest.T * w_d, dest)
+        xtx[o, d] = np.dot(orig.T, np.dot(w, dest))
+        xtx[o, -1] = np.dot(orig.T, wg_o)
+        xtx[d, -1] = np.dot(dest.T, wg_d)
+        xtx[-1, -1] = wgg
+        xtz[o, 0] = np.dot(orig.T, wz.sum(axis=1))
+        xtz[d, 0] = np.dot(dest.T, wz.sum(axis=0))
+        xtz[-1, 0] = wzg
+        if self.constant:
+            xtx[0, 0] = w_o.sum()
+            xtx[0, o] = np.dot(w_o, orig)
+            xtx[0, d] = np.dot(w_d, dest)
+            xtx[0, -1] = wg_o.sum()
+            xtz[0, 0] = wz.sum()
+        # the upper triangle is filled; mirror it
+        upper = np.triu_indices(k, 1)
+        xtx[upper[1], upper[0]] = xtx[upper]
+        return xtx, xtz
+
+    def rows(self, origins):
+        """
+        The rows of the pairs of a slice of origins, as a dense array.
+
+        Parameters
+        ----------
+        origins     : slice
+                      origins whose rows are formed, in origin-major order
+
+        Returns
+        -------
+        x           : array
+                      (number of origins * N_d)*k
+        """
+        b = origins.stop - origins.start
+        n_d = len(self.destinations)
+        x = np.empty((b, n_d, self.shape[1]))
+        if self.constant:
+            x[:, :, 0] = 1.0
+        x[:, :, self._o] = self.origins[origins, None, :]
+        x[:, :, self._d] = self.destinations[None, :, :]
+        x[:, :, -1] = self._distance(origins)
+        return x.reshape((b * n_d, -1))
+
+    def chunks(self, flows, offset=None):
+        """
+        A chunk source for StreamingGLM(chunks=..., constant=False).
+
+        Parameters
+        ----------
+        flows       : array or sparse matrix
+                      N_o*N_d flows; a scipy.sparse matrix stores only the
+                      non-zero flows, and a block of origins is densified
+                      only while it is read
+        offset      : array
+                      N_o*N_d offsets, or None
+
+        Returns
+        -------
+        chunks      : callable
+                      returns a fresh iterator of (y, X, offset) blocks of
+                      whole origins, in the row order of the design
+        """
+        n_o, n_d = len(self.origins), len(self.destinations)
+        if flows.shape != (n_o, n_d):
+            raise ValueError(f"flows should be N_o*N_d. (got {flows.shape})")
+        if sp.issparse(flows):
+            flows = sp.csr_matrix(flows)
+
+        def chunks():
+            # the block, its weighted copy and the working arrays
+            for rows in self._blocks(2 * self.shape[1] + 10):
+                y = flows[rows]
+                y = y.toarray() if sp.issparse(y) else np.asarray(y)
+                off = None if offset is None else np.asarray(offset)[rows]
+                yield (
+                    y.reshape((-1, 1)),
+                    self.rows(rows),
+                    None if off is None else off.reshape((-1, 1)),
+                )
+
+        return chunks
@@ -0,0 +1,520 @@
+"""
+Exact GLM estimation over data sharded across worker processes.
+
+Each worker loads and keeps one shard of (y, X, offset). On every IWLS
+iteration the coordinator sends the current coefficients and each worker
+returns only its partial X'WX, X'Wz, deviance and log-likelihood; the
+coordinator adds them up and solves for the next coefficients. Raw data never
+leaves the workers.
+
+Workers are either local processes (LocalShard) or any process serving a
+shard on a socket with serve_shard, reached through RemoteShard. The socket
+carries pickled objects, so both ends must share a secret authkey, and the
+port should only be reachable from trusted hosts.
+"""
+
+import contextlib
+import multiprocessing
+import traceback
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from . import family
+from .glm import GLM, GLMResults
+from .iwls import (
+    _block_normal_eq,
+    _check_criterion,
+    _conv_value,
+    _deviance,
+    _record,
+)
+from .solvers import get_solver
+from .streaming import _is_ols, _ols_loglike
+from .utils import cache_readonly
+
+__all__ = [
+    "DistributedGLM",
+    "DistributedGLMResults",
+    "LocalShard",
+    "RemoteShard",
+    "serve_shard",
+]
+
+
+class _Shard:
+    """
+    Worker-side state: one shard of the data and the model family.
+    """
+
+    def __init__(self, loader):
+        data = loader()
+        self.y = np.asarray(data[0], dtype=float).reshape((-1, 1))
+        X = np.asarray(data[1], dtype=float)  # noqa: N806
+        self.X = X.reshape((-1, 1)) if X.ndim == 1 else X
+        if len(data) > 2 and data[2] is not None:
+            self.offset = np.asarray(data[2], dtype=float).reshape((-1, 1))
+        else:
+            self.offset = np.ones_like(self.y)
+        self.family = None
+        self.x = None
+
+    def init(self, fam, constant):
+        self.family = fam
+        ones = np.ones_like(self.y)
+        self.x = np.hstack([ones, self.X]) if constant else self.X
+        y = self.y
+        return (
+            y.shape[0],
+            self.x.shape[1],
+            y.sum(),
+            (y**2).sum(),
+            (y / self.offset).sum(),
+        )
+
+    def _design(self, null):
+        return np.ones_like(self.y) if null else self.x
+
+    def _mu(self, betas, null):
+        mu = self.family.fitted(np.dot(self._design(null), betas))
+        if isinstance(self.family, family.Poisson):
+            mu = mu * self.offset
+        return mu
+
+    def _loglike(self, mu, scale):
+        # the OLS loglikelihood is not a sum over observations; the
+        # coordinator rebuilds it from the residual sum of squares
+        if _is_ols(self.family):
+            return 0.0
+        return self.family.loglike(self.y, mu, scale=scale)
+
+    def step(self, betas, y_means, null):
+        xtwx, xtwz, mu = _block_normal_eq(
+            self.y,
+            self._design(null),
+            self.family,
+            self.offset,
+            betas,
+            y_means,
+            return_mu=True,
+        )
+        deviance = self.family.deviance(self.y, mu)
+        ssr = np.sum((self.y - mu) ** 2)
+        monitored = _deviance(self.family, self.y, mu)
+        return xtwx, xtwz, deviance, self._loglike(mu, 1.0), ssr, monitored
+
+    def diagnostics(self, betas, null):
+        mu = self._mu(betas, null)
+        return (
+            self.family.deviance(self.y, mu),
+            np.sum((self.y - mu) ** 2 / self.family.variance(mu)),
+            np.sum((self.y - mu) ** 2),
+        )
+
+    def loglike(self, betas, scale, null):
+        return (self._loglike(self._mu(betas, null), scale),)
+
+
+_COMMANDS = ("init", "step", "diagnostics", "loglike")
+
+
+def _serve(conn, loader):
+    """
+    Serve requests for one shard on a connection until it is closed.
+    """
+    shard = None
+    while True:
+        try:
+            cmd, args = conn.recv()
+        except EOFError:
+            break
+        if cmd == "close":
+            break
+        try:
+            if cmd not in _COMMANDS:
+                raise ValueError(f"unknown command {cmd}")
+            if shard is None:
+                shard = _Shard(loader)
+            result = getattr(shard, cmd)(*args)
+        except Exception:
+            conn.send(("error", traceback.format_exc()))
+        else:
+            conn.send(("ok", result))
+    conn.close()
+
+
+def _check_authkey(authkey):
+    """
+    Refuse to open a socket without authentication.
+    """
+    if not authkey:
+        raise ValueError(
+            "an authkey is required; the connection unpickles what it receives"
+        )
+
+
+def serve_shard(address, loader, authkey):
+    """
+    Serve one shard on a socket, for use on a remote node. Blocks until the
+    coordinator disconnects.
+
+    The connection runs pickle: the family and the requests sent by the
+    coordinator are unpickled here, which can run arbitrary code. Only a
+    client that proves it holds authkey is accepted; keep the key secret and
+    the port closed to untrusted hosts.
+
+    Parameters
+    ----------
+    address : tuple
+        (host, port) to listen on
+    loader : callable
+        returns (y, X) or (y, X, offset) for the shard; called once, in this
+        process
+    authkey : bytes
+        shared secret, required; the coordinator must pass the same one to
+        RemoteShard
+    """
+    _check_authkey(authkey)
+    with Listener(address, authkey=authkey) as listener, listener.accept() as conn:
+        _serve(conn, loader)
+
+
+class Shard:
+    """
+    Coordinator-side handle to a worker holding one shard.
+    """
+
+    _conn = None
+
+    def request(self, cmd, *args):
+        self._conn.send((cmd, args))
+
+    def result(self):
+        status, value = self._conn.recv()
+        if status == "error":
+            raise RuntimeError(f"shard worker failed:\n{value}")
+        return value
+
+    def close(self):
+        if self._conn is not None:
+            with contextlib.suppress(OSError):
+                self._conn.send(("close", ()))
+            self._conn.close()
+            self._conn = None
+
+
+class LocalShard(Shard):
+    """
+    Shard held by a worker process on this machine.
+
+    Parameters
+    ----------
+    loader : callable
+        returns (y, X) or (y, X, offset) for the shard; called in the worker
+        process, so it must be picklable under the 'spawn' start method, e.g.
+        functools.partial(np.load, path)
+    context : string
+        multiprocessing start method; default is the platform default
+    """
+
+    def __init__(self, loader, context=None):
+        ctx = multiprocessing.get_context(context)
+        self._conn, child = ctx.Pipe()
+        self._process = ctx.Process(target=_serve, args=(child, loader), daemon=True)
+        self._process.start()
+        child.close()
+
+    def close(self):
+        super().close()
+        self._process.join()
+
+
+class RemoteShard(Shard):
+    """
+    Shard held by a process running serve_shard, reached over a socket.
+
+    The connection runs pickle, and the replies of the worker are unpickled
+    here; connect only to workers you trust. The worker is authenticated by
+    authkey, and a wrong key raises multiprocessing.AuthenticationError.
+
+    Parameters
+    ----------
+    address : tuple
+        (host, port) the worker listens on
+    authkey : bytes
+        shared secret given to serve_shard, required
+    """
+
+    def __init__(self, address, authkey):
+        _check_authkey(authkey)
+        self._conn = Client(address, authkey=authkey)
+
+
+class DistributedGLM(GLM):
+    """
+    Generalised linear models estimated over sharded data. Gives the same
+    estimates as GLM on the concatenated shards; only k*k and k*1 partial
+    sums travel between processes.
+
+    Parameters
+    ----------
+        shards        : list
+                        Shard handles (LocalShard, RemoteShard), or loader
+                        callables, each of which is started as a LocalShard.
+        family        : family instance
+                        Model type: Gaussian, Poisson, Binomial
+        constant      : boolean
+                        If True (default) a column of ones is prepended to
+                        every shard's design. Unlike GLM, X is not checked for
+                        existing constant columns.
+
+    Attributes
+    ----------
+        n             : integer
+                        Number of observations over all shards
+        k             : integer
+                        Number of independent variables, including constant
+        fit_params    : dict
+                        Parameters passed into fit method to define estimation
+                        routine.
+
+    Notes
+    -----
+    Close the model (or use it as a context manager) to stop the workers.
+    """
+
+    def __init__(self, shards, family=family.Gaussian(), constant=True):
+        """
+        Initialize class
+        """
+        self.shards = [s if isinstance(s, Shard) else LocalShard(s) for s in shards]
+        self.family = family
+        self.constant = constant
+        self.y = self.X = self.offset = None
+        parts = self._map("init", family, constant)
+        if len({p[1] for p in parts}) > 1:
+            raise ValueError("all shards must have the same number of columns")
+        self.n, self.k = sum(p[0] for p in parts), parts[0][1]
+        self.nobs = self.n
+        sum_y, sum_y2, sum_yoff = (sum(p[i] for p in parts) for i in (2, 3, 4))
+        self._mean_y = sum_y / self.n
+        self._var_y = (sum_y2 - self.n * self._mean_y**2) / (self.n - 1)
+        self._y_means = (self._mean_y, sum_yoff / self.n)
+        self.fit_params = {}
+
+    def _map(self, cmd, *args):
+        """
+        Send a request to every shard, then collect the replies in order.
+        """
+        for shard in self.shards:
+            shard.request(cmd, *args)
+        return [shard.result() for shard in self.shards]
+
+    def _reduce(self, cmd, *args):
+        parts = self._map(cmd, *args)
+        return tuple(sum(p[i] for p in parts) for i in range(len(parts[0])))
+
+    def _iwls(
+        self,
+        ini_betas,
+        tol,
+        max_iter,
+        solver,
+        null=False,
+        criterion="min_diff",
+        info=None,
+    ):
+        n_iter = 0
+        diff = 1.0e6
+        betas = None if ini_betas is None else np.asarray(ini_betas).reshape((-1, 1))
+        deviance = llf = monitored = None
+        while diff > tol and n_iter < max_iter:
+            n_iter += 1
+            old_monitored = monitored
+            xtwx, xtwz, deviance, llf, ssr, monitored = self._reduce(
+                "step", betas, self._y_means, null
+            )
+            score = None if betas is None else xtwz - np.dot(xtwx, betas)
+            n_betas = solver.solve_normal(xtwx, xtwz)
+            diff = _conv_value(
+                criterion, betas, n_betas, monitored, old_monitored, score, self.n
+            )
+            betas = n_betas
+        _record(info, criterion, diff, tol)
+        if _is_ols(self.family):
+            llf = _ols_loglike(ssr, self.n)
+        return betas, n_iter, deviance, llf
+
+    def fit(
+        self,
+        ini_betas=None,
+        tol=1.0e-6,
+        max_iter=200,
+        solver="cholesky",
+        criterion="min_diff",
+    ):
+        """
+        Method that fits a model with distributed iwls.
+
+        Parameters
+        ----------
+
+        ini_betas     : array
+                        k*1, initial coefficient values, including constant.
+        tol:            float
+                        Tolerence for estimation convergence.
+        max_iter       : integer
+                        Maximum number of iterations if convergence not
+                        achieved.
+        solver        : string
+                        Linear solver for the reduced normal equations:
+                        'cholesky' (default), 'splu' or 'svd'.
+        criterion     : string
+                        Convergence criterion; see GLM.fit. The shards return
+                        the deviance at the betas entering each iteration, so
+                        'deviance' stops one iteration later than in GLM.
+        """
+        _check_criterion(criterion)
+        self.fit_params["ini_betas"] = ini_betas
+        self.fit_params["tol"] = tol
+        self.fit_params["max_iter"] = max_iter
+        self.fit_params["solve"] = "iwls"
+        self.fit_params["solver"] = solver
+        self.fit_params["criterion"] = criterion
+        solver = get_solver(solver)
+        info = {}
+        params, n_iter, deviance, llf = self._iwls(
+            ini_betas, tol, max_iter, solver, criterion=criterion, info=info
+        )
+        self.fit_params["n_iter"] = n_iter
+        self.fit_params["conv_value"] = info["value"]
+        self.fit_params["converged"] = info["converged"]
+        # at the coefficients entering the last iteration
+        self.fit_params["deviance"] = deviance
+        self.fit_params["llf"] = llf
+        return DistributedGLMResults(self, params.flatten(), solver)
+
+    def close(self):
+        """
+        Stop the workers.
+        """
+        for shard in self.shards:
+            shard.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @cache_readonly
+    def df_model(self):
+        return self.k - 1
+
+    @cache_readonly
+    def mean_y(self):
+        return self._mean_y
+
+    @cache_readonly
+    def std_y(self):
+        return np.sqrt(self._var_y)
+
+
+class DistributedGLMResults(GLMResults):
+    """
+    Results of a DistributedGLM. Has the scalar diagnostics and inference of
+    GLMResults, each computed by a reduction over the shards on first access.
+    n-length quantities (y, mu, residuals) stay on the workers and are not
+    available.
+
+    Parameters
+    ----------
+        model         : DistributedGLM object
+                        Pointer to the model with estimation parameters.
+        params        : array
+                        k*1, estimated coefficients
+        solver        : Solver
+                        solver holding the factorization of the final iwls
+                        step
+    """
+
+    def __init__(self, model, params, solver):
+        self.model = model
+        self.n = model.n
+        self.nobs = model.nobs
+        self.X = None
+        self.k = model.k
+        self.offset = None
+        self.family = model.family
+        self.fit_params = model.fit_params
+        self.params = params
+        self.w = None
+        self.solver = solver
+        self._cache = {}
+
+    def _local(self):
+        raise ValueError("n-length results stay on the shard workers")
+
+    @cache_readonly
+    def y(self):
+        self._local()
+
+    @cache_readonly
+    def mu(self):
+        self._local()
+
+    @cache_readonly
+    def null(self):
+        self._local()
+
+    @cache_readonly
+    def _null_params(self):
+        solver = get_solver("cholesky")
+        params, _, _, _ = self.model._iwls(None, 1.0e-6, 200, solver, null=True)
+        return params
+
+    @cache_readonly
+    def _diagnostics(self):
+        return self.model._reduce("diagnostics", self.params.reshape((-1, 1)), False)
+
+    @cache_readonly
+    def _null_diagnostics(self):
+        return self.model._reduce("diagnostics", self._null_params, True)
+
+    @cache_readonly
+    def deviance(self):
+        return self._diagnostics[0]
+
+    @cache_readonly
+    def null_deviance(self):
+        return self._null_diagnostics[0]
+
+    @cache_readonly
+    def pearson_chi2(self):
+        return self._diagnostics[1]
+
+    @cache_readonly
+    def scale(self):
+        if isinstance(self.family, (family.Binomial, family.Poisson)):
+            return 1.0
+        return self.pearson_chi2 / self.df_resid
+
+    def _loglike(self, null):
+        if _is_ols(self.family):
+            diagnostics = self._null_diagnostics if null else self._diagnostics
+            return _ols_loglike(diagnostics[2], self.n)
+        params = self._null_params if null else self.params.reshape((-1, 1))
+        return self.model._reduce("loglike", params, self.scale, null)[0]
+
+    @cache_readonly
+    def llf(self):
+        return self._loglike(null=False)
+
+    @cache_readonly
+    def llnull(self):
+        return self._loglike(null=True)
+
+    @cache_readonly
+    def tr_S(self):
+        # tr(X [X'X]^-1 X') = tr([X'X]^-1 X'X) = k
+        return self.model.k
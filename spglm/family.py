@@ -15,6 +15,15 @@ from . import varfuncs as V  # noqa: N812
 FLOAT_EPS = np.finfo(float).eps
 
 
+def _inplace(obj, method, module):
+    """
+    Whether obj.method is the one of a built-in link or variance function,
+    which accept out= and work=; user-defined ones may take the mean alone.
+    """
+    func = getattr(type(obj), method, None)
+    return getattr(func, "__module__", None) == module.__name__
+
+
 class Family:
     """
     The parent class for one-parameter exponential families.
@@ -96,7 +105,7 @@ class Family:
         """
         return (y + y.mean()) / 2.0
 
-    def weights(self, mu):
+    def weights(self, mu, out=None, work=None):
         r"""
         Weights for IRLS steps
 
@@ -104,6 +113,11 @@ class Family:
         ----------
         mu : array-like
             The transformed mean response variable in the exponential family
+        out : array, optional
+            Array of the same shape as `mu` to write the weights into.
+        work : array, optional
+            Scratch array of shape (2,) + mu.shape, used with `out` so that
+            no temporaries are allocated.
 
         Returns
         -------
@@ -111,9 +125,19 @@ class Family:
             The weights for the IRLS steps
 
         """
-        return 1.0 / (self.link.deriv(mu) ** 2 * self.variance(mu))
-
-    def deviance(self, endog, mu, freq_weights=1.0, scale=1.0):
+        if out is None or not self._inplace():
+            w = 1.0 / (self.link.deriv(mu) ** 2 * self.variance(mu))
+            if out is None:
+                return w
+            out[...] = w
+            return out
+        work = (None, None) if work is None else work
+        self.link.deriv(mu, out=out, work=work[0])
+        np.square(out, out=out)
+        np.multiply(out, self.variance(mu, out=work[0], work=work[1]), out=out)
+        return np.divide(1.0, out, out=out)
+
+    def deviance(self, endog, mu, freq_weights=1.0, scale=1.0, var_weights=1.0):
         r"""
         The deviance function evaluated at (endog,mu,freq_weights,mu).
 
@@ -129,6 +153,9 @@ class Family:
             1d array of frequency weights. The default is 1.
         scale : float, optional
             An optional scale argument. The default is 1.
+        var_weights : array-like
+            1d array of variance weights, which divide the variance of each
+            observation. The default is 1.
 
         Returns
         -------
@@ -138,7 +165,7 @@ class Family:
         """
         raise NotImplementedError
 
-    def resid_dev(self, endog, mu, freq_weights=1.0, scale=1.0):
+    def resid_dev(self, endog, mu, freq_weights=1.0, scale=1.0, var_weights=1.0):
         """
         The deviance residuals
 
@@ -153,6 +180,8 @@ class Family:
         scale : float, optional
             An optional argument to divide the residuals by scale. The default
             is 1.
+        var_weights : array-like
+            1d array of variance weights. The default is 1.
 
         Returns
         -------
@@ -161,7 +190,7 @@ class Family:
         """
         raise NotImplementedError
 
-    def fitted(self, lin_pred):
+    def fitted(self, lin_pred, out=None):
         """
         Fitted values based on linear predictors lin_pred.
 
@@ -170,6 +199,9 @@ class Family:
         lin_pred : array
             Values of the linear predictor of the model.
             dot(X,beta) in a classical linear model.
+        out : array, optional
+            Array of the same shape as `lin_pred` to write the fitted values
+            into.
 
         Returns
         --------
@@ -177,9 +209,56 @@ class Family:
             The mean response variables given by the inverse of the link
             function.
         """
-        fits = self.link.inverse(lin_pred)
+        if out is None or not _inplace(self.link, "inverse", L):
+            fits = self.link.inverse(lin_pred)
+            if out is None:
+                return fits
+            out[...] = fits
+            return out
+        fits = self.link.inverse(lin_pred, out=out)
         return fits
 
+    def _inplace(self):
+        """
+        Whether the link derivative and the variance function can write into
+        preallocated arrays.
+        """
+        return _inplace(self.link, "deriv", L) and _inplace(
+            self.variance, "__call__", V
+        )
+
+    def iwls_kernel(self):
+        """
+        The function computing the iwls weights and working response for this
+        family and link, chosen once per fit.
+
+        Canonical pairs (log link with the mu variance, logit with the
+        binomial variance, identity with the constant variance and inverse
+        power with the mu squared variance) get a fused kernel that evaluates
+        the closed forms of w and z in a single pass, without clipping mu
+        twice or evaluating the link derivative twice; any other pair gets
+        the generic kernel, which calls weights and link.deriv.
+
+        Returns
+        -------
+        kernel : IWLSKernel
+        """
+        link, variance = self.link, self.variance
+        if type(variance) is V.VarianceFunction and _is_power(link, 1.0):
+            return IdentityKernel(self)
+        power = variance.power if type(variance) is V.Power else None
+        if power == 1.0 and isinstance(link, L.Log):
+            return LogKernel(self)
+        if power == 2.0 and _is_power(link, -1.0):
+            return InverseKernel(self)
+        if (
+            type(variance) is V.Binomial
+            and variance.n == 1
+            and type(link) in (L.Logit, L.logit)
+        ):
+            return LogitKernel(self)
+        return IWLSKernel(self)
+
     def predict(self, mu):
         """
         Linear predictors based on given mu values.
@@ -197,7 +276,7 @@ class Family:
         """
         return self.link(mu)
 
-    def loglike(self, endog, mu, freq_weights=1.0, scale=1.0):
+    def loglike(self, endog, mu, freq_weights=1.0, scale=1.0, var_weights=1.0):
         """
         The log-likelihood function in terms of the fitted mean response.
 
@@ -211,6 +290,9 @@ class Family:
             1d array of frequency weights. The default is 1.
         scale : float
             The scale parameter. The default is 1.
+        var_weights : array-like
+            1d array of variance weights; scale / var_weights is the
+            scale of each observation. The default is 1.
 
         Returns
         -------
@@ -269,7 +351,7 @@ class Poisson(Family):
         """
         return np.clip(x, FLOAT_EPS, np.inf)
 
-    def resid_dev(self, endog, mu, scale=1.0):
+    def resid_dev(self, endog, mu, scale=1.0, var_weights=1.0):
         r"""Poisson deviance residual
 
         Parameters
@@ -281,6 +363,8 @@ class Poisson(Family):
         scale : float, optional
             An optional argument to divide the residuals by scale. The default
             is 1.
+        var_weights : array-like
+            1d array of variance weights. The default is 1.
 
         Returns
         -------
@@ -291,11 +375,11 @@ class Poisson(Family):
         endog_mu = self._clean(endog / mu)
         return (
             np.sign(endog - mu)
-            * np.sqrt(2 * (endog * np.log(endog_mu) - (endog - mu)))
+            * np.sqrt(2 * var_weights * (endog * np.log(endog_mu) - (endog - mu)))
             / scale
         )
 
-    def deviance(self, endog, mu, freq_weights=1.0, scale=1.0):
+    def deviance(self, endog, mu, freq_weights=1.0, scale=1.0, var_weights=1.0):
         r"""
         Poisson deviance function
 
@@ -309,6 +393,8 @@ class Poisson(Family):
             1d array of frequency weights. The default is 1.
         scale : float, optional
             An optional scale argument. The default is 1.
+        var_weights : array-like
+            1d array of variance weights. The default is 1.
 
         Returns
         -------
@@ -318,9 +404,10 @@ class Poisson(Family):
 
         """
         endog_mu = self._clean(endog / mu)
-        return 2 * np.sum(endog * freq_weights * np.log(endog_mu)) / scale
+        weights = freq_weights * var_weights
+        return 2 * np.sum(endog * weights * np.log(endog_mu)) / scale
 
-    def loglike(self, endog, mu, freq_weights=1.0, scale=1.0):
+    def loglike(self, endog, mu, freq_weights=1.0, scale=1.0, var_weights=1.0):
         r"""
         The log-likelihood function in terms of the fitted mean response.
 
@@ -334,6 +421,8 @@ class Poisson(Family):
             1d array of frequency weights. The default is 1.
         scale : float, optional
             The scale parameter, defaults to 1.
+        var_weights : array-like
+            1d array of variance weights. The default is 1.
 
         Returns
         -------
@@ -343,7 +432,9 @@ class Poisson(Family):
 
         """
         loglike = np.sum(
-            freq_weights * (endog * np.log(mu) - mu - special.gammaln(endog + 1))
+            freq_weights
+            * var_weights
+            * (endog * np.log(mu) - mu - special.gammaln(endog + 1))
         )
         return scale * loglike
 
@@ -404,7 +495,7 @@ class QuasiPoisson(Family):
         """
         return np.clip(x, FLOAT_EPS, np.inf)
 
-    def resid_dev(self, endog, mu, scale=1.0):
+    def resid_dev(self, endog, mu, scale=1.0, var_weights=1.0):
         r"""Poisson deviance residual
 
         Parameters
@@ -416,6 +507,8 @@ class QuasiPoisson(Family):
         scale : float, optional
             An optional argument to divide the residuals by scale. The default
             is 1.
+        var_weights : array-like
+            1d array of variance weights. The default is 1.
 
         Returns
         -------
@@ -426,11 +519,11 @@ class QuasiPoisson(Family):
         endog_mu = self._clean(endog / mu)
         return (
             np.sign(endog - mu)
-            * np.sqrt(2 * (endog * np.log(endog_mu) - (endog - mu)))
+            * np.sqrt(2 * var_weights * (endog * np.log(endog_mu) - (endog - mu)))
             / scale
         )
 
-    def deviance(self, endog, mu, freq_weights=1.0, scale=1.0):
+    def deviance(self, endog, mu, freq_weights=1.0, scale=1.0, var_weights=1.0):
         r"""
         Poisson deviance function
 
@@ -444,6 +537,8 @@ class QuasiPoisson(Family):
             1d array of frequency weights. The default is 1.
         scale : float, optional
             An optional scale argument. The default is 1.
+        var_weights : array-like
+            1d array of variance weights. The default is 1.
 
         Returns
         -------
@@ -453,9 +548,10 @@ class QuasiPoisson(Family):
 
         """
         endog_mu = self._clean(endog / mu)
-        return 2 * np.sum(endog * freq_weights * np.log(endog_mu)) / scale
+        weights = freq_weights * var_weights
+        return 2 * np.sum(endog * weights * np.log(endog_mu)) / scale
 
-    def loglike(self, endog, mu, freq_weights=1.0, scale=1.0):
+    def loglike(self, endog, mu, freq_weights=1.0, scale=1.0, var_weights=1.0):
         r"""
         The log-likelihood function in terms of the fitted mean response.
 
@@ -513,7 +609,7 @@ class Gaussian(Family):
         self.variance = Gaussian.variance
         self.link = link()
 
-    def resid_dev(self, endog, mu, scale=1.0):
+    def resid_dev(self, endog, mu, scale=1.0, var_weights=1.0):
         """
         Gaussian deviance residuals
 
@@ -526,6 +622,8 @@ class Gaussian(Family):
         scale : float, optional
             An optional argument to divide the residuals by scale. The default
             is 1.
+        var_weights : array-like
+            1d array of variance weights. The default is 1.
 
         Returns
         -------
@@ -534,9 +632,9 @@ class Gaussian(Family):
 
         """
 
-        return (endog - mu) / np.sqrt(self.variance(mu)) / scale
+        return (endog - mu) * np.sqrt(var_weights / self.variance(mu)) / scale
 
-    def deviance(self, endog, mu, freq_weights=1.0, scale=1.0):
+    def deviance(self, endog, mu, freq_weights=1.0, scale=1.0, var_weights=1.0):
         """
         Gaussian deviance function
 
@@ -550,6 +648,8 @@ class Gaussian(Family):
             1d array of frequency weights. The default is 1.
         scale : float, optional
             An optional scale argument. The default is 1.
+        var_weights : array-like
+            1d array of variance weights. The default is 1.
 
         Returns
         -------
@@ -558,9 +658,9 @@ class Gaussian(Family):
             as defined below.
 
         """
-        return np.sum(freq_weights * (endog - mu) ** 2) / scale
+        return np.sum(freq_weights * var_weights * (endog - mu) ** 2) / scale
 
-    def loglike(self, endog, mu, freq_weights=1.0, scale=1.0):
+    def loglike(self, endog, mu, freq_weights=1.0, scale=1.0, var_weights=1.0):
         """
         The log-likelihood in terms of the fitted mean response.
 
@@ -574,6 +674,8 @@ class Gaussian(Family):
             1d array of frequency weights. The default is 1.
         scale : float, optional
             Scales the loglikelihood function. The default is 1.
+        var_weights : array-like
+            1d array of variance weights. The default is 1.
 
         Returns
         -------
@@ -583,13 +685,17 @@ class Gaussian(Family):
 
         """
         if isinstance(self.link, L.Power) and self.link.power == 1:
-            # This is just the loglikelihood for classical OLS
-            nobs2 = endog.shape[0] / 2.0
-            SSR = np.sum((endog - self.fitted(mu)) ** 2, axis=0)
+            # This is just the loglikelihood for classical (weighted) OLS
+            nobs2 = np.sum(np.broadcast_to(freq_weights, endog.shape)) / 2.0
+            SSR = np.sum(
+                freq_weights * var_weights * (endog - self.fitted(mu)) ** 2, axis=0
+            )
             llf = -np.log(SSR) * nobs2
             llf -= (1 + np.log(np.pi / nobs2)) * nobs2
-            return llf
+            return llf + np.sum(freq_weights * np.log(var_weights)) / 2.0
         else:
+            # the scale of each observation
+            scale = scale / var_weights
             return np.sum(
                 freq_weights
                 * (
@@ -639,6 +745,7 @@ class Gamma(Family):
 
     links = [L.log, L.identity, L.inverse_power]
     variance = V.mu_squared
+    valid = [0, np.inf]
     safe_links = [
         L.Log,
     ]
@@ -654,7 +761,7 @@ class Gamma(Family):
         """
         return np.clip(x, FLOAT_EPS, np.inf)
 
-    def deviance(self, endog, mu, freq_weights=1.0, scale=1.0):
+    def deviance(self, endog, mu, freq_weights=1.0, scale=1.0, var_weights=1.0):
         r"""
         Gamma deviance function
 
@@ -668,6 +775,8 @@ class Gamma(Family):
             1d array of frequency weights. The default is 1.
         scale : float, optional
             An optional scale argument. The default is 1.
+        var_weights : array-like
+            1d array of variance weights. The default is 1.
 
         Returns
         -------
@@ -676,9 +785,10 @@ class Gamma(Family):
 
         """
         endog_mu = self._clean(endog / mu)
-        return 2 * np.sum(freq_weights * ((endog - mu) / mu - np.log(endog_mu)))
+        weights = freq_weights * var_weights
+        return 2 * np.sum(weights * ((endog - mu) / mu - np.log(endog_mu)))
 
-    def resid_dev(self, endog, mu, scale=1.0):
+    def resid_dev(self, endog, mu, scale=1.0, var_weights=1.0):
         r"""
         Gamma deviance residuals
 
@@ -691,6 +801,8 @@ class Gamma(Family):
         scale : float, optional
             An optional argument to divide the residuals by scale. The default
             is 1.
+        var_weights : array-like
+            1d array of variance weights. The default is 1.
 
         Returns
         -------
@@ -700,10 +812,10 @@ class Gamma(Family):
         """
         endog_mu = self._clean(endog / mu)
         return np.sign(endog - mu) * np.sqrt(
-            -2 * (-(endog - mu) / mu + np.log(endog_mu))
+            -2 * var_weights * (-(endog - mu) / mu + np.log(endog_mu))
         )
 
-    def loglike(self, endog, mu, freq_weights=1.0, scale=1.0):
+    def loglike(self, endog, mu, freq_weights=1.0, scale=1.0, var_weights=1.0):
         r"""
         The log-likelihood function in terms of the fitted mean response.
 
@@ -717,6 +829,8 @@ class Gamma(Family):
             1d array of frequency weights. The default is 1.
         scale : float, optional
             The default is 1.
+        var_weights : array-like
+            1d array of variance weights. The default is 1.
 
         Returns
         -------
@@ -725,19 +839,18 @@ class Gamma(Family):
             (endog,mu,freq_weights,scale) as defined below.
 
         """
-        return (
-            -1.0
-            / scale
-            * np.sum(
-                (
-                    endog / mu
-                    + np.log(mu)
-                    + (scale - 1) * np.log(endog)
-                    + np.log(scale)
-                    + scale * special.gammaln(1.0 / scale)
-                )
-                * freq_weights
+        # the scale of each observation
+        scale = scale / var_weights
+        return -np.sum(
+            (
+                endog / mu
+                + np.log(mu)
+                + (scale - 1) * np.log(endog)
+                + np.log(scale)
+                + scale * special.gammaln(1.0 / scale)
             )
+            / scale
+            * freq_weights
         )
 
         # in Stata scale is set to equal 1 for reporting llf
@@ -785,16 +898,15 @@ class Binomial(Family):
 
     links = [L.logit, L.probit, L.cauchy, L.log, L.cloglog, L.identity]
     variance = V.binary  # this is not used below in an effort to include n
+    valid = [0, 1]
 
     # Other safe links, e.g. cloglog and probit are subclasses
     safe_links = [L.Logit, L.CDFLink]
 
     def __init__(self, link=L.logit):  # , n=1.):
-        # TODO: it *should* work for a constant n>1 actually, if freq_weights
-        # is equal to n
+        # the trials of each observation are given as var_weights, see
+        # initialize; the variance is that of the proportion (0,1)
         self.n = 1
-        # overwritten by initialize if needed but always used to initialize
-        # variance since endog is assumed/forced to be (0,1)
         self.variance = V.Binomial(n=self.n)
         self.link = link()
 
@@ -805,7 +917,7 @@ class Binomial(Family):
         """
         return (y + 0.5) / 2
 
-    def initialize(self, endog, freq_weights):
+    def initialize(self, endog, freq_weights=1.0):
         """
         Initialize the response variable.
 
@@ -813,27 +925,31 @@ class Binomial(Family):
         ----------
         endog : array
             Endogenous response variable
+        freq_weights : array-like
+            Not used; the trials are those of a single observation.
 
         Returns
         --------
-        If `endog` is binary, returns `endog`
+        If `endog` is binary, returns `endog` and ones
 
         If `endog` is a 2d array, then the input is assumed to be in the format
-        (successes, failures) and
-        successes/(success + failures) is returned.  And n is set to
-        successes + failures.
+        (successes, failures) and the n*1 arrays
+        successes/(success + failures) and successes + failures are
+        returned. The trials are the var_weights of the deviance and
+        log-likelihood, and multiply the iwls weights; the family itself is
+        not changed.
         """
-        # if not np.all(np.asarray(freq_weights) == 1):
-        #     self.variance = V.Binomial(n=freq_weights)
         if endog.ndim > 1 and endog.shape[1] > 1:
-            y = endog[:, 0]
-            # overwrite self.freq_weights for deviance below
-            self.n = endog.sum(1)
-            return y * 1.0 / self.n, self.n
+            n = endog[:, :2].sum(1, keepdims=True) * 1.0
+            if np.any(n <= 0):
+                raise ValueError("every observation needs at least one trial")
+            return endog[:, :1] / n, n
         else:
-            return endog, np.ones(endog.shape[0])
+            return endog, np.ones((endog.shape[0], 1))
 
-    def deviance(self, endog, mu, freq_weights=1, scale=1.0, axis=None):
+    def deviance(
+        self, endog, mu, freq_weights=1, scale=1.0, axis=None, var_weights=1.0
+    ):
         r"""
         Deviance function for either Bernoulli or Binomial data.
 
@@ -848,6 +964,11 @@ class Binomial(Family):
             1d array of frequency weights. The default is 1.
         scale : float, optional
             An optional scale argument. The default is 1.
+        axis : int, optional
+            The axis to sum over. The default is None, all of them.
+        var_weights : array-like
+            1d array of variance weights; the number of trials of each
+            observation. The default is 1.
 
         Returns
         --------
@@ -855,7 +976,8 @@ class Binomial(Family):
             The deviance function as defined below
 
         """
-        if np.shape(self.n) == () and self.n == 1:
+        n = self.n * var_weights
+        if np.shape(n) == () and n == 1:
             one = np.equal(endog, 1)
             return -2 * np.sum(
                 (one * np.log(mu + 1e-200) + (1 - one) * np.log(1 - mu + 1e-200))
@@ -865,7 +987,7 @@ class Binomial(Family):
 
         else:
             return 2 * np.sum(
-                self.n
+                n
                 * freq_weights
                 * (
                     endog * np.log(endog / mu + 1e-200)
@@ -874,7 +996,7 @@ class Binomial(Family):
                 axis=axis,
             )
 
-    def resid_dev(self, endog, mu, scale=1.0):
+    def resid_dev(self, endog, mu, scale=1.0, var_weights=1.0):
         r"""
         Binomial deviance residuals
 
@@ -887,6 +1009,9 @@ class Binomial(Family):
         scale : float, optional
             An optional argument to divide the residuals by scale. The default
             is 1.
+        var_weights : array-like
+            1d array of variance weights; the number of trials of each
+            observation. The default is 1.
 
         Returns
         -------
@@ -896,7 +1021,8 @@ class Binomial(Family):
         """
 
         mu = self.link._clean(mu)
-        if np.shape(self.n) == () and self.n == 1:
+        n = self.n * var_weights
+        if np.shape(n) == () and n == 1:
             one = np.equal(endog, 1)
             return (
                 np.sign(endog - mu)
@@ -908,7 +1034,7 @@ class Binomial(Family):
                 np.sign(endog - mu)
                 * np.sqrt(
                     2
-                    * self.n
+                    * n
                     * (
                         endog * np.log(endog / mu + 1e-200)
                         + (1 - endog) * np.log((1 - endog) / (1 - mu) + 1e-200)
@@ -917,7 +1043,7 @@ class Binomial(Family):
                 / scale
             )
 
-    def loglike(self, endog, mu, freq_weights=1, scale=1.0):
+    def loglike(self, endog, mu, freq_weights=1, scale=1.0, var_weights=1.0):
         r"""
         The log-likelihood function in terms of the fitted mean response.
 
@@ -931,6 +1057,9 @@ class Binomial(Family):
             1d array of frequency weights. The default is 1.
         scale : float, optional
             Not used for the Binomial GLM.
+        var_weights : array-like
+            1d array of variance weights; the number of trials of each
+            observation. The default is 1.
 
         Returns
         -------
@@ -940,19 +1069,20 @@ class Binomial(Family):
 
         """
 
-        if np.shape(self.n) == () and self.n == 1:
+        n = self.n * var_weights
+        if np.shape(n) == () and n == 1:
             return scale * np.sum(
                 (endog * np.log(mu / (1 - mu) + 1e-200) + np.log(1 - mu)) * freq_weights
             )
         else:
-            y = endog * self.n  # convert back to successes
+            y = endog * n  # convert back to successes
             return scale * np.sum(
                 (
-                    special.gammaln(self.n + 1)
+                    special.gammaln(n + 1)
                     - special.gammaln(y + 1)
-                    - special.gammaln(self.n - y + 1)
+                    - special.gammaln(n - y + 1)
                     + y * np.log(mu / (1 - mu))
-                    + self.n * np.log(1 - mu)
+                    + n * np.log(1 - mu)
                 )
                 * freq_weights
             )
@@ -989,3 +1119,201 @@ class Binomial(Family):
             (cox_snell(endog) - cox_snell(mu))
             / (mu ** (1 / 6.0) * (1 - mu) ** (1 / 6.0))
         )
+
+
+def _is_power(link, power):
+    return isinstance(link, L.Power) and link.power == power
+
+
+class IWLSKernel:
+    """
+    Fitted values, weights and working response of an iwls iteration.
+
+    The generic kernel, for any family and link; see Family.iwls_kernel for
+    the fused kernels of the canonical pairs. The offset scales the fitted
+    values of the Poisson family only, as in the iwls routine.
+
+    Parameters
+    ----------
+    family : Family
+        The family, with its link and variance function.
+    """
+
+    # the link is canonical for the variance, so that the observed and the
+    # expected information coincide
+    canonical = False
+
+    def __init__(self, family):
+        self.family = family
+        self.link = family.link
+        self.scale_offset = isinstance(family, Poisson)
+
+    def fitted(self, v, offset=None, out=None):
+        """
+        Fitted values from the linear predictor v, including the offset.
+
+        Parameters
+        ----------
+        v : array
+            The linear predictor.
+        offset : array, optional
+            The offset; multiplies the fitted values of Poisson models.
+        out : array, optional
+            Array of the same shape as `v` to write the fitted values into.
+
+        Returns
+        -------
+        mu : array
+        """
+        mu = self.family.fitted(v, out=out)
+        if self.scale_offset and offset is not None:
+            mu = np.multiply(mu, offset, out=out)
+        return mu
+
+    def working(self, y, v, mu, w=None, z=None, work=None):
+        """
+        The iwls weights and working response at mu.
+
+        Parameters
+        ----------
+        y : array
+            The response variable.
+        v : array
+            The linear predictor.
+        mu : array
+            The fitted values at v.
+        w, z : array, optional
+            Arrays of the same shape as `mu` to write the weights and the
+            working response into.
+        work : array, optional
+            Scratch array of shape (2,) + mu.shape, used with w and z so
+            that no temporaries are allocated.
+
+        Returns
+        -------
+        w : array
+            The iwls weights 1 / (g'(mu)**2 V(mu)).
+        z : array
+            The working response v + g'(mu) (y - mu).
+        """
+        if w is None or not self.family._inplace():
+            weights = self.family.weights(mu)
+            working = v + self.link.deriv(mu) * (y - mu)
+            if w is None:
+                return weights, working
+            w[...] = weights
+            z[...] = working
+            return w, z
+        work = (None, None) if work is None else work
+        self.family.weights(mu, out=w, work=work)
+        self.link.deriv(mu, out=z, work=work[0])
+        r = np.subtract(y, mu, out=work[1])
+        np.multiply(z, r, out=z)
+        np.add(v, z, out=z)
+        return w, z
+
+    def observed(self, y, v, mu):
+        """
+        Weights and weighted working response of a Newton iteration, from the
+        observed rather than the expected information.
+
+        Parameters
+        ----------
+        y : array
+            The response variable.
+        v : array
+            The linear predictor.
+        mu : array
+            The fitted values at v.
+
+        Returns
+        -------
+        w : array
+            The observed information weights
+            w_e (1 + (y - mu) (V'(mu) g'(mu) + V(mu) g''(mu)) / (V(mu) g'(mu))),
+            where w_e are the iwls weights. They equal w_e for a canonical
+            link and may be negative away from the optimum.
+        wz : array
+            w v + (y - mu) / (V(mu) g'(mu)), so that the Newton step solves
+            X'WX b = X'wz.
+        """
+        if self.canonical:
+            w, z = self.working(y, v, mu)
+            return w, w * z
+        d = self.link.deriv(mu)
+        var = self.family.variance(mu)
+        r = y - mu
+        curvature = self.family.variance.deriv(mu) * d + var * self.link.deriv2(mu)
+        w = 1.0 / (d**2 * var)
+        w_obs = w * (1.0 + r * curvature / (var * d))
+        return w_obs, w_obs * v + w * d * r
+
+
+class LogKernel(IWLSKernel):
+    """
+    Log link with the variance mu: w = mu and z = v + (y - mu) / mu, with mu
+    clipped at machine epsilon as by the link.
+    """
+
+    canonical = True
+
+    def working(self, y, v, mu, w=None, z=None, work=None):
+        c = np.maximum(mu, FLOAT_EPS, out=None if work is None else work[0])
+        # c / mu is 1 unless mu is clipped, so w is mu exactly
+        w = np.divide(c, mu, out=w)
+        np.multiply(w, c, out=w)
+        z = np.subtract(y, mu, out=z)
+        np.divide(z, c, out=z)
+        np.add(v, z, out=z)
+        return w, z
+
+
+class LogitKernel(IWLSKernel):
+    """
+    Logit link with the binomial variance: w = p (1 - p) and
+    z = v + (y - mu) / (p (1 - p)), with p = mu clipped to (eps, 1 - eps).
+    """
+
+    canonical = True
+
+    def working(self, y, v, mu, w=None, z=None, work=None):
+        out = None if work is None else work[0]
+        p = np.clip(mu, FLOAT_EPS, 1.0 - FLOAT_EPS, out=out)
+        w = np.subtract(1, p, out=w)
+        np.multiply(p, w, out=w)
+        z = np.subtract(y, mu, out=z)
+        np.divide(z, w, out=z)
+        np.add(v, z, out=z)
+        return w, z
+
+
+class IdentityKernel(IWLSKernel):
+    """
+    Identity link with constant variance: w = 1 and z = y.
+    """
+
+    canonical = True
+
+    def working(self, y, v, mu, w=None, z=None, work=None):  # noqa: ARG002
+        if w is None:
+            shape = np.shape(mu)
+            return np.ones(shape), np.broadcast_to(y, shape).astype(float)
+        w.fill(1.0)
+        z[...] = y
+        return w, z
+
+
+class InverseKernel(IWLSKernel):
+    """
+    Inverse power link with the variance mu**2: w = mu**2 and
+    z = v - (y - mu) / mu**2.
+    """
+
+    canonical = True
+
+    def working(self, y, v, mu, w=None, z=None, work=None):  # noqa: ARG002
+        w = np.square(mu, out=w)
+        z = np.subtract(y, mu, out=z)
+        np.divide(z, w, out=z)
+        np.subtract(v, z, out=z)
+        return w, z
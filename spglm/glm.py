@@ -4,16 +4,33 @@ __author__ = "Taylor Oshan tayoshan@gmail.com"
 
 import numpy as np
 import numpy.linalg as la
+from scipy import sparse as sp
 from spreg import user_output as user
 from spreg.utils import RegressionPropsY, spdot
 
 from . import family
 from .base import LikelihoodModelResults
-from .iwls import iwls
+from .design import CategoricalDesign, Design
+from .family import Binomial
+from .iwls import (
+    _fe_codes,
+    _fe_effects,
+    _n_jobs,
+    _resolve_engine,
+    initial_betas,
+    iwls,
+)
+from .optimize import METHODS, optimize_glm
+from .profiling import profiled, stage
+from .solvers import get_solver
 from .utils import cache_readonly
 
 __all__ = ["GLM"]
 
+# multiplier of the row hashes of compress; odd, so that it is invertible
+# modulo 2**64
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
 
 class GLM(RegressionPropsY):
     """
@@ -25,8 +42,13 @@ class GLM(RegressionPropsY):
     ----------
         y             : array
                         n*1, dependent variable.
-        X             : array
+        X             : array, sparse matrix or Design
                         n*k, independent variable, exlcuding the constant.
+                        A scipy.sparse design is kept sparse through
+                        estimation and diagnostics. A Design (see design.py)
+                        is used as is, constant included, and is fitted
+                        from its X'WX; see iwls. With categorical, X holds
+                        the continuous columns only and may be None.
         family        : string
                         Model type: 'Gaussian', 'Poisson', 'Binomial'
         offset        : array
@@ -36,17 +58,87 @@ class GLM(RegressionPropsY):
                         Default is None where Ni becomes 1.0 for all locations.
         y_fix         : array
                         n*1, the fix intercept value of y
+        precision     : string
+                        'double' (default) or 'single'. With 'single' X and
+                        the offset are stored in float32, halving the memory
+                        read by each iwls pass; cross-products are summed in
+                        float64 and the estimates are refined in float64, so
+                        they match a double precision fit to the stored X.
+                        Dense X only.
+        categorical   : array or list of arrays
+                        n*c array, or list of c arrays, of integer codes
+                        0, 1, ... (int8, int16, int32, ...) of the levels of
+                        c categorical variables. Each stands for dummy
+                        columns of its levels after X, with level 0 as the
+                        reference (every level of the first if constant is
+                        False), that are never formed; see
+                        design.CategoricalDesign. Default is None.
+        fixed_effects : array
+                        n*1 or n*g, integer codes of the group of each
+                        observation in each of g factors (e.g. origin and
+                        destination), whose effects are absorbed in each
+                        iwls step rather than estimated as dummy columns of
+                        X; see iwls. The constant is absorbed with them, so
+                        X should not include one. Only the slopes enter the
+                        solve and the covariance; the effects are recovered
+                        on request by GLMResults.fixed_effects. Dense X only.
+        freq_weights  : array
+                        n*1, frequency weights, the number of times each row
+                        was observed. They multiply the iwls weights, the
+                        deviance and the log-likelihood of each row, and
+                        nobs is their sum. Default is None, which counts
+                        every row once.
+        var_weights   : array
+                        n*1, variance weights; the variance of each
+                        observation is that of the family divided by its
+                        weight. For the Binomial family y may also be given
+                        as n*2 (successes, failures), whose trials are then
+                        the var_weights (times those given, if any); see
+                        family.Binomial.initialize. Default is None.
+        compress      : boolean
+                        If True, identical rows of X (with the categorical
+                        codes), the offset and the var_weights are fitted
+                        once: the rows are hashed into groups, and each
+                        group becomes one row whose y is the frequency
+                        weighted mean of the group's and whose freq_weights
+                        are their sum. For the Binomial family, the
+                        successes and trials of a group are summed instead
+                        (and the var_weights are not part of the key). The
+                        estimates and their covariance are those of the
+                        original rows, and so are the deviance, likelihood,
+                        scale and residuals of GLMResults, which expands
+                        the fitted values back to the original rows when
+                        first asked for. For many repeated covariate
+                        patterns, e.g. categorical only designs. Dense X
+                        only, without fixed_effects. Default is False.
 
     Attributes
     ----------
         y             : array
-                        n*1, dependent variable.
+                        n*1, dependent variable; the proportion of successes
+                        for n*2 Binomial y
         X             : array
                         n*k, independent variable, including constant.
         family        : string
                         Model type: 'Gaussian', 'Poisson', 'logistic'
         n             : integer
-                        Number of observations
+                        Number of rows; of unique rows if compressed
+        nobs          : float
+                        Number of observations, the sum of the freq_weights
+                        of the original rows (n without them)
+        freq_weights  : array
+                        n*1, frequency weights of the rows; None if there
+                        are none
+        var_weights   : array
+                        n*1, variance weights of the rows, including the
+                        Binomial trials; None if there are none
+        inverse       : array
+                        the row of each original observation of a
+                        compressed model; None if not compressed
+        observed      : tuple
+                        (y, freq_weights, var_weights) of the original
+                        observations of a compressed model; None if not
+                        compressed
         k             : integer
                         Number of independent variables
         df_model      : float
@@ -58,6 +150,17 @@ class GLM(RegressionPropsY):
                         Mean of y
         std_y         : float
                         Standard deviation of y
+        precision     : string
+                        'double' or 'single', the storage precision of X
+        fixed_effects : array
+                        n*g, the fixed effects codes renumbered 0, 1, ...;
+                        None if there are none
+        fe_levels     : list
+                        the original codes of the levels of each factor
+        k_fe          : integer
+                        number of absorbed effects that are identified, i.e.
+                        the levels of all factors less one for each factor
+                        after the first
         fit_params     : dict
                         Parameters passed into fit method to define estimation
                         routine.
@@ -89,30 +192,130 @@ class GLM(RegressionPropsY):
         offset=None,
         y_fix=None,
         constant=True,
+        precision="double",
+        fixed_effects=None,
+        categorical=None,
+        freq_weights=None,
+        var_weights=None,
+        compress=False,
     ):
         """
         Initialize class
         """
-        self.n = user.check_arrays(y, X)
-        user.check_y(y, self.n)
+        if precision not in ("double", "single"):
+            raise ValueError(
+                f"precision should be 'double' or 'single'. (got {precision})"
+            )
+        structured = isinstance(X, Design) or categorical is not None
+        if sp.issparse(X) or structured:
+            if precision == "single":
+                raise ValueError("precision='single' requires a dense X")
+            if fixed_effects is not None:
+                raise ValueError("fixed_effects require a dense X")
+        if compress and (sp.issparse(X) or isinstance(X, Design)):
+            raise ValueError("compress requires a dense X")
+        if compress and fixed_effects is not None:
+            raise ValueError("compress does not apply with fixed_effects")
+        trials = None
+        if isinstance(family, Binomial) and np.ndim(y) == 2 and np.shape(y)[1] == 2:
+            # (successes, failures): y is the proportion of successes
+            y, trials = family.initialize(np.asarray(y, dtype=np.float64))
+        if sp.issparse(X):
+            X = sp.csr_matrix(X)
+        if categorical is not None and X is None:
+            X = np.empty((len(y), 0))
+        with stage("check_arrays"):
+            if isinstance(X, Design):
+                self.n = X.shape[0]
+            else:
+                self.n = user.check_arrays(y, X)
+            user.check_y(y, self.n)
+        freq_weights = _prior_weights(freq_weights, self.n, "freq_weights")
+        var_weights = _prior_weights(var_weights, self.n, "var_weights")
+        if trials is not None:
+            var_weights = trials if var_weights is None else var_weights * trials
+        self.nobs = self.n if freq_weights is None else freq_weights.sum()
+        self.inverse = self.observed = None
+        if compress:
+            with stage("compress"):
+                codes = []
+                if categorical is not None:
+                    codes = categorical
+                    if isinstance(codes, np.ndarray):
+                        codes = list(codes.reshape((self.n, -1)).T)
+                    codes = [np.asarray(c).reshape(-1) for c in codes]
+                X = np.asarray(X)
+                key = list(X.reshape((self.n, -1)).T) + codes
+                binomial = isinstance(family, Binomial)
+                for a in (offset, None if binomial else var_weights):
+                    if a is not None:
+                        key.append(np.asarray(a).reshape(-1))
+                index, self.inverse = _row_groups(key, self.n)
+                self.observed = (y, freq_weights, var_weights)
+                y, freq_weights, var_weights = _aggregate(
+                    y, self.inverse, index, freq_weights, var_weights, binomial
+                )
+                X = X[index]
+                if categorical is not None:
+                    categorical = [c[index] for c in codes]
+                if offset is not None:
+                    offset = np.asarray(offset)[index]
+                if y_fix is not None:
+                    y_fix = y_fix[index]
+                self.n = len(index)
         self.y = y
-        if constant:
-            self.X, _, _ = user.check_constant(X)
+        self.freq_weights = freq_weights
+        self.var_weights = var_weights
+        if fixed_effects is not None:
+            self.fixed_effects, self.fe_levels = _fe_codes(fixed_effects, self.n)
+            self.k_fe = sum(len(level) for level in self.fe_levels) - (
+                len(self.fe_levels) - 1
+            )
+        else:
+            self.fixed_effects = self.fe_levels = None
+            self.k_fe = 0
+        if constant and fixed_effects is None and not isinstance(X, Design):
+            with stage("check_constant"):
+                self.X, _, _ = user.check_constant(X)
         else:
             self.X = X
+        if categorical is not None:
+            self.X = CategoricalDesign(self.X, categorical, full_first=not constant)
         self.family = family
         self.k = self.X.shape[1]
+        self.precision = precision
+        dtype = np.float32 if precision == "single" else np.float64
+        if precision == "single":
+            self.X = np.asarray(self.X).astype(dtype, copy=False)
         if offset is None:
-            self.offset = np.ones(shape=(self.n, 1))
+            self.offset = np.ones(shape=(self.n, 1), dtype=dtype)
         else:
-            self.offset = offset * 1.0
+            self.offset = np.asarray(offset).astype(dtype)
         if y_fix is None:
             self.y_fix = np.zeros(shape=(self.n, 1))
         else:
             self.y_fix = y_fix
         self.fit_params = {}
 
-    def fit(self, ini_betas=None, tol=1.0e-6, max_iter=200, solve="iwls"):
+    @profiled("fit")
+    def fit(
+        self,
+        ini_betas=None,
+        tol=1.0e-6,
+        max_iter=200,
+        solve="iwls",
+        solver="cholesky",
+        n_jobs=1,
+        block_size=None,
+        engine="numpy",
+        criterion="min_diff",
+        information="expected",
+        step_halving=False,
+        init=None,
+        frac=0.1,
+        callback=None,
+        trace=False,
+    ):
         """
         Method that fits a model with a particular estimation routine.
 
@@ -131,12 +334,167 @@ class GLM(RegressionPropsY):
         solve         :string
                        Technique to solve MLE equations.
                        'iwls' = iteratively (re)weighted least squares (default)
+                       'lbfgs' = limited memory BFGS on the deviance
+                       'trust-ncg' = Newton-CG trust-region on the deviance,
+                       with Hessian-vector products
+                       The last two never form the k*k X'WX, for designs
+                       with many columns; they stop on the 'gradient'
+                       criterion and ignore solver, n_jobs, block_size,
+                       engine, criterion, information and step_halving.
+                       The covariance is computed when first asked for.
+        solver        : string
+                        Linear solver used at each iwls step; see solvers.py.
+                        'cholesky' = Cholesky factorization of X'WX (default)
+                        'splu' = sparse LU of X'WX, for sparse X with many
+                        columns
+                        'schur' = sparse (or diagonal) factorization of the
+                        block of the sparse columns of X and dense Cholesky
+                        of its Schur complement, for a few dense columns
+                        next to many sparse (e.g. indicator) ones
+                        'qr' = column pivoted QR of the weighted design
+                        'svd' = singular value decomposition (least squares)
+                        'lsmr' = warm started, inexact LSMR iterations on the
+                        weighted design, for large sparse X with many columns
+                        'sketch' = LSQR to full precision, preconditioned
+                        from a random sketch of the weighted design, for
+                        n >> k
+        n_jobs        : integer
+                        Number of threads for the iwls pass over the data;
+                        -1 uses all cores. Dense X only.
+        block_size    : integer
+                        Rows per block of the fused iwls pass; see iwls.
+                        Default is None, which uses cache sized blocks when
+                        n_jobs is not 1 and the unblocked routine otherwise.
+        engine        : string
+                        'numpy' (default) or 'numba', which runs the iwls
+                        iterations as a compiled loop; worthwhile for many
+                        small fits. Falls back to 'numpy' if Numba is not
+                        installed, the family is not a built-in one or the
+                        fit cannot run compiled (see iwls); the engine used
+                        is recorded in fit_params['engine'].
+        criterion     : string
+                        Convergence criterion compared with tol; see iwls.
+                        'min_diff' = smallest absolute change of a coefficient
+                        (default)
+                        'max_diff' = largest absolute change of a coefficient
+                        'rel_diff' = largest change of a coefficient relative
+                        to max(|beta|, 1)
+                        'deviance' = relative change of the deviance, as in
+                        R's glm
+                        'gradient' = largest entry of the score divided by n
+                        Its final value, whether it met tol and the number of
+                        iterations are recorded in fit_params['conv_value'],
+                        fit_params['converged'] and fit_params['n_iter'].
+        information   : string
+                        'expected' (default) for Fisher scoring or 'observed'
+                        for full Newton steps from the observed information,
+                        which converge quadratically for non-canonical links
+                        (e.g. Gamma/log, Binomial/probit). The covariance of
+                        the estimates then uses the observed information.
+        step_halving  : boolean
+                        If True, steps that leave the valid range of mu or
+                        increase the deviance are halved; the number of
+                        halvings is recorded in fit_params['n_halving'].
+                        Default is False.
+        init          : string
+                        Starting values from a cheap first stage, in place of
+                        ini_betas; see iwls.initial_betas.
+                        None = start from starting_mu(y) (default)
+                        'subsample' = fit on a random subsample of about
+                        frac * n rows, stratified on y
+                        'link' = least squares regression of link(y) on X
+                        For 'subsample' the iterations of the subsample fit
+                        are recorded in fit_params['n_iter_init'], and those
+                        less the iterations of the full fit in
+                        fit_params['n_iter_diff']. The subsample fit starts
+                        from the default starting values, so the difference
+                        hints at the full data iterations saved, but it is
+                        not a count of them and can be negative; it is None
+                        unless solve='iwls' and the subsample fit succeeded.
+                        A subsample fit that fails falls back to the default
+                        starting values.
+        frac          : float
+                        Fraction of the rows in the subsample of
+                        init='subsample'. Default is 0.1.
+        callback      : callable
+                        Called after every iteration as
+                        callback(record, betas), with the iteration's trace
+                        record as a dict and the new betas; returning True
+                        stops the fit, which sets fit_params['stopped'].
+        trace         : boolean
+                        If True, results.trace holds a structured array with
+                        one row per iteration: 'iteration', 'deviance',
+                        'change' (largest absolute change of a coefficient),
+                        'step' (fraction of the full step taken), 'conv_value'
+                        (the criterion), 'time' (wall seconds) and 'solver';
+                        see iwls. Default is False.
         """
         self.fit_params["ini_betas"] = ini_betas
         self.fit_params["tol"] = tol
         self.fit_params["max_iter"] = max_iter
         self.fit_params["solve"] = solve
+        self.fit_params["solver"] = solver
+        self.fit_params["n_jobs"] = n_jobs
+        self.fit_params["block_size"] = block_size
+        self.fit_params["criterion"] = criterion
+        self.fit_params["information"] = information
+        self.fit_params["step_halving"] = step_halving
+        self.fit_params["init"] = init
+        self.fit_params["frac"] = frac
+        n_iter_init = None
+        absorbed = self.fixed_effects is not None
+        weights = None
+        for prior in (self.freq_weights, self.var_weights):
+            if prior is not None:
+                weights = prior if weights is None else weights * prior
+        weighted = weights is not None
+        if weighted and solve.lower() != "iwls":
+            raise ValueError("weighted and compressed models are fitted by iwls only")
+        if absorbed and (init is not None or ini_betas is not None):
+            raise ValueError("ini_betas and init do not apply with fixed_effects")
+        if absorbed and solve.lower() != "iwls":
+            raise ValueError("fixed_effects are absorbed by solve='iwls' only")
+        if isinstance(self.X, Design) and (init is not None or solve.lower() != "iwls"):
+            raise ValueError("a structured design is fitted by solve='iwls' only")
+        if init is not None:
+            if ini_betas is not None:
+                raise ValueError("ini_betas and init cannot both be given")
+            with stage("init"):
+                ini_betas, n_iter_init = initial_betas(
+                    self.y,
+                    self.X,
+                    self.family,
+                    self.offset,
+                    init,
+                    frac,
+                    tol,
+                    max_iter,
+                    solver,
+                )
+        self.fit_params["n_iter_init"] = n_iter_init
         if solve.lower() == "iwls":
+            solver = get_solver(solver)
+            safeguarded = information == "observed" or step_halving
+            monitored = trace or callback is not None
+            blocked = (
+                block_size is not None
+                or _n_jobs(n_jobs) > 1
+                or self.precision == "single"
+            )
+            engine = _resolve_engine(
+                engine,
+                self.family,
+                self.X,
+                solver,
+                criterion,
+                safeguarded,
+                monitored,
+                absorbed,
+                weighted,
+                blocked,
+            )
+            self.fit_params["engine"] = engine
+            info = {}
             params, predy, w, n_iter = iwls(
                 self.y,
                 self.X,
@@ -146,17 +504,162 @@ class GLM(RegressionPropsY):
                 ini_betas,
                 tol,
                 max_iter,
+                solver=solver,
+                block_size=block_size,
+                n_jobs=n_jobs,
+                precision=self.precision,
+                engine=engine,
+                criterion=criterion,
+                info=info,
+                information=information,
+                step_halving=step_halving,
+                callback=callback,
+                trace=trace,
+                fixed_effects=self.fixed_effects,
+                weights=weights,
             )
             self.fit_params["n_iter"] = n_iter
-        return GLMResults(self, params.flatten(), predy, w)
+            self.fit_params["conv_value"] = info["value"]
+            self.fit_params["converged"] = info["converged"]
+            self.fit_params["n_halving"] = info.get("n_halving", 0)
+        elif solve.lower() in METHODS:
+            self.fit_params["criterion"] = "gradient"
+            info = {}
+            params, predy, w, n_iter = optimize_glm(
+                self.y,
+                self.X,
+                self.family,
+                self.offset,
+                ini_betas,
+                tol,
+                max_iter,
+                method=solve.lower(),
+                info=info,
+                callback=callback,
+                trace=trace,
+            )
+            solver = None
+            self.fit_params["n_iter"] = n_iter
+            self.fit_params["conv_value"] = info["value"]
+            self.fit_params["converged"] = info["converged"]
+        else:
+            raise ValueError(
+                f"solve should be 'iwls', 'lbfgs' or 'trust-ncg'. (got {solve})"
+            )
+        n_iter_diff = None
+        # the iterations of another solve are not comparable to iwls ones
+        if init == "subsample" and solve.lower() == "iwls" and ini_betas is not None:
+            n_iter_diff = n_iter_init - n_iter
+        self.fit_params["n_iter_diff"] = n_iter_diff
+        self.fit_params["stopped"] = info.get("stopped", False)
+        return GLMResults(
+            self,
+            params.flatten(),
+            predy,
+            w,
+            solver=solver,
+            trace=info.get("trace"),
+            absorbed=info.get("absorbed"),
+        )
 
     @cache_readonly
     def df_model(self):
-        return self.X.shape[1] - 1
+        return self.X.shape[1] + self.k_fe - 1
 
     @cache_readonly
     def df_resid(self):
-        return self.n - self.df_model - 1
+        return self.nobs - self.df_model - 1
+
+
+def _prior_weights(weights, n, name):
+    """
+    The n*1 array of the freq_weights or var_weights of GLM; None if there
+    are none.
+    """
+    if weights is None:
+        return None
+    weights = np.asarray(weights, dtype=np.float64).reshape((-1, 1))
+    if weights.shape[0] != n:
+        raise ValueError(f"{name} should have one entry per observation")
+    if not np.all(np.isfinite(weights)) or np.any(weights < 0):
+        raise ValueError(f"{name} should be finite and non-negative")
+    return weights
+
+
+def _row_groups(columns, n):
+    """
+    Groups of identical rows of the columns, for GLM(compress=True).
+
+    Each row is hashed from the bits of its values, one column at a time,
+    and the rows are grouped by sorting the n 64-bit hashes rather than the
+    rows themselves. The groups are checked against the columns; should two
+    different rows share a hash, the rows are grouped by an exact sort.
+
+    Parameters
+    ----------
+    columns     : list
+                  length n arrays, e.g. the columns of X and the offset
+    n           : integer
+                  number of rows
+
+    Returns
+    -------
+    index       : array
+                  the first row of each group, in the order of the rows
+    inverse     : array
+                  n, the group of each row
+    """
+    # + 0.0 gives -0.0 the bits of 0.0
+    columns = [np.asarray(c, dtype=np.float64) + 0.0 for c in columns]
+    hashes = np.zeros(n, dtype=np.uint64)
+    for c in columns:
+        hashes ^= c.view(np.uint64)
+        hashes *= _HASH_MULTIPLIER
+        hashes ^= hashes >> np.uint64(32)
+    _, index, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    first = index[inverse.reshape(-1)]
+    if not all(np.array_equal(c, c[first]) for c in columns):
+        rows = np.column_stack(columns) if columns else np.zeros((n, 1))
+        _, index, inverse = np.unique(
+            rows, axis=0, return_index=True, return_inverse=True
+        )
+    # number the groups in the order of their first row
+    order = np.argsort(index)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return index[order], rank[inverse.reshape(-1)]
+
+
+def _aggregate(y, inverse, index, freq_weights, var_weights, binomial):
+    """
+    The y, freq_weights and var_weights of the groups of rows of
+    _row_groups, whose rows share their mean.
+
+    A group's y is the frequency weighted mean of its rows', and its
+    freq_weights their sum; its rows share their var_weights. For the
+    Binomial family the trials (freq_weights times var_weights) and the
+    successes of a group are summed, and its y is their ratio, with the
+    trials as var_weights.
+    """
+    m = len(index)
+    y = np.asarray(y, dtype=np.float64).reshape(-1)
+    counts = np.ones(len(y)) if freq_weights is None else freq_weights.reshape(-1)
+    if binomial:
+        if var_weights is not None:
+            counts = counts * var_weights.reshape(-1)
+        var_weights, freq_weights = np.bincount(inverse, counts, m), None
+        total = var_weights
+    else:
+        freq_weights = total = np.bincount(inverse, counts, m)
+        if var_weights is not None:
+            var_weights = var_weights[index].reshape(-1)
+    # groups of zero weight keep the y of their first row
+    y = np.divide(
+        np.bincount(inverse, counts * y, m), total, out=y[index], where=total > 0
+    )
+    freq_weights = None if freq_weights is None else freq_weights.reshape((-1, 1))
+    var_weights = None if var_weights is None else var_weights.reshape((-1, 1))
+    return y.reshape((-1, 1)), freq_weights, var_weights
 
 
 class GLMResults(LikelihoodModelResults):
@@ -173,6 +676,16 @@ class GLMResults(LikelihoodModelResults):
                         n*1, predicted y values.
         w             : array
                         n*1, final weight used for iwls
+        solver        : Solver
+                        solver holding the factorization of the final iwls
+                        step; used to compute normalized_cov_params. Default
+                        is None, which inverts w'w.
+        trace         : array
+                        per-iteration records of the fit; see GLM.fit.
+                        Default is None.
+        absorbed      : array
+                        n*1, the sum of the absorbed fixed effects of each
+                        observation; see GLM. Default is None.
 
     Attributes
     ----------
@@ -186,14 +699,16 @@ class GLMResults(LikelihoodModelResults):
         family        : string
                         Model type: 'Gaussian', 'Poisson', 'Logistic'
         n             : integer
-                        Number of observations
+                        Number of rows of the model
+        nobs          : float
+                        Number of observations; see GLM
         k             : integer
                         Number of independent variables
         df_model      : float
                         k-1, where k is the number of variables (including
                         intercept)
         df_residual   : float
-                        observations minus variables (n-k)
+                        observations minus variables (nobs-k)
         fit_params    : dict
                         parameters passed into fit method to define estimation
                         routine.
@@ -238,11 +753,19 @@ class GLMResults(LikelihoodModelResults):
                         McFadden's pseudo R2  (coefficient of determination)
         adj_pseudoR2  : float
                         adjusted McFadden's pseudo R2
-        tr_S          : trace of the hat matrix S
+        tr_S          : trace of the hat matrix S; the numerical rank of X
+                        (columns aliased by the solver do not count) plus the
+                        absorbed fixed effects
         resid_response          : array
-                                  response residuals; defined as y-mu
+                                  response residuals; defined as y-mu. The
+                                  residuals and the statistics above are
+                                  of the observations, weighted by their
+                                  freq_weights and var_weights; for a
+                                  compressed model, of its original rows,
+                                  to which mu is expanded (see expand)
         resid_pearson : array
-                        Pearson residuals; defined as (y-mu)/sqrt(VAR(mu))
+                        Pearson residuals; defined as
+                        (y-mu)/sqrt(VAR(mu)/var_weights)
                         where VAR is the distribution specific variance
                         function; see family.py and varfuncs.py for more information.
         resid_working  : array
@@ -265,6 +788,17 @@ class GLMResults(LikelihoodModelResults):
         normalized_cov_params   : array
                                 k*k, approximates [X.T*X]-1
 
+        trace          : array
+                         structured array of per-iteration records if the
+                         fit was traced, None otherwise
+
+        fixed_effects  : list
+                         for each factor of the absorbed fixed effects, the
+                         effects of its levels (in the order of
+                         model.fe_levels); with more than one factor those of
+                         every factor but the first average zero over the
+                         observations. None without fixed effects
+
     Examples
     --------
     >>> import libpysal
@@ -291,7 +825,9 @@ class GLMResults(LikelihoodModelResults):
 
     """
 
-    def __init__(self, model, params, mu, w):
+    trace = None
+
+    def __init__(self, model, params, mu, w, solver=None, trace=None, absorbed=None):
         self.model = model
         self.n = model.n
         self.y = model.y.T.flatten()
@@ -302,9 +838,23 @@ class GLMResults(LikelihoodModelResults):
         self.fit_params = model.fit_params
         self.params = params
         self.w = w
+        self.solver = solver
+        self.trace = trace
+        self.absorbed = absorbed
         self.mu = mu.flatten()
+        self.nobs = getattr(model, "nobs", model.n)
         self._cache = {}
 
+    def expand(self, values):
+        """
+        Values of the rows of a compressed model (see GLM), e.g. mu, at its
+        original observations; other values are returned unchanged.
+        """
+        inverse = getattr(self.model, "inverse", None)
+        if inverse is None:
+            return values
+        return np.asarray(values)[inverse]
+
     @cache_readonly
     def df_model(self):
         return self.model.df_model
@@ -313,42 +863,79 @@ class GLMResults(LikelihoodModelResults):
     def df_resid(self):
         return self.model.df_resid
 
+    @cache_readonly
+    def fixed_effects(self):
+        if self.absorbed is None:
+            return None
+        return _fe_effects(self.absorbed, self.model.fixed_effects)
+
     @cache_readonly
     def normalized_cov_params(self):
+        if self.solver is not None:
+            return self.solver.inv()
         return la.inv(spdot(self.w.T, self.w))
 
+    @cache_readonly
+    def _observed(self):
+        # y, mu and the freq and var weights (1.0 if none) of the
+        # observations; a compressed model's are of its original rows
+        model = self.model
+        y, mu = self.y, self.mu
+        fw = getattr(model, "freq_weights", None)
+        vw = getattr(model, "var_weights", None)
+        if getattr(model, "inverse", None) is not None:
+            y, fw, vw = model.observed
+            y, mu = y.reshape(-1), self.expand(mu)
+        fw = 1.0 if fw is None else fw.reshape(-1)
+        vw = 1.0 if vw is None else vw.reshape(-1)
+        return y, mu, fw, vw
+
     @cache_readonly
     def resid_response(self):
-        return self.y - self.mu
+        y, mu, _, _ = self._observed
+        return y - mu
 
     @cache_readonly
     def resid_pearson(self):
-        return (self.y - self.mu) / np.sqrt(self.family.variance(self.mu))
+        y, mu, _, vw = self._observed
+        return (y - mu) / np.sqrt(self.family.variance(mu) / vw)
 
     @cache_readonly
     def resid_working(self):
-        return self.resid_response / self.family.link.deriv(self.mu)
+        mu = self._observed[1]
+        return self.resid_response / self.family.link.deriv(mu)
 
     @cache_readonly
     def resid_anscombe(self):
-        return self.family.resid_anscombe(self.y, self.mu)
+        y, mu, _, vw = self._observed
+        return self.family.resid_anscombe(y, mu) * np.sqrt(vw)
 
     @cache_readonly
     def resid_deviance(self):
-        return self.family.resid_dev(self.y, self.mu)
+        y, mu, _, vw = self._observed
+        return self.family.resid_dev(y, mu, var_weights=vw)
 
     @cache_readonly
     def pearson_chi2(self):
-        chisq = (self.y - self.mu) ** 2 / self.family.variance(self.mu)
+        y, mu, fw, vw = self._observed
+        chisq = fw * vw * (y - mu) ** 2 / self.family.variance(mu)
         chisqsum = np.sum(chisq)
         return chisqsum
 
     @cache_readonly
     def null(self):
+        # fitted on the rows of the model, like mu
         y = np.reshape(self.y, (-1, 1))
-        model = self.model  # noqa: F841 - `model` never used
         X = np.ones((len(y), 1))
-        null_mod = GLM(y, X, family=self.family, offset=self.offset, constant=False)
+        null_mod = GLM(
+            y,
+            X,
+            family=self.family,
+            offset=self.offset,
+            constant=False,
+            freq_weights=getattr(self.model, "freq_weights", None),
+            var_weights=getattr(self.model, "var_weights", None),
+        )
         return null_mod.fit().mu
 
     @cache_readonly
@@ -356,25 +943,28 @@ class GLMResults(LikelihoodModelResults):
         if isinstance(self.family, (family.Binomial, family.Poisson)):
             return 1.0
         else:
-            return (
-                np.power(self.resid_response, 2) / self.family.variance(self.mu)
-            ).sum() / (self.df_resid)
+            return self.pearson_chi2 / (self.df_resid)
 
     @cache_readonly
     def deviance(self):
-        return self.family.deviance(self.y, self.mu)
+        y, mu, fw, vw = self._observed
+        return self.family.deviance(y, mu, fw, var_weights=vw)
 
     @cache_readonly
     def null_deviance(self):
-        return self.family.deviance(self.y, self.null)
+        y, _, fw, vw = self._observed
+        return self.family.deviance(y, self.expand(self.null), fw, var_weights=vw)
 
     @cache_readonly
     def llnull(self):
-        return self.family.loglike(self.y, self.null, scale=self.scale)
+        y, _, fw, vw = self._observed
+        null = self.expand(self.null)
+        return self.family.loglike(y, null, fw, scale=self.scale, var_weights=vw)
 
     @cache_readonly
     def llf(self):
-        return self.family.loglike(self.y, self.mu, scale=self.scale)
+        y, mu, fw, vw = self._observed
+        return self.family.loglike(y, mu, fw, scale=self.scale, var_weights=vw)
 
     @cache_readonly
     def aic(self):
@@ -385,7 +975,7 @@ class GLMResults(LikelihoodModelResults):
 
     @cache_readonly
     def bic(self):
-        return self.deviance - (self.model.n - self.df_model - 1) * np.log(self.model.n)
+        return self.deviance - self.df_resid * np.log(self.nobs)
 
     @cache_readonly
     def D2(self):
@@ -393,7 +983,7 @@ class GLMResults(LikelihoodModelResults):
 
     @cache_readonly
     def adj_D2(self):
-        return 1.0 - (float(self.n) - 1.0) / (float(self.n) - float(self.k)) * (
+        return 1.0 - (float(self.nobs) - 1.0) / (float(self.nobs) - float(self.k)) * (
             1.0 - self.D2
         )
 
@@ -407,7 +997,7 @@ class GLMResults(LikelihoodModelResults):
 
     @cache_readonly
     def tr_S(self):
-        xtx_inv = np.linalg.inv(np.dot(self.X.T, self.X))
-        xtx_inv_xt = np.dot(xtx_inv, self.X.T)
-        S = np.dot(self.X, xtx_inv_xt)
-        return np.trace(S)
+        # tr(X [X'X]^-1 X') = tr([X'X]^-1 X'X) = rank(X), k unless the solver
+        # aliased columns, plus the absorbed levels
+        rank = None if self.solver is None else self.solver.rank()
+        return (self.k if rank is None else rank) + self.model.k_fe
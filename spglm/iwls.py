@@ -1,44 +1,1152 @@
+import contextlib
+import copy
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-import numpy.linalg as la
 from scipy import linalg
 from scipy import sparse as sp
-from spreg.utils import spdot, spmultiply
+from scipy.sparse.linalg import lsqr
+from spreg.utils import spdot
+
+from . import _numba
+from .design import Design
+from .family import Binomial, Family, Poisson, QuasiPoisson
+from .profiling import profiled, stage
+from .solvers import Solver, get_solver
+from .utils import hilbert_order
 
-from .family import Binomial, Poisson
+CRITERIA = ("min_diff", "max_diff", "rel_diff", "deviance", "gradient")
+INITS = ("subsample", "link")
+# fewest rows of a subsample per column of x, and per stratum of y
+SUBSAMPLE_ROWS = 10
+# a row of the per-iteration trace; see _Monitor
+TRACE_DTYPE = np.dtype(
+    [
+        ("iteration", np.int32),
+        ("deviance", np.float64),
+        ("change", np.float64),
+        ("step", np.float64),
+        ("conv_value", np.float64),
+        ("time", np.float64),
+        ("solver", "U16"),
+    ]
+)
+# halvings of a step before a safeguarded fit gives up
+MAX_HALVING = 30
+# relative tolerance and most sweeps of the alternating projections that
+# absorb fixed effects
+FE_TOL = 1e-10
+FE_MAX_ITER = 10000
 
 
-def _compute_betas(y, x):
+class Workspace:
+    """
+    Preallocated arrays for the iwls routine.
+
+    iwls writes the linear predictor, fitted values, weights and working
+    response of every iteration into these arrays instead of allocating new
+    ones, and the family, link and variance functions evaluate into them
+    through their `out` arguments. A workspace can be passed to many fits of
+    the same size (e.g. the local models of a GWR), so that their iterations
+    allocate nothing of size n.
+
+    Parameters
+    ----------
+    n           : integer
+                  number of observations
+    k           : integer
+                  number of columns of the design matrix
+
+    Attributes
+    ----------
+    v           : array
+                  n*1, linear predictor
+    mu          : array
+                  n*1, fitted values
+    w           : array
+                  n*1, (square root of the) iwls weights
+    z           : array
+                  n*1, working response
+    wz          : array
+                  n*1, weighted working response
+    wx          : array
+                  n*k, weighted design matrix
+    xwi         : array
+                  n*k, weighted design matrix times the GWR kernel weights
+    work        : array
+                  2*n*1, scratch for the family functions
+    """
+
+    def __init__(self, n, k):
+        self.n = n
+        self.k = k
+        self.v = np.empty((n, 1))
+        self.mu = np.empty((n, 1))
+        self.w = np.empty((n, 1))
+        self.z = np.empty((n, 1))
+        self.wz = np.empty((n, 1))
+        self.wx = np.empty((n, k))
+        self.xwi = np.empty((n, k))
+        self.work = np.empty((2, n, 1))
+
+    def check(self, n, k):
+        if (self.n, self.k) != (n, k):
+            raise ValueError(
+                f"workspace is for n={self.n}, k={self.k}; got n={n}, k={k}"
+            )
+
+
+def _check_criterion(criterion):
+    if criterion not in CRITERIA:
+        raise ValueError(
+            f"criterion should be one of {', '.join(CRITERIA)}. (got {criterion})"
+        )
+
+
+def _conv_value(
+    criterion, betas, n_betas, deviance=None, old_deviance=None, score=None, n=1
+):
+    """
+    Value of the convergence criterion after an iteration; iwls stops once it
+    is at most tol.
+
+    'min_diff'  : smallest absolute change of a coefficient
+    'max_diff'  : largest absolute change of a coefficient
+    'rel_diff'  : largest change of a coefficient relative to max(|beta|, 1)
+    'deviance'  : relative change of the deviance, |D - D_old| / (|D| + 0.1),
+                  as in R's glm
+    'gradient'  : largest entry of the score X'W(z - v) / n at the betas
+                  entering the iteration
+
+    Returns inf while a quantity is not available yet: the previous deviance
+    on the first iteration, and the score before the linear predictor is X
+    times the betas.
+    """
+    if criterion == "deviance":
+        if old_deviance is None:
+            return np.inf
+        return abs(deviance - old_deviance) / (abs(deviance) + 0.1)
+    if criterion == "gradient":
+        if score is None:
+            return np.inf
+        return np.max(np.abs(score)) / n
+    change = np.abs(n_betas - (0.0 if betas is None else betas))
+    if criterion == "min_diff":
+        return change.min()
+    if criterion == "max_diff":
+        return change.max()
+    return (change / np.maximum(np.abs(n_betas), 1.0)).max()
+
+
+def _record(info, criterion, value, tol):
+    """
+    Fill the info dict of an iwls fit with its convergence criterion.
+    """
+    if info is not None:
+        info["criterion"] = criterion
+        info["value"] = float(np.squeeze(value))
+        info["converged"] = bool(value <= tol)
+
+
+def _deviance(family, y, mu, weights=1.0):
+    """
+    The deviance monitored by the convergence criterion and step halving.
+
+    The Poisson deviance of family.py leaves out the sum of y - mu, which is
+    zero at a log link fit with an intercept but not along the iterations or
+    for other links; it is added back here so that the deviance is the one
+    Fisher scoring decreases. The weights, prior weights of a GLM or the
+    kernel of a local fit, scale the deviance of each observation as
+    var_weights do.
+    """
+    deviance = family.deviance(y, mu, var_weights=weights)
+    if isinstance(family, (Poisson, QuasiPoisson)):
+        deviance -= 2 * np.sum(weights * (y - mu))
+    return deviance
+
+
+class _Monitor:
+    """
+    Per-iteration records of a fit, and the user callback.
+
+    Each iteration gives a row of TRACE_DTYPE: the iteration number, the
+    deviance at the new betas (see _deviance), the largest absolute change
+    of a coefficient (NaN on a cold first iteration), the fraction of the
+    full step taken (below 1 after step halving), the value of the
+    convergence criterion, the wall time of the iteration in seconds and the
+    solver. The rows are kept if trace is True, and the callback is called
+    with the row as a dict and the new betas; the fit stops after the
+    iteration if it returns True.
+    """
+
+    def __init__(self, trace, callback, solver, family, y, weights=1.0):
+        self.trace = trace
+        self.callback = callback
+        self.solver = solver
+        self.family = family
+        self.y = y
+        self.weights = weights
+        self.rows = []
+        self.stopped = False
+        self._clock = time.perf_counter()
+
+    def __call__(self, n_iter, betas, n_betas, diff, deviance=None, mu=None, step=1.0):
+        if deviance is None and mu is not None:
+            deviance = _deviance(self.family, self.y, mu, self.weights)
+        change = np.nan if betas is None else np.max(np.abs(n_betas - betas))
+        now = time.perf_counter()
+        row = (
+            n_iter,
+            np.nan if deviance is None else float(deviance),
+            float(change),
+            float(step),
+            float(np.squeeze(diff)),
+            now - self._clock,
+            self.solver,
+        )
+        if self.trace:
+            self.rows.append(row)
+        if self.callback is not None:
+            self.stopped = bool(
+                self.callback(dict(zip(TRACE_DTYPE.names, row)), n_betas)
+            )
+        # the callback's own time is not charged to the next iteration
+        self._clock = time.perf_counter()
+        return self.stopped
+
+    def record(self, info):
+        """
+        Add the trace and whether the callback stopped the fit to info.
+        """
+        if info is not None:
+            info["stopped"] = self.stopped
+            if self.trace:
+                info["trace"] = np.array(self.rows, dtype=TRACE_DTYPE)
+
+
+def _monitor(trace, callback, solver, family, y, weights=1.0):
+    """
+    A _Monitor for the fit, or None if neither a trace nor a callback is
+    asked for.
+    """
+    if not trace and callback is None:
+        return None
+    name = solver if isinstance(solver, str) else solver.name
+    return _Monitor(trace, callback, name, family, y, weights)
+
+
+def _compute_betas(y, x, solver=None):
     """
     compute MLE coefficients using iwls routine
 
     Methods: p189, Iteratively (Re)weighted Least Squares (IWLS),
     Fotheringham, A. S., Brunsdon, C., & Charlton, M. (2002).
     Geographically weighted regression: the analysis of spatially varying relationships.
+
+    The normal equations are solved by factorization (see solvers.py) rather
+    than by explicitly inverting X'X; `solver` keeps the factorization.
     """
-    xT = x.T
-    xtx = spdot(xT, x)
-    xtx_inv = la.inv(xtx)
-    xtx_inv = sp.csr_matrix(xtx_inv)
-    xTy = spdot(xT, y, array_out=False)
-    betas = spdot(xtx_inv, xTy)
-    return betas
+    if solver is None:
+        solver = get_solver("cholesky")
+    return solver.solve(y, x)
 
 
-def _compute_betas_gwr(y, x, wi):
+def _compute_betas_gwr(y, x, wi, hat=True, out=None):
     """
     compute MLE coefficients using iwls routine
 
     Methods: p189, Iteratively (Re)weighted Least Squares (IWLS),
     Fotheringham, A. S., Brunsdon, C., & Charlton, M. (2002).
     Geographically weighted regression: the analysis of spatially varying relationships.
+
+    If hat is False the k*n [X'X]^-1 X' is not formed and the Cholesky
+    factorization of X'X is returned in its place. out is an optional n*k
+    array for x * wi.
+    """
+    with stage("gram"):
+        xT = np.multiply(x, wi, out=out).T
+        xtx = np.dot(xT, x)
+    if hat:
+        xtx_inv_xt = linalg.solve(xtx, xT)
+        betas = np.dot(xtx_inv_xt, y)
+        return betas, xtx_inv_xt
+    factor = linalg.cho_factor(xtx, check_finite=False)
+    betas = linalg.cho_solve(factor, np.dot(xT, y), check_finite=False)
+    return betas, factor
+
+
+def _gwr_influence(x, wi, w, factor, i):
+    """
+    Influence of observation i on its own local fit, from the factorization
+    of the local X'WX rather than the k*n [X'WX]^-1 X'.
+
+    Parameters
+    ----------
+    x           : array
+                  n*k, design matrix
+    wi          : array
+                  n*1, kernel weights of location i
+    w           : array
+                  n*1, square root of the final iwls weights
+    factor      : tuple
+                  Cholesky factorization of X' diag(wi * w**2) X
+    i           : integer
+                  index of the observation at the regression point
+
+    Returns
+    -------
+    influ       : float
+                  S_ii, the ith diagonal entry of the hat matrix
+    tr_STS_i    : float
+                  sum of the squared entries of the ith row of S
+    CCT         : array
+                  k, diagonal of [X'WX]^-1 X'W^2X [X'WX]^-1, the local
+                  covariance of the betas up to scale
+    """
+    wi = np.asarray(wi).reshape(-1)
+    w2 = np.asarray(w).reshape(-1) ** 2
+    xi = x[i]
+    u = linalg.cho_solve(factor, xi, check_finite=False)
+    influ = w2[i] * wi[i] * np.dot(xi, u)
+    xtwwx = np.dot(x.T * (w2 * wi * wi), x)
+    tr_STS_i = w2[i] * np.dot(u, np.dot(xtwwx, u))
+    xtx_inv = linalg.cho_solve(factor, np.eye(x.shape[1]), check_finite=False)
+    CCT = np.einsum("ij,jk,ik->i", xtx_inv, xtwwx, xtx_inv)
+    return influ, tr_STS_i, CCT
+
+
+def _starting_mu(family, y, y_mean=None):
+    """
+    family.starting_mu(y), using y_mean in place of y.mean() for families
+    with the default starting values, so that a block of observations starts
+    where the full data would.
+    """
+    if y_mean is None or type(family).starting_mu is not Family.starting_mu:
+        return family.starting_mu(y)
+    return (y + y_mean) / 2.0
+
+
+def _starting_values(family, y, offset, y_means=(None, None)):
+    """
+    Starting linear predictor and fitted values of the iwls routine.
+
+    y_means holds the means of y and y / offset over the full data when only
+    a block of it is passed.
+    """
+    if isinstance(family, Poisson):
+        v = family.predict(_starting_mu(family, y / offset, y_means[1]))
+        mu = _starting_mu(family, y, y_means[0])
+    else:
+        mu = _starting_mu(family, y, y_means[0])
+        v = family.predict(mu)
+    return v, mu
+
+
+def _link_betas(y, x, family, offset):
+    """
+    Least squares fit of the starting linear predictor, i.e. of link(y) with
+    y moved off the boundaries of the link, on x. Solved by LSQR so that X'X
+    is not formed.
+    """
+    v, _ = _starting_values(family, y, offset)
+    return lsqr(x, np.ravel(v), atol=1e-10, btol=1e-10)[0].reshape((-1, 1))
+
+
+def _subsample(y, frac, k, rng):
+    """
+    Row indices of a random subsample of about frac * n rows, stratified on
+    the deciles of y (its values for a binary y). Rows are drawn
+    independently, and each stratum keeps SUBSAMPLE_ROWS rows in expectation
+    (all of them if it has fewer) and the subsample SUBSAMPLE_ROWS * k, so
+    that rare outcomes and all the columns are represented.
+    """
+    y = np.ravel(y)
+    n = y.shape[0]
+    p = min(1.0, max(frac, SUBSAMPLE_ROWS * k / n))
+    edges = np.unique(np.quantile(y, np.linspace(0.1, 0.9, 9)))
+    # values tied with a decile (e.g. the 0s of a rare binary outcome) form
+    # their own stratum, apart from those between two deciles
+    strata = np.searchsorted(edges, y) + np.searchsorted(edges, y, side="right")
+    counts = np.bincount(strata)
+    p_strata = np.minimum(1.0, np.maximum(p, SUBSAMPLE_ROWS / np.maximum(counts, 1)))
+    return np.flatnonzero(rng.random(n) < p_strata[strata])
+
+
+def initial_betas(
+    y,
+    x,
+    family,
+    offset,
+    init,
+    frac=0.1,
+    tol=1.0e-8,
+    max_iter=200,
+    solver="cholesky",
+    seed=0,
+):
+    """
+    Starting values for the full data iwls routine from a cheap first stage.
+
+    Parameters
+    ----------
+    y           : array
+                  n*1, dependent variable
+
+    x           : array or sparse matrix
+                  n*k, design matrix of k independent variables
+
+    family      : family object
+                  probability models: Gaussian, Poisson, or Binomial
+
+    offset      : array
+                  n*1, the offset variable for each observation
+
+    init        : string
+                  'subsample' fits the model by iwls on a random subsample
+                  of about frac * n rows, stratified on y (see _subsample);
+                  'link' regresses link(y) on x by least squares, which
+                  costs about one pass over the data
+
+    frac        : float
+                  fraction of the rows in the subsample, in (0, 1]
+
+    tol         : float
+                  tolerance of the subsample fit
+
+    max_iter    : integer maximum number of iterations of the subsample fit
+
+    solver      : string or Solver
+                  solver of the subsample fit; a fresh one of the same type
+                  is used, so that the state of a Solver instance is kept for
+                  the full data fit
+
+    seed        : integer or Generator
+                  seed of the subsample
+
+    Returns
+    -------
+    betas       : array
+                  k*1, starting values, or None if the subsample fit failed
+                  or did not converge (e.g. a subsample with separated
+                  classes or an empty column)
+
+    n_iter      : integer
+                  number of iterations of the subsample fit (0 if it
+                  failed), which estimates those of a full data fit from the
+                  default starting values; None for 'link'
+    """
+    if init not in INITS:
+        raise ValueError(f"init should be 'subsample' or 'link'. (got {init})")
+    if not 0 < frac <= 1:
+        raise ValueError(f"frac should be in (0, 1]. (got {frac})")
+    if init == "link":
+        return _link_betas(y, x, family, offset), None
+    rows = _subsample(y, frac, x.shape[1], np.random.default_rng(seed))
+    info = {}
+    try:
+        betas, _, _, n_iter = iwls(
+            y[rows],
+            x[rows],
+            family,
+            offset[rows],
+            None,
+            tol=tol,
+            max_iter=max_iter,
+            # a copy, so that the caller's settings apply but its state is
+            # left to the full fit
+            solver=copy.deepcopy(get_solver(solver)),
+            info=info,
+        )
+    except linalg.LinAlgError:
+        return None, 0
+    if not (info["converged"] and np.all(np.isfinite(betas))):
+        return None, n_iter
+    return betas, n_iter
+
+
+def _block_normal_eq(
+    y,
+    x,
+    family,
+    offset,
+    betas=None,
+    y_means=(None, None),
+    return_mu=False,
+    dtype=None,
+    kernel=None,
+):
+    """
+    Contribution of a block of observations to the IWLS normal equations.
+
+    Parameters
+    ----------
+    y           : array
+                  b*1, dependent variable for the block
+    x           : array
+                  b*k, design matrix for the block
+    family      : family object
+    offset      : array
+                  b*1, offset for the block
+    betas       : array
+                  k*1, current coefficients; None for the first iteration
+    y_means     : tuple
+                  means of y and y / offset over the full data, used for the
+                  starting values of the first iteration
+    return_mu   : boolean
+                  also return the fitted values at betas, e.g. to evaluate
+                  the deviance in the same pass
+    dtype       : numpy dtype
+                  working precision of the block; x, y and offset are cast to
+                  it (a no-op if they are stored in it) and the partial sums
+                  are returned in float64. Default is None, which leaves the
+                  arrays as they are
+    kernel      : IWLSKernel
+                  family.iwls_kernel(), to reuse across blocks
+
+    Returns
+    -------
+    xtwx        : array
+                  k*k, X'WX for the block
+    xtwz        : array
+                  k*1, X'Wz for the block
+    mu          : array
+                  b*1, fitted values at betas; only if return_mu is True
+    """
+    if dtype is not None:
+        x = x.astype(dtype, copy=False)
+        y = y.astype(dtype, copy=False)
+        offset = offset.astype(dtype, copy=False)
+        if betas is not None:
+            betas = betas.astype(dtype, copy=False)
+    if kernel is None:
+        kernel = family.iwls_kernel()
+    if isinstance(family, Binomial):
+        y = family.link._clean(y)
+    if betas is None:
+        v, mu = _starting_values(family, y, offset, y_means)
+        if dtype is not None:
+            v, mu = v.astype(dtype, copy=False), mu.astype(dtype, copy=False)
+    else:
+        v = np.dot(x, betas)
+        mu = kernel.fitted(v, offset)
+    w, z = kernel.working(y, v, mu)
+    xw = x * w
+    # a block partial sum has few terms; the sum over blocks is in float64
+    xtwx = np.dot(xw.T, x).astype(np.float64, copy=False)
+    xtwz = np.dot(xw.T, z).astype(np.float64, copy=False)
+    if return_mu:
+        return xtwx, xtwz, mu
+    return xtwx, xtwz
+
+
+def _resolve_engine(
+    engine,
+    family,
+    x,
+    solver=None,
+    criterion="min_diff",
+    safeguarded=False,
+    monitored=False,
+    absorbed=False,
+    weighted=False,
+    blocked=False,
+):
+    """
+    The engine an iwls fit runs on: 'numba' if it was requested and can be
+    used for this fit, 'numpy' otherwise.
+
+    The compiled iteration needs Numba, a built-in family, link and variance
+    function, a dense array design, the 'cholesky' solver (which the compiled
+    loop uses on every iteration), a criterion other than 'deviance', plain
+    Fisher scoring (not safeguarded), no per-iteration trace or callback (not
+    monitored), no fixed effects to absorb, no prior weights and no blocked
+    pass (block_size, n_jobs or single precision).
+    """
+    if engine not in ("numpy", "numba"):
+        raise ValueError(f"engine should be 'numpy' or 'numba'. (got {engine})")
+    if (
+        engine == "numba"
+        and _numba.HAS_NUMBA
+        and not sp.issparse(x)
+        and not isinstance(x, Design)
+        and _numba.family_codes(family) is not None
+        and criterion != "deviance"
+        and not safeguarded
+        and not monitored
+        and not absorbed
+        and not weighted
+        and not blocked
+        and (solver is None or solver.name == "cholesky")
+    ):
+        return "numba"
+    return "numpy"
+
+
+def _block_rows(k):
+    """
+    Rows per block so that a block and its temporaries stay cache sized.
+    """
+    return max(64, 2**18 // (8 * (2 * k + 8)))
+
+
+def _n_jobs(n_jobs):
+    if n_jobs is None or n_jobs == 0:
+        return 1
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return n_jobs
+
+
+def _reduce_blocks(func, blocks, executor=None, window=None):
+    """
+    Sum func(*block) over an iterable of blocks.
+
+    With an executor the blocks are evaluated concurrently, with at most
+    `window` of them in flight so that a lazy (e.g. out-of-core) source is
+    not read ahead, and the partial results are added in block order so the
+    sum does not depend on the number of threads.
+    """
+    total = None
+
+    def add(part):
+        return part if total is None else tuple(a + b for a, b in zip(total, part))
+
+    if executor is None:
+        for block in blocks:
+            total = add(func(*block))
+        return total
+    pending = deque()
+    for block in blocks:
+        pending.append(executor.submit(func, *block))
+        if len(pending) >= window:
+            total = add(pending.popleft().result())
+    while pending:
+        total = add(pending.popleft().result())
+    return total
+
+
+def _iwls_blocked(
+    y,
+    x,
+    family,
+    offset,
+    ini_betas,
+    tol,
+    max_iter,
+    solver,
+    block_size,
+    n_jobs,
+    precision="double",
+    criterion="min_diff",
+    info=None,
+    monitor=None,
+):
+    """
+    iwls for a dense GLM with the weights, working response and X'WX, X'Wz
+    computed in one fused pass per row block, the blocks running on a thread
+    pool. Neither the n*k weighted design nor n-length temporaries are
+    allocated during the iterations.
+
+    With precision='single' the blocks are worked in float32 until the betas
+    settle to float32 accuracy, then refined with float64 iterations, each
+    block being upcast as it is read; the betas are those of a float64 fit to
+    the stored design.
+
+    The deviance for criterion='deviance' is summed over the blocks of the
+    same pass, at the betas entering each iteration, so the fit stops one
+    iteration later than the unblocked routine. It is that deviance that a
+    monitor records.
+    """
+    n, k = x.shape
+    block_size = _block_rows(k) if block_size is None else block_size
+    n_jobs = _n_jobs(n_jobs)
+    y_means = (y.mean(dtype=np.float64), (y / offset).mean(dtype=np.float64))
+    betas = ini_betas
+    if precision == "single":
+        dtype = np.float32
+        refine_tol = max(tol, np.sqrt(np.finfo(np.float32).eps))
+    else:
+        dtype = np.float64
+        refine_tol = tol
+
+    def blocks():
+        for start in range(0, n, block_size):
+            stop = start + block_size
+            yield y[start:stop], x[start:stop], offset[start:stop], betas, y_means
+
+    kernel = family.iwls_kernel()
+
+    with_deviance = criterion == "deviance" or monitor is not None
+
+    def step(y_b, x_b, off_b, b, means):
+        if not with_deviance:
+            return _block_normal_eq(
+                y_b, x_b, family, off_b, b, means, dtype=dtype, kernel=kernel
+            )
+        xtwx, xtwz, mu = _block_normal_eq(
+            y_b, x_b, family, off_b, b, means, True, dtype, kernel
+        )
+        return xtwx, xtwz, _deviance(family, y_b, mu)
+
+    n_iter = 0
+    diff = 1.0e6
+    deviance = None
+    with ThreadPoolExecutor(n_jobs) if n_jobs > 1 else contextlib.nullcontext() as pool:
+        while diff > tol and n_iter < max_iter:
+            n_iter += 1
+            # the weights are computed in the same pass as X'WX and X'Wz
+            with stage("gram"):
+                parts = _reduce_blocks(step, blocks(), pool, 2 * n_jobs)
+                if dtype is not np.float64 and not np.isfinite(parts[1]).all():
+                    # fitted values saturated in float32 (e.g. a logit mu of 1)
+                    dtype = np.float64
+                    parts = _reduce_blocks(step, blocks(), pool, 2 * n_jobs)
+            xtwx, xtwz = parts[:2]
+            old_deviance, deviance = deviance, (parts + (None,))[2]
+            # v = X betas, so X'W(z - v) is the score at betas
+            score = None if betas is None else xtwz - np.dot(xtwx, betas)
+            with stage("solve"):
+                n_betas = solver.solve_normal(xtwx, xtwz)
+            diff = _conv_value(
+                criterion, betas, n_betas, deviance, old_deviance, score, n
+            )
+            stop = monitor is not None and monitor(
+                n_iter, betas, n_betas, diff, deviance
+            )
+            betas = n_betas
+            if stop:
+                break
+            if dtype is not np.float64 and diff <= refine_tol:
+                dtype = np.float64
+                diff = 1.0e6
+                deviance = None
+    with stage("predict"):
+        v = np.empty((n, 1))
+        for start in range(0, n, block_size):
+            rows = slice(start, start + block_size)
+            v[rows] = np.dot(x[rows].astype(np.float64, copy=False), betas)
+        mu = kernel.fitted(v, offset)
+    _record(info, criterion, diff, tol)
+    if monitor is not None:
+        monitor.record(info)
+    return betas, mu, None, n_iter
+
+
+def _fe_codes(fixed_effects, n):
+    """
+    Factorize the group codes of fixed effects.
+
+    Parameters
+    ----------
+    fixed_effects : array
+                    n*1 or n*g, integer codes of the group of each
+                    observation in each of g factors
+    n             : integer
+                    number of observations
+
+    Returns
+    -------
+    codes         : array
+                    n*g, the codes renumbered 0, 1, ... in order of the
+                    original codes of each factor
+    levels        : list
+                    for each factor, the array of its original codes
+    """
+    fixed_effects = np.asarray(fixed_effects)
+    if fixed_effects.ndim == 1:
+        fixed_effects = fixed_effects.reshape((-1, 1))
+    if fixed_effects.ndim != 2 or fixed_effects.shape[0] != n:
+        raise ValueError("fixed_effects should be n*1 or n*g group codes")
+    if not np.issubdtype(fixed_effects.dtype, np.integer):
+        raise ValueError(
+            f"fixed_effects should be integer codes. (got {fixed_effects.dtype})"
+        )
+    codes = np.empty(fixed_effects.shape, dtype=np.intp)
+    levels = []
+    for j in range(fixed_effects.shape[1]):
+        level, codes[:, j] = np.unique(fixed_effects[:, j], return_inverse=True)
+        levels.append(level)
+    return codes, levels
+
+
+def _groups(codes):
+    """
+    The (codes, number of levels) of each factor of factorized fixed effects.
+    """
+    return [(c, int(c.max()) + 1) for c in np.asarray(codes).T]
+
+
+def _demean(a, w, groups, tol=FE_TOL, max_iter=FE_MAX_ITER):
+    """
+    Weighted alternating projections: take from each column of a, in place,
+    its w-weighted mean within each group of each factor in turn, until the
+    means taken in a sweep are all below tol times the scale of the column.
+    One sweep is exact for a single factor.
+
+    The result is a less its w-weighted least squares fit on the group
+    dummies of all the factors, and it does not depend on any multiple of
+    the dummies a held on entry; iwls passes the previous iteration's
+    demeaned columns, which are close to the new ones, as a warm start.
+    """
+    scale = tol * np.maximum(np.abs(a).max(axis=0), 1.0)
+    sums = [np.bincount(c, w, m) for c, m in groups]
+    for _ in range(max_iter):
+        change = np.zeros(a.shape[1])
+        for (c, m), wsum in zip(groups, sums):
+            for j in range(a.shape[1]):
+                means = np.bincount(c, w * a[:, j], m)
+                np.divide(means, wsum, out=means, where=wsum > 0)
+                a[:, j] -= means[c]
+                change[j] = max(change[j], np.abs(means).max())
+        if len(groups) == 1 or np.all(change <= scale):
+            break
+    return a
+
+
+def _fe_effects(absorbed, codes, tol=FE_TOL, max_iter=FE_MAX_ITER):
+    """
+    The effect of each level of each factor from the fixed effects part of
+    the linear predictor.
+
+    Parameters
+    ----------
+    absorbed      : array
+                    n*1, the linear predictor less X betas, i.e. the sum of
+                    the effects of the groups of each observation
+    codes         : array
+                    n*g, factorized group codes; see _fe_codes
+
+    Returns
+    -------
+    effects       : list
+                    for each factor, the effects of its levels. With more
+                    than one factor they are identified up to constants;
+                    those of every factor but the first average zero over
+                    the observations.
+    """
+    groups = _groups(codes)
+    resid = np.asarray(absorbed, dtype=np.float64).reshape(-1).copy()
+    counts = [np.bincount(c, minlength=m) for c, m in groups]
+    effects = [np.zeros(m) for _, m in groups]
+    scale = tol * max(np.abs(resid).max(), 1.0)
+    for _ in range(max_iter):
+        change = 0.0
+        for (c, m), count, effect in zip(groups, counts, effects):
+            means = np.bincount(c, resid, m) / np.maximum(count, 1)
+            effect += means
+            resid -= means[c]
+            change = max(change, np.abs(means).max())
+        if len(groups) == 1 or change <= scale:
+            break
+    for (c, _), effect in zip(groups[1:], effects[1:]):
+        shift = effect[c].mean()
+        effect -= shift
+        effects[0] += shift
+    return effects
+
+
+def _iwls_absorbed(
+    y,
+    x,
+    family,
+    offset,
+    codes,
+    tol,
+    max_iter,
+    solver,
+    criterion,
+    info,
+    monitor=None,
+):
     """
-    xT = (x * wi).T
-    xtx = np.dot(xT, x)
-    xtx_inv_xt = linalg.solve(xtx, xT)
-    betas = np.dot(xtx_inv_xt, y)
-    return betas, xtx_inv_xt
+    iwls for a GLM with fixed effects absorbed.
 
+    Each iteration demeans the working response and the columns of x within
+    the groups of the fixed effects, weighted by the iwls weights (see
+    _demean), and solves for the slopes alone. By the Frisch-Waugh-Lovell
+    theorem these are the slopes of the fit with a dummy column for every
+    group, and the k*k factorization of the demeaned problem gives their
+    covariance. The linear predictor, effects included, is the working
+    response less the residuals of the demeaned problem.
 
+    info['absorbed'] is set to the fixed effects part of the final linear
+    predictor, from which _fe_effects recovers the effect of each group.
+    """
+    n, k = x.shape
+    groups = _groups(codes)
+    kernel = family.iwls_kernel()
+    y_obs = y
+    if isinstance(family, Binomial):
+        y = family.link._clean(y)
+    v, mu = _starting_values(family, y, offset)
+    # the demeaned x and working response, kept between iterations
+    xz = np.empty((n, k + 1))
+    xz[:, :k] = x
+    xz[:, k] = 0.0
+    old_z = np.zeros((n, 1))
+    betas = None
+    deviance = score = None
+    if criterion == "deviance":
+        deviance = _deviance(family, y_obs, mu)
+    n_iter = 0
+    diff = 1.0e6
+    while diff > tol and n_iter < max_iter:
+        n_iter += 1
+        with stage("weights"):
+            w, z = kernel.working(y, v, mu)
+        with stage("absorb"):
+            # adding the change of z keeps the effects removed so far
+            xz[:, k:] += z - old_z
+            old_z = z
+            _demean(xz, w.ravel(), groups)
+        w = np.sqrt(w)
+        wx = xz[:, :k] * w
+        wz = xz[:, k:] * w
+        with stage("solve"):
+            n_betas = _compute_betas(wz, wx, solver)
+        if criterion == "gradient" and betas is not None:
+            score = spdot(wx.T, wz - np.dot(wx, betas))
+        with stage("predict"):
+            v = z - (xz[:, k:] - np.dot(xz[:, :k], n_betas))
+            mu = kernel.fitted(v, offset)
+        old_deviance = deviance
+        if criterion == "deviance":
+            deviance = _deviance(family, y_obs, mu)
+        diff = _conv_value(criterion, betas, n_betas, deviance, old_deviance, score, n)
+        stop = monitor is not None and monitor(
+            n_iter, betas, n_betas, diff, deviance, mu
+        )
+        betas = n_betas
+        if stop:
+            break
+    _record(info, criterion, diff, tol)
+    if info is not None:
+        info["absorbed"] = v - np.dot(x, betas)
+    if monitor is not None:
+        monitor.record(info)
+    return betas, mu, wx, n_iter
+
+
+def _iwls_design(
+    y,
+    x,
+    family,
+    offset,
+    ini_betas,
+    tol,
+    max_iter,
+    solver,
+    criterion,
+    info,
+    monitor=None,
+    weights=None,
+):
+    """
+    iwls for a GLM with a structured design (see design.py), which computes
+    X b, X'WX and X'Wz from its own compact form; the normal equations are
+    solved from X'WX, so no n*k array is formed.
+    """
+    n = x.shape[0]
+    kernel = family.iwls_kernel()
+    y_obs = y
+    if isinstance(family, Binomial):
+        y = family.link._clean(y)
+    betas = ini_betas
+    if ini_betas is None:
+        v, mu = _starting_values(family, y, offset)
+    else:
+        v = x.dot(betas)
+        mu = kernel.fitted(v, offset)
+    dev_weights = 1.0 if weights is None else weights
+    deviance = score = None
+    if criterion == "deviance":
+        deviance = _deviance(family, y_obs, mu, dev_weights)
+    n_iter = 0
+    diff = 1.0e6
+    while diff > tol and n_iter < max_iter:
+        n_iter += 1
+        with stage("weights"):
+            w, z = kernel.working(y, v, mu)
+            if weights is not None:
+                w = w * weights
+        with stage("gram"):
+            xtwx, xtwz = x.normal_eq(w, z)
+        if criterion == "gradient" and betas is not None:
+            # v = X betas, so X'W(z - v) is the score at betas
+            score = xtwz - np.dot(xtwx, betas)
+        with stage("solve"):
+            n_betas = solver.solve_normal(xtwx, xtwz)
+        with stage("predict"):
+            v = x.dot(n_betas)
+            mu = kernel.fitted(v, offset)
+        old_deviance = deviance
+        if criterion == "deviance":
+            deviance = _deviance(family, y_obs, mu, dev_weights)
+        diff = _conv_value(criterion, betas, n_betas, deviance, old_deviance, score, n)
+        stop = monitor is not None and monitor(
+            n_iter, betas, n_betas, diff, deviance, mu
+        )
+        betas = n_betas
+        if stop:
+            break
+    _record(info, criterion, diff, tol)
+    if monitor is not None:
+        monitor.record(info)
+    return betas, mu, None, n_iter
+
+
+def _valid_mu(family, mu):
+    """
+    Whether the fitted values are finite and inside family.valid, e.g.
+    non-negative for Poisson and Gamma and in [0, 1] for Binomial models. A
+    bound itself is allowed, as a saturated inverse link reaches it; where
+    the deviance is not defined there it is not finite.
+    """
+    lower, upper = family.valid
+    return bool(np.all(np.isfinite(mu) & (mu >= lower) & (mu <= upper)))
+
+
+def _acceptable(family, mu, deviance, old_deviance, first):
+    """
+    Whether a safeguarded iwls step is kept: valid fitted values, a finite
+    deviance and, unless it is a cold first iteration, no increase of the
+    deviance beyond rounding.
+    """
+    if not (_valid_mu(family, mu) and np.isfinite(deviance)):
+        return False
+    return first or deviance - old_deviance <= 1e-10 * (abs(old_deviance) + 0.1)
+
+
+def _newton_betas(y, x, v, mu, kernel, solver):
+    """
+    Betas of a Newton step from the observed information, or None where it
+    is not positive definite, in which case the iteration takes a Fisher
+    scoring step instead.
+    """
+    w, wz = kernel.observed(y, v, mu)
+    with stage("gram"):
+        xw = sp.diags(w.ravel()) @ x if sp.issparse(x) else x * w
+        xtwx = spdot(x.T, xw)
+    try:
+        if not np.all(w >= 0):
+            # some weights are negative; the k*k check is cheap
+            np.linalg.cholesky(xtwx)
+        return solver.solve_normal(xtwx, spdot(x.T, wz))
+    except linalg.LinAlgError:
+        return None
+
+
+def _iwls_safeguarded(
+    y,
+    x,
+    family,
+    offset,
+    ini_betas,
+    tol,
+    max_iter,
+    solver,
+    information,
+    step_halving,
+    criterion,
+    info,
+    monitor=None,
+):
+    """
+    iwls for a GLM with step halving and/or Newton steps.
+
+    With information='observed' each iteration takes a full Newton step from
+    the observed information, which converges quadratically near the
+    optimum for non-canonical links too; where that is not positive
+    definite, and on a cold first iteration, it takes a Fisher scoring step.
+
+    With step_halving, a step that leads to fitted values outside
+    family.valid, a non-finite deviance or a larger deviance is halved
+    towards the previous betas, up to MAX_HALVING times, after which the fit
+    stops unconverged at the previous betas. On the first iteration without
+    ini_betas only the validity is checked, halving towards the least
+    squares fit of the starting linear predictor, as the starting fitted
+    values do not come from any betas. A halved step does not count as
+    converged.
+    """
+    n = x.shape[0]
+    kernel = family.iwls_kernel()
+    # y is cleaned for the iterations and the deviance is of the observed y
+    y_obs = y
+    if isinstance(family, Binomial):
+        y = family.link._clean(y)
+    if ini_betas is None:
+        betas = None
+        v, mu = _starting_values(family, y, offset)
+    else:
+        betas = ini_betas
+        v = spdot(x, betas)
+        mu = kernel.fitted(v, offset)
+    deviance = _deviance(family, y_obs, mu)
+    n_iter = n_halving = 0
+    diff = 1.0e6
+    while diff > tol and n_iter < max_iter:
+        n_iter += 1
+        with stage("weights"):
+            w, z = kernel.working(y, v, mu)
+            w = np.sqrt(w)
+            wx = sp.diags(w.ravel()) @ x if sp.issparse(x) else x * w
+        with stage("solve"):
+            n_betas = None
+            if information == "observed" and betas is not None:
+                n_betas = _newton_betas(y, x, v, mu, kernel, solver)
+            if n_betas is None:
+                n_betas = _compute_betas(w * z, wx, solver)
+        # v = X betas unless this is a cold first iteration
+        score = None if betas is None else spdot(wx.T, w * (z - v))
+        with stage("predict"):
+            n_v = spdot(x, n_betas)
+            n_mu = kernel.fitted(n_v, offset)
+        n_deviance = _deviance(family, y_obs, n_mu)
+        halving = 0
+        if step_halving:
+            ref = betas
+            while halving < MAX_HALVING and not _acceptable(
+                family, n_mu, n_deviance, deviance, betas is None
+            ):
+                if ref is None:
+                    # least squares fit of the starting linear predictor
+                    ref = _compute_betas(w * v, wx, solver)
+                halving += 1
+                n_betas = (n_betas + ref) / 2.0
+                n_v = spdot(x, n_betas)
+                n_mu = kernel.fitted(n_v, offset)
+                n_deviance = _deviance(family, y_obs, n_mu)
+            if not _acceptable(family, n_mu, n_deviance, deviance, betas is None):
+                # no acceptable step along this direction
+                if betas is None:
+                    raise ValueError(
+                        "no valid coefficients were found; supply ini_betas"
+                    )
+                diff = np.inf
+                break
+            n_halving += halving
+        diff = _conv_value(criterion, betas, n_betas, n_deviance, deviance, score, n)
+        if halving:
+            # a shortened step is small without the fit having converged
+            diff = np.inf
+        stop = monitor is not None and monitor(
+            n_iter, betas, n_betas, diff, n_deviance, step=0.5**halving
+        )
+        betas, v, mu, deviance = n_betas, n_v, n_mu, n_deviance
+        if stop:
+            break
+    _record(info, criterion, diff, tol)
+    if info is not None:
+        info["n_halving"] = n_halving
+    if monitor is not None:
+        monitor.record(info)
+    return betas, mu, wx, n_iter
+
+
+@profiled("iwls")
 def iwls(
     y,
     x,
@@ -49,6 +1157,22 @@ def iwls(
     tol=1.0e-8,
     max_iter=200,
     wi=None,
+    solver="cholesky",
+    hat="full",
+    i=None,
+    block_size=None,
+    n_jobs=1,
+    precision="double",
+    workspace=None,
+    engine="numpy",
+    criterion="min_diff",
+    info=None,
+    information="expected",
+    step_halving=False,
+    callback=None,
+    trace=False,
+    fixed_effects=None,
+    weights=None,
 ):
     """
     Iteratively re-weighted least squares estimation routine
@@ -58,8 +1182,13 @@ def iwls(
     y           : array
                   n*1, dependent variable
 
-    x           : array
-                  n*k, designs matrix of k independent variables
+    x           : array, sparse matrix or Design
+                  n*k, designs matrix of k independent variables; a
+                  scipy.sparse matrix stays sparse throughout estimation. A
+                  Design (see design.py) computes X b, X'WX and X'Wz from a
+                  structured form, e.g. categorical codes; it needs a solver
+                  that works from X'WX, runs on the 'numpy' engine and
+                  returns None in place of wx
 
     family      : family object
                   probability models: Gaussian, Poisson, or Binomial
@@ -71,8 +1200,9 @@ def iwls(
                   n*1, the fixed intercept value of y for each observation
 
     ini_betas   : array
-                  1*k, starting values for the k betas within the iteratively
-                  weighted least squares routine
+                  k*1, starting values for the k betas within the iteratively
+                  weighted least squares routine; the first iteration starts
+                  from the fitted values they imply instead of starting_mu(y)
 
     tol         : float
                   tolerance for estimation convergence
@@ -82,6 +1212,126 @@ def iwls(
     wi          : array
                   n*1, weights to transform observations from location i in GWR
 
+    solver      : string or Solver
+                  linear solver for the GLM normal equations: 'cholesky'
+                  (default), 'splu', 'schur', 'qr', 'svd', 'lsmr' or
+                  'sketch'; see solvers.py. If a Solver instance is passed it
+                  holds the final factorization on return, which can be
+                  reused to compute [X'WX]^-1.
+
+    hat         : string
+                  GWR only. 'full' (default) returns the k*n [X'X]^-1 X';
+                  'influence' returns only the influence quantities of
+                  observation i (see _gwr_influence), computed from the local
+                  factorization without forming the k*n matrix
+
+    i           : integer
+                  GWR only, required if hat='influence'. Index of the
+                  observation at the regression point
+
+    block_size  : integer
+                  GLM with dense x only. If given, or if n_jobs is not 1, each
+                  iteration computes the weights, working response and the
+                  partial X'WX and X'Wz in a single pass over blocks of
+                  block_size rows (default: cache sized); wx is then not
+                  formed and None is returned in its place
+
+    n_jobs      : integer
+                  number of threads for the blocked pass; -1 uses all cores.
+                  The partial sums are reduced in block order, so results do
+                  not depend on n_jobs
+
+    precision   : string
+                  GLM with dense x only. 'double' (default) or 'single'. With
+                  'single' x is read as float32 (it is cast, i.e. copied,
+                  unless already stored so) and the blocked pass runs in
+                  float32, with X'WX and X'Wz summed over blocks in float64;
+                  once the betas settle, float64 iterations refine them to
+                  the tolerance of a double precision fit
+
+    workspace   : Workspace
+                  preallocated arrays for the iterations, e.g. shared by many
+                  fits of the same size. The returned n-length arrays are
+                  views of it, overwritten by the next fit that uses it.
+                  Default is None, which allocates one for this fit. Not used
+                  by the blocked pass
+
+    engine      : string
+                  'numpy' (default) or 'numba'. 'numba' runs the iterations
+                  as a compiled loop, for many small fits where the per-call
+                  overhead of NumPy dominates. It falls back to 'numpy' when
+                  Numba is not installed, for user defined families, links or
+                  variance functions, for sparse x, with any solver but
+                  'cholesky' and for the blocked pass (block_size, n_jobs or
+                  single precision). wx is not formed and None is returned in
+                  its place
+
+    criterion   : string
+                  convergence criterion compared with tol: 'min_diff'
+                  (default), the smallest absolute change of a coefficient;
+                  'max_diff', the largest; 'rel_diff', the largest change
+                  relative to max(|beta|, 1); 'deviance', the relative change
+                  of the deviance as in R's glm; 'gradient', the largest
+                  entry of the score X'W(z - v) / n. See _conv_value
+
+    info        : dict
+                  if given, filled with the 'criterion', its final 'value'
+                  and whether the fit 'converged' (value <= tol); and with
+                  'n_halving', the number of step halvings, if the fit is
+                  safeguarded
+
+    information : string
+                  GLM only. 'expected' (default) takes Fisher scoring steps;
+                  'observed' takes full Newton steps from the observed
+                  information, using the second derivative of the link and
+                  the derivative of the variance function. The two coincide
+                  for canonical links; for non-canonical ones Newton
+                  converges quadratically near the optimum. Needs a solver
+                  that can work from X'WX, and the solver then holds the
+                  factorization of the observed information
+
+    step_halving: boolean
+                  GLM only. If True a step that leads to fitted values
+                  outside family.valid, or that increases the deviance, is
+                  halved towards the previous betas (up to MAX_HALVING
+                  times), as in R's glm2. A fit that cannot be improved
+                  along its step stops unconverged
+
+    callback    : callable
+                  called after every iteration as callback(record, betas),
+                  with the iteration's trace record as a dict (see trace) and
+                  the new k*1 betas. If it returns True the fit stops there,
+                  and info['stopped'] is set. Runs on the 'numpy' engine
+
+    trace       : boolean
+                  if True, info['trace'] is set to a structured array
+                  (TRACE_DTYPE) with one row per iteration: 'iteration';
+                  'deviance' at the new betas (in the blocked pass, at the
+                  betas entering the iteration); 'change', the largest
+                  absolute change of a coefficient; 'step', the fraction of
+                  the full step taken; 'conv_value', the criterion; 'time',
+                  the wall time in seconds; and the 'solver'. Runs on the
+                  'numpy' engine
+
+    fixed_effects : array
+                  GLM with dense x only. n*1 or n*g integer codes of the
+                  group of each observation in each of g factors, whose
+                  effects are absorbed: every iteration demeans z and the
+                  columns of x within the groups, weighted by the iwls
+                  weights, and solves for the k slopes only. x should not
+                  hold a constant, which the effects absorb. The betas and
+                  the final factorization are those of the slopes;
+                  info['absorbed'] is set to the n*1 sum of the effects of
+                  each observation (see _fe_effects). Runs on the 'numpy'
+                  engine, with neither ini_betas nor wi
+
+    weights     : array
+                  GLM only. n*1 prior weights of the observations, e.g. the
+                  product of their frequency and variance weights (see
+                  GLM), which multiply their iwls weights and their
+                  deviance. The returned wx and the final factorization
+                  include them. Runs unblocked and unsafeguarded on the
+                  'numpy' engine, without fixed_effects or wi
 
 
     Returns
@@ -110,49 +1360,596 @@ def iwls(
 
     xtx_inv_xt  : array
                   iwls throughout to compute GWR hat matrix
-                  [X'X]^-1 X'
+                  [X'X]^-1 X'; if hat='influence', the tuple
+                  (influ, tr_STS_i, CCT) instead
 
     """
     n_iter = 0
     diff = 1.0e6
+    solver = get_solver(solver)
+    if hat not in ("full", "influence"):
+        raise ValueError(f"hat should be 'full' or 'influence'. (got {hat})")
+    if wi is not None and hat == "influence" and i is None:
+        raise ValueError("i must be given when hat='influence'")
+    if precision not in ("double", "single"):
+        raise ValueError(f"precision should be 'double' or 'single'. (got {precision})")
+    blocked = block_size is not None or _n_jobs(n_jobs) > 1 or precision == "single"
+    structured = isinstance(x, Design)
+    if blocked and (wi is not None or sp.issparse(x) or structured):
+        raise ValueError(
+            "block_size, n_jobs and precision apply to GLM fits with dense x"
+        )
+    _check_criterion(criterion)
+    if information not in ("expected", "observed"):
+        raise ValueError(
+            f"information should be 'expected' or 'observed'. (got {information})"
+        )
+    safeguarded = information == "observed" or step_halving
+    if safeguarded and (blocked or wi is not None):
+        raise ValueError(
+            "information='observed' and step_halving apply to unblocked GLM fits"
+        )
+    if information == "observed" and (type(solver).solve_normal is Solver.solve_normal):
+        raise ValueError(
+            "information='observed' needs a solver that works from X'WX; use "
+            "solver='cholesky', 'splu' or 'svd'."
+        )
+    absorbed = fixed_effects is not None
+    if structured and (safeguarded or absorbed or wi is not None):
+        raise ValueError(
+            "a structured design applies to unblocked, unsafeguarded GLM fits "
+            "without fixed_effects"
+        )
+    if structured and type(solver).solve_normal is Solver.solve_normal:
+        raise ValueError(
+            "a structured design needs a solver that works from X'WX; use "
+            "solver='cholesky', 'splu' or 'svd'."
+        )
+    if absorbed and (blocked or safeguarded or wi is not None or sp.issparse(x)):
+        raise ValueError(
+            "fixed_effects apply to unblocked, unsafeguarded GLM fits with dense x"
+        )
+    if absorbed and ini_betas is not None:
+        raise ValueError("ini_betas does not apply with fixed_effects")
+    weighted = weights is not None
+    if weighted and (blocked or safeguarded or absorbed or wi is not None):
+        raise ValueError(
+            "weights apply to unblocked, unsafeguarded GLM fits without fixed_effects"
+        )
+    monitored = trace or callback is not None
+    engine = _resolve_engine(
+        engine,
+        family,
+        x,
+        solver,
+        criterion,
+        safeguarded,
+        monitored,
+        absorbed,
+        weighted,
+        blocked,
+    )
 
     betas = np.zeros((x.shape[1], 1)) if ini_betas is None else ini_betas
+    dev_weights = 1.0
+    if weighted:
+        dev_weights = weights
+    elif wi is not None:
+        # the deviance of a local fit is weighted by the kernel
+        dev_weights = wi
 
+    # the deviance is of the observed y; the blocks clean y themselves
+    y_obs = y
     if isinstance(family, Binomial):
         y = family.link._clean(y)
-    if isinstance(family, Poisson):
-        y_off = y / offset
-        y_off = family.starting_mu(y_off)
-        v = family.predict(y_off)
-        mu = family.starting_mu(y)
+    if blocked:
+        if precision == "single":
+            x = np.asarray(x).astype(np.float32, copy=False)
+        return _iwls_blocked(
+            y_obs,
+            x,
+            family,
+            offset,
+            ini_betas,
+            tol,
+            max_iter,
+            solver,
+            block_size,
+            n_jobs,
+            precision,
+            criterion,
+            info,
+            _monitor(trace, callback, solver, family, y_obs),
+        )
+    if structured:
+        return _iwls_design(
+            y_obs,
+            x,
+            family,
+            offset,
+            ini_betas,
+            tol,
+            max_iter,
+            solver,
+            criterion,
+            info,
+            _monitor(trace, callback, solver, family, y_obs, dev_weights),
+            weights,
+        )
+    if absorbed:
+        codes, _ = _fe_codes(fixed_effects, x.shape[0])
+        return _iwls_absorbed(
+            y_obs,
+            np.asarray(x),
+            family,
+            offset,
+            codes,
+            tol,
+            max_iter,
+            solver,
+            criterion,
+            info,
+            _monitor(trace, callback, solver, family, y_obs),
+        )
+    if safeguarded:
+        return _iwls_safeguarded(
+            y_obs,
+            x,
+            family,
+            offset,
+            ini_betas,
+            tol,
+            max_iter,
+            solver,
+            information,
+            step_halving,
+            criterion,
+            info,
+            _monitor(trace, callback, solver, family, y_obs),
+        )
+    if engine == "numba":
+        return _iwls_numba(
+            y,
+            x,
+            family,
+            offset,
+            ini_betas,
+            tol,
+            max_iter,
+            wi,
+            solver,
+            hat,
+            i,
+            criterion,
+            info,
+        )
+    if workspace is None:
+        workspace = Workspace(*x.shape)
+    workspace.check(*x.shape)
+    ws = workspace
+    v, mu, w, z, wz = ws.v, ws.mu, ws.w, ws.z, ws.wz
+    # the family and link are dispatched once, not every iteration
+    kernel = family.iwls_kernel()
+    if ini_betas is not None:
+        # start from the linear predictor implied by the initial betas
+        v[:] = spdot(x, betas)
+        kernel.fitted(v, offset, out=mu)
     else:
-        mu = family.starting_mu(y)
-        v = family.predict(mu)
+        v[:], mu[:] = _starting_values(family, y, offset)
+    deviance = score = None
+    if criterion == "deviance":
+        deviance = _deviance(family, y_obs, mu, dev_weights)
+    monitor = _monitor(trace, callback, solver, family, y_obs, dev_weights)
 
+    # every n-length array of the loop is a workspace array
     while diff > tol and n_iter < max_iter:
         n_iter += 1
-        w = family.weights(mu)
-        z = v + (family.link.deriv(mu) * (y - mu))
-        w = np.sqrt(w)
-        if not isinstance(x, np.ndarray):
-            w = sp.csr_matrix(w)
-            z = sp.csr_matrix(z)
-        wx = spmultiply(x, w, array_out=False)
-        wz = spmultiply(z, w, array_out=False)
-        if wi is None:
-            n_betas = _compute_betas(wz, wx)
-        else:
-            n_betas, xtx_inv_xt = _compute_betas_gwr(wz, wx, wi)
-        v = spdot(x, n_betas)
-        mu = family.fitted(v)
+        with stage("weights"):
+            kernel.working(y, v, mu, w, z, ws.work)
+            if weighted:
+                np.multiply(w, weights, out=w)
+            np.sqrt(w, out=w)
+            if sp.issparse(x):
+                # scale the rows in place of the sparsity pattern; X is never densified
+                wx = sp.diags(w.ravel()) @ x
+            else:
+                wx = np.multiply(x, w, out=ws.wx)
+            np.multiply(z, w, out=wz)
+        with stage("solve"):
+            if wi is None:
+                n_betas = _compute_betas(wz, wx, solver)
+            else:
+                n_betas, factor = _compute_betas_gwr(wz, wx, wi, hat=False, out=ws.xwi)
+        if criterion == "gradient" and (n_iter > 1 or ini_betas is not None):
+            # v = X betas here, so X'W(z - v) is the score at betas
+            xw = wx if wi is None else ws.xwi
+            score = spdot(xw.T, wz - w * v)
+        with stage("predict"):
+            if sp.issparse(x):
+                v[:] = x @ n_betas
+            else:
+                np.dot(x, n_betas, out=v)
+            kernel.fitted(v, offset, out=mu)
 
-        if isinstance(family, Poisson):
-            mu = mu * offset
-
-        diff = min(abs(n_betas - betas))
+        old_deviance = deviance
+        if criterion == "deviance":
+            deviance = _deviance(family, y_obs, mu, dev_weights)
+        diff = _conv_value(
+            criterion, betas, n_betas, deviance, old_deviance, score, x.shape[0]
+        )
+        # a cold first iteration does not start from any betas
+        cold = n_iter == 1 and ini_betas is None
+        stop = monitor is not None and monitor(
+            n_iter, None if cold else betas, n_betas, diff, deviance, mu
+        )
         betas = n_betas
+        if stop:
+            break
 
+    _record(info, criterion, diff, tol)
+    if monitor is not None:
+        monitor.record(info)
     if wi is None:
         return betas, mu, wx, n_iter
+    # the hat quantities are only needed for the final iteration
+    if hat == "influence":
+        xtx_inv_xt = _gwr_influence(x, wi, w, factor, i)
+    else:
+        xtx_inv_xt = linalg.cho_solve(factor, (wx * wi).T, check_finite=False)
+    return betas, mu, v, w, z, xtx_inv_xt, n_iter
+
+
+def _iwls_numba(
+    y, x, family, offset, ini_betas, tol, max_iter, wi, solver, hat, i, criterion, info
+):
+    """
+    iwls on the compiled engine, returning what iwls does.
+    """
+    betas = np.zeros((x.shape[1], 1)) if ini_betas is None else ini_betas
+    if ini_betas is not None:
+        v = np.dot(x, betas)
+        mu = family.iwls_kernel().fitted(v, offset)
+    else:
+        v, mu = _starting_values(family, y, offset)
+    betas, v, mu, w, z, xtwx, n_iter, diff = _numba.iwls_numba(
+        y,
+        x,
+        family,
+        offset,
+        wi,
+        betas,
+        v,
+        mu,
+        tol,
+        max_iter,
+        criterion,
+        ini_betas is not None,
+    )
+    _record(info, criterion, diff, tol)
+    if wi is None:
+        # keep the factorization of the final step for [X'WX]^-1
+        solver.solve_normal(xtwx, np.zeros((x.shape[1], 1)))
+        return betas, mu, None, n_iter
+    factor = linalg.cho_factor(xtwx, check_finite=False)
+    if hat == "influence":
+        xtx_inv_xt = _gwr_influence(x, wi, w, factor, i)
     else:
-        return betas, mu, v, w, z, xtx_inv_xt, n_iter
+        xtx_inv_xt = linalg.cho_solve(factor, (x * w * wi).T, check_finite=False)
+    return betas, mu, v, w, z, xtx_inv_xt, n_iter
+
+
+def batch_iwls(
+    y,
+    x,
+    family,
+    offset,
+    wi,
+    ini_betas=None,
+    tol=1.0e-8,
+    max_iter=200,
+    m=None,
+    block_size=256,
+    influence=False,
+    points=None,
+):
+    """
+    Iteratively re-weighted least squares for many local (GWR) models at once
+
+    Equivalent to calling iwls(..., wi=wi[i]) for every location i, but the
+    iterations of a block of locations run together: the local cross-products
+    X'W_iX are stacked into a (b, k, k) tensor and solved in one batched call.
+    Locations that have converged drop out of the active set.
+
+    Parameters
+    ----------
+    y           : array
+                  n*1, dependent variable
+
+    x           : array
+                  n*k, designs matrix of k independent variables
+
+    family      : family object
+                  probability models: Gaussian, Poisson, or Binomial
+
+    offset      : array
+                  n*1, the offset variable for each observation.
+
+    wi          : array or callable
+                  m*n, kernel weights of the n observations for each of the m
+                  locations, or a callable wi(start, stop) returning the
+                  (stop-start)*n block of weights for locations start:stop
+
+    ini_betas   : array
+                  k or m*k, starting values for the betas; as in iwls the
+                  first iteration starts from the fitted values they imply
+
+    tol         : float
+                  tolerance for estimation convergence
+
+    max_iter    : integer maximum number of iterations if convergence not met
+
+    m           : integer
+                  number of locations; required when wi is a callable
+
+    block_size  : integer
+                  number of locations fitted together; memory use is
+                  O(block_size * n)
+
+    influence   : boolean
+                  if True, also return the influence quantities of each
+                  location's own observation (see _gwr_influence), computed
+                  from the local factorizations at the final iteration
+
+    points      : array
+                  m, index of the observation at each regression point, used
+                  when influence is True. Default is range(m), which requires
+                  the locations to be the n observations
+
+    Returns
+    -------
+
+    betas       : array
+                  m*k, estimated coefficients for each location
+
+    n_iter      : array
+                  m, number of iterations for each location
+
+    converged   : array
+                  m, boolean, whether the location met tol within max_iter
+
+    influ       : array
+                  m, S_ii for each location; only if influence is True
+
+    tr_STS      : array
+                  m, sum of squared entries of row i of S; only if influence
+                  is True
+
+    CCT         : array
+                  m*k, diagonal of the local covariance of the betas up to
+                  scale; only if influence is True
+
+    """
+    y = np.asarray(y, dtype=float).reshape((1, -1))
+    offset = np.asarray(offset, dtype=float).reshape((1, -1))
+    n, k = x.shape
+    if callable(wi):
+        if m is None:
+            raise ValueError("m must be given when wi is a callable")
+        get_wi = wi
+    else:
+        wi = np.asarray(wi)
+        m = wi.shape[0]
+
+        def get_wi(start, stop):
+            return wi[start:stop]
+
+    # products of column pairs, so that X'W_iX for a block is one matmul
+    xx = (x[:, :, None] * x[:, None, :]).reshape((n, k * k))
+
+    if isinstance(family, Binomial):
+        y = family.link._clean(y)
+    v0, mu0 = _starting_values(family, y, offset)
+    kernel = family.iwls_kernel()
+
+    betas = np.zeros((m, k))
+    if ini_betas is not None:
+        betas[:] = np.asarray(ini_betas).reshape((-1, k))
+    n_iter = np.zeros(m, dtype=int)
+    converged = np.zeros(m, dtype=bool)
+    if influence:
+        points = np.arange(m) if points is None else np.asarray(points)
+        if points.shape != (m,) or points.max() >= n:
+            raise ValueError("points should hold one observation index per location")
+        influ = np.zeros(m)
+        tr_STS = np.zeros(m)
+        CCT = np.zeros((m, k))
+
+    for start in range(0, m, block_size):
+        stop = min(start + block_size, m)
+        w_block = np.asarray(get_wi(start, stop), dtype=float)
+        b_betas = betas[start:stop].copy()
+        b_iter = n_iter[start:stop]
+        if ini_betas is None:
+            v = np.repeat(v0, stop - start, axis=0)
+            mu = np.repeat(mu0, stop - start, axis=0)
+        else:
+            v = np.dot(b_betas, x.T)
+            mu = kernel.fitted(v, offset)
+        active = np.arange(stop - start)
+        while active.size:
+            b_iter[active] += 1
+            iw, z = kernel.working(y, v[active], mu[active])
+            w = w_block[active] * iw
+            xtx = np.dot(w, xx).reshape((-1, k, k))
+            xtz = np.dot(w * z, x)
+            n_betas = np.linalg.solve(xtx, xtz[:, :, None])[:, :, 0]
+            v[active] = np.dot(n_betas, x.T)
+            mu[active] = kernel.fitted(v[active], offset)
+            diff = np.min(np.abs(n_betas - b_betas[active]), axis=1)
+            b_betas[active] = n_betas
+            done = diff <= tol
+            converged[start + active[done]] = True
+            more = ~done & (b_iter[active] < max_iter)
+            if influence and not more.all():
+                f = ~more
+                loc = start + active[f]
+                pts = points[loc]
+                rows = np.arange(f.sum())
+                xi = x[pts]
+                xtx_inv = np.linalg.inv(xtx[f])
+                u = np.einsum("bij,bj->bi", xtx_inv, xi)
+                iw_i = iw[f][rows, pts]
+                influ[loc] = w[f][rows, pts] * np.einsum("bi,bi->b", xi, u)
+                xtwwx = np.dot(w[f] * w_block[active][f], xx).reshape((-1, k, k))
+                tr_STS[loc] = iw_i * np.einsum("bi,bij,bj->b", u, xtwwx, u)
+                CCT[loc] = np.einsum("bij,bjk,bik->bi", xtx_inv, xtwwx, xtx_inv)
+            active = active[more]
+        betas[start:stop] = b_betas
+
+    if influence:
+        return betas, n_iter, converged, influ, tr_STS, CCT
+    return betas, n_iter, converged
+
+
+def local_iwls(
+    y,
+    x,
+    family,
+    offset,
+    wi,
+    coords=None,
+    order="hilbert",
+    warm_start=True,
+    tol=1.0e-8,
+    max_iter=200,
+    m=None,
+    compare=False,
+):
+    """
+    Fit one local (GWR) model per location, visiting the locations in a
+    space-filling curve order and warm starting each fit from the converged
+    betas of the previously visited, and therefore nearby, location.
+
+    Parameters
+    ----------
+    y           : array
+                  n*1, dependent variable
+
+    x           : array
+                  n*k, designs matrix of k independent variables
+
+    family      : family object
+                  probability models: Gaussian, Poisson, or Binomial
+
+    offset      : array
+                  n*1, the offset variable for each observation.
+
+    wi          : array or callable
+                  m*n, kernel weights for each location, or a callable
+                  wi(start, stop) returning the weights of locations
+                  start:stop, as in batch_iwls
+
+    coords      : array
+                  m*2, coordinates of the locations; required if order is
+                  'hilbert'
+
+    order       : string or array
+                  'hilbert' (default) visits the locations in Hilbert curve
+                  order of coords; None visits them as given; an array is
+                  used as the visiting order
+
+    warm_start  : boolean
+                  if True (default) each fit starts from the betas of the
+                  previously visited location, provided that fit converged
+
+    tol         : float
+                  tolerance for estimation convergence
+
+    max_iter    : integer maximum number of iterations if convergence not met
+
+    m           : integer
+                  number of locations; required when wi is a callable and
+                  coords is None
+
+    compare     : boolean
+                  if True, also count the iterations of cold started fits
+                  (with batch_iwls) to report the savings
+
+    Returns
+    -------
+
+    betas       : array
+                  m*k, estimated coefficients for each location
+
+    n_iter      : array
+                  m, number of iterations for each location
+
+    info        : dict
+                  'order': visiting order; 'n_iter': total iterations;
+                  'n_iter_cold': total iterations of cold starts and 'saved':
+                  fraction of iterations saved, both None unless compare is
+                  True
+
+    """
+    if coords is not None:
+        m = len(coords)
+    elif not callable(wi):
+        m = np.asarray(wi).shape[0]
+    elif m is None:
+        raise ValueError("m must be given when wi is a callable")
+    if callable(wi):
+        get_wi = wi
+    else:
+        wi = np.asarray(wi)
+
+        def get_wi(start, stop):
+            return wi[start:stop]
+
+    if isinstance(order, str):
+        if order.lower() != "hilbert":
+            raise ValueError("order should be 'hilbert', None or an array")
+        if coords is None:
+            raise ValueError("coords must be given when order='hilbert'")
+        order = hilbert_order(coords)
+    elif order is None:
+        order = np.arange(m)
+    else:
+        order = np.asarray(order)
+
+    betas = np.zeros((m, x.shape[1]))
+    n_iter = np.zeros(m, dtype=int)
+    ini_betas = None
+    # one set of n-length arrays serves all m fits
+    workspace = Workspace(*x.shape)
+    for loc in order:
+        wi_loc = np.asarray(get_wi(loc, loc + 1), dtype=float).reshape((-1, 1))
+        rslt = iwls(
+            y,
+            x,
+            family,
+            offset,
+            None,
+            ini_betas,
+            tol,
+            max_iter,
+            wi=wi_loc,
+            workspace=workspace,
+        )
+        betas[loc] = rslt[0].ravel()
+        n_iter[loc] = rslt[-1]
+        # a fit that did not converge is a poor start for its neighbour
+        ini_betas = rslt[0] if warm_start and rslt[-1] < max_iter else None
+
+    info = {
+        "order": order,
+        "n_iter": int(n_iter.sum()),
+        "n_iter_cold": None,
+        "saved": None,
+    }
+    if compare:
+        cold = batch_iwls(
+            y, x, family, offset, get_wi, tol=tol, max_iter=max_iter, m=m
+        )[1]
+        info["n_iter_cold"] = int(cold.sum())
+        info["saved"] = 1.0 - info["n_iter"] / info["n_iter_cold"]
+    return betas, n_iter, info
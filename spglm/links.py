@@ -8,6 +8,16 @@ import scipy.stats
 FLOAT_EPS = np.finfo(float).eps
 
 
+def _into(result, out):
+    """
+    Copy result into out, for methods that have no in-place implementation.
+    """
+    if out is None:
+        return result
+    out[...] = result
+    return out
+
+
 class Link:
     """
     A generic link function for one-parameter exponential family.
@@ -31,7 +41,7 @@ class Link:
         """
         return NotImplementedError
 
-    def inverse(self, z):
+    def inverse(self, z, out=None):
         """
         Inverse of the link function.  Just a placeholder.
 
@@ -40,6 +50,8 @@ class Link:
         z : array-like
             `z` is usually the linear predictor of the transformed variable
             in the IRLS algorithm for GLM.
+        out : array, optional
+            Array of the same shape as `z` to write the result into.
 
         Returns
         -------
@@ -50,13 +62,17 @@ class Link:
         """
         return NotImplementedError
 
-    def deriv(self, p):
+    def deriv(self, p, out=None, work=None):
         """
         Derivative of the link function g'(p).  Just a placeholder.
 
         Parameters
         ----------
         p : array-like
+        out : array, optional
+            Array of the same shape as `p` to write the result into.
+        work : array, optional
+            Scratch array of the same shape as `p`; allocated if not given.
 
         Returns
         -------
@@ -111,7 +127,7 @@ class Logit(Link):
     logit = Logit()
     """
 
-    def _clean(self, p):
+    def _clean(self, p, out=None):
         """
         Clip logistic values to range (eps, 1-eps)
 
@@ -119,13 +135,15 @@ class Logit(Link):
         -----------
         p : array-like
             Probabilities
+        out : array, optional
+            Array to write the clipped values into
 
         Returns
         --------
         pclip : array
             Clipped probabilities
         """
-        return np.clip(p, FLOAT_EPS, 1.0 - FLOAT_EPS)
+        return np.clip(p, FLOAT_EPS, 1.0 - FLOAT_EPS, out=out)
 
     def __call__(self, p):
         """
@@ -148,7 +166,7 @@ class Logit(Link):
         p = self._clean(p)
         return np.log(p / (1.0 - p))
 
-    def inverse(self, z):
+    def inverse(self, z, out=None):
         """
         Inverse of the logit transform
 
@@ -156,6 +174,8 @@ class Logit(Link):
         ----------
         z : array-like
             The value of the logit transform at `p`
+        out : array, optional
+            Array of the same shape as `z` to write the result into.
 
         Returns
         -------
@@ -166,11 +186,16 @@ class Logit(Link):
         -----
         g^(-1)(z) = exp(z)/(1+exp(z))
         """
-        z = np.asarray(z)
-        t = np.exp(-z)
-        return 1.0 / (1.0 + t)
+        if out is None:
+            z = np.asarray(z)
+            t = np.exp(-z)
+            return 1.0 / (1.0 + t)
+        np.negative(z, out=out)
+        np.exp(out, out=out)
+        np.add(1.0, out, out=out)
+        return np.divide(1.0, out, out=out)
 
-    def deriv(self, p):
+    def deriv(self, p, out=None, work=None):
         """
         Derivative of the logit transform
 
@@ -178,6 +203,10 @@ class Logit(Link):
         ----------
         p: array-like
             Probabilities
+        out : array, optional
+            Array of the same shape as `p` to write the result into.
+        work : array, optional
+            Scratch array of the same shape as `p`; allocated if not given.
 
         Returns
         -------
@@ -191,8 +220,13 @@ class Logit(Link):
         Alias for `Logit`:
         logit = Logit()
         """
-        p = self._clean(p)
-        return 1.0 / (p * (1 - p))
+        if out is None:
+            p = self._clean(p)
+            return 1.0 / (p * (1 - p))
+        p = self._clean(p, out=work)
+        np.subtract(1, p, out=out)
+        np.multiply(p, out, out=out)
+        return np.divide(1.0, out, out=out)
 
     def inverse_deriv(self, z):
         """
@@ -277,7 +311,7 @@ class Power(Link):
         z = np.power(p, self.power)
         return z
 
-    def inverse(self, z):
+    def inverse(self, z, out=None):
         """
         Inverse of the power transform link function
 
@@ -285,6 +319,8 @@ class Power(Link):
         ----------
         `z` : array-like
             Value of the transformed mean parameters at `p`
+        out : array, optional
+            Array of the same shape as `z` to write the result into.
 
         Returns
         -------
@@ -296,10 +332,10 @@ class Power(Link):
         g^(-1)(z`) = `z`**(1/`power`)
         """
 
-        p = np.power(z, 1.0 / self.power)
+        p = np.power(z, 1.0 / self.power, out=out)
         return p
 
-    def deriv(self, p):
+    def deriv(self, p, out=None, work=None):  # noqa: ARG002 - work is unused
         """
         Derivative of the power transform
 
@@ -307,6 +343,10 @@ class Power(Link):
         ----------
         p : array-like
             Mean parameters
+        out : array, optional
+            Array of the same shape as `p` to write the result into.
+        work : array, optional
+            Scratch array of the same shape as `p`; allocated if not given.
 
         Returns
         --------
@@ -317,7 +357,10 @@ class Power(Link):
         -----
         g'(`p`) = `power` * `p`**(`power` - 1)
         """
-        return self.power * np.power(p, self.power - 1)
+        if out is None:
+            return self.power * np.power(p, self.power - 1)
+        np.power(p, self.power - 1, out=out)
+        return np.multiply(self.power, out, out=out)
 
     def deriv2(self, p):
         """
@@ -427,8 +470,8 @@ class Log(Link):
     machine epsilon so that p is in (0,1). log is an alias of Log.
     """
 
-    def _clean(self, x):
-        return np.clip(x, FLOAT_EPS, np.inf)
+    def _clean(self, x, out=None):
+        return np.clip(x, FLOAT_EPS, np.inf, out=out)
 
     def __call__(self, p):
         """
@@ -451,7 +494,7 @@ class Log(Link):
         x = self._clean(p)
         return np.log(x)
 
-    def inverse(self, z):
+    def inverse(self, z, out=None):
         """
         Inverse of log transform link function
 
@@ -459,6 +502,8 @@ class Log(Link):
         ----------
         z : array
             The inverse of the link function at `p`
+        out : array, optional
+            Array of the same shape as `z` to write the result into.
 
         Returns
         -------
@@ -469,9 +514,9 @@ class Log(Link):
         -----
         g^{-1}(z) = exp(z)
         """
-        return np.exp(z)
+        return np.exp(z, out=out)
 
-    def deriv(self, p):
+    def deriv(self, p, out=None, work=None):  # noqa: ARG002 - work is unused
         """
         Derivative of log transform link function
 
@@ -479,6 +524,10 @@ class Log(Link):
         ----------
         p : array-like
             Mean parameters
+        out : array, optional
+            Array of the same shape as `p` to write the result into.
+        work : array, optional
+            Scratch array of the same shape as `p`; allocated if not given.
 
         Returns
         -------
@@ -489,8 +538,11 @@ class Log(Link):
         -----
         g'(x) = 1/x
         """
-        p = self._clean(p)
-        return 1.0 / p
+        if out is None:
+            p = self._clean(p)
+            return 1.0 / p
+        self._clean(p, out=out)
+        return np.divide(1.0, out, out=out)
 
     def deriv2(self, p):
         """
@@ -585,7 +637,7 @@ class CDFLink(Logit):
         p = self._clean(p)
         return self.dbn.ppf(p)
 
-    def inverse(self, z):
+    def inverse(self, z, out=None):
         """
         The inverse of the CDF link
 
@@ -593,6 +645,8 @@ class CDFLink(Logit):
         ----------
         z : array-like
             The value of the inverse of the link function at `p`
+        out : array, optional
+            Array of the same shape as `z` to write the result into.
 
         Returns
         -------
@@ -603,9 +657,9 @@ class CDFLink(Logit):
         -----
         g^(-1)(`z`) = `dbn`.cdf(`z`)
         """
-        return self.dbn.cdf(z)
+        return _into(self.dbn.cdf(z), out)
 
-    def deriv(self, p):
+    def deriv(self, p, out=None, work=None):  # noqa: ARG002 - work is unused
         """
         Derivative of CDF link
 
@@ -613,6 +667,10 @@ class CDFLink(Logit):
         ----------
         p : array-like
             mean parameters
+        out : array, optional
+            Array of the same shape as `p` to write the result into.
+        work : array, optional
+            Scratch array of the same shape as `p`; allocated if not given.
 
         Returns
         -------
@@ -624,7 +682,7 @@ class CDFLink(Logit):
         g'(`p`) = 1./ `dbn`.pdf(`dbn`.ppf(`p`))
         """
         p = self._clean(p)
-        return 1.0 / self.dbn.pdf(self.dbn.ppf(p))
+        return _into(1.0 / self.dbn.pdf(self.dbn.ppf(p)), out)
 
     def deriv2(self, p):
         """
@@ -666,7 +724,27 @@ class probit(CDFLink):
     probit is an alias of CDFLink.
     """
 
-    pass
+    def deriv2(self, p):
+        """
+        Second derivative of the probit link function
+
+        Parameters
+        ----------
+        p : array-like
+            Mean parameters
+
+        Returns
+        -------
+        g''(p) : array
+            The value of the second derivative of the probit link at `p`
+
+        Notes
+        -----
+        g''(`p`) = q / pdf(q)**2, where q = norm.ppf(`p`)
+        """
+        p = self._clean(p)
+        q = self.dbn.ppf(p)
+        return q / self.dbn.pdf(q) ** 2
 
 
 class cauchy(CDFLink):
@@ -735,7 +813,7 @@ class CLogLog(Logit):
         p = self._clean(p)
         return np.log(-np.log(1 - p))
 
-    def inverse(self, z):
+    def inverse(self, z, out=None):
         """
         Inverse of C-Log-Log transform link function
 
@@ -744,6 +822,8 @@ class CLogLog(Logit):
         ----------
         z : array-like
             The value of the inverse of the CLogLog link function at `p`
+        out : array, optional
+            Array of the same shape as `z` to write the result into.
 
         Returns
         -------
@@ -754,9 +834,14 @@ class CLogLog(Logit):
         -----
         g^(-1)(`z`) = 1-exp(-exp(`z`))
         """
-        return 1 - np.exp(-np.exp(z))
+        if out is None:
+            return 1 - np.exp(-np.exp(z))
+        np.exp(z, out=out)
+        np.negative(out, out=out)
+        np.exp(out, out=out)
+        return np.subtract(1, out, out=out)
 
-    def deriv(self, p):
+    def deriv(self, p, out=None, work=None):
         """
         Derivative of C-Log-Log transform link function
 
@@ -764,6 +849,10 @@ class CLogLog(Logit):
         ----------
         p : array-like
             Mean parameters
+        out : array, optional
+            Array of the same shape as `p` to write the result into.
+        work : array, optional
+            Scratch array of the same shape as `p`; allocated if not given.
 
         Returns
         -------
@@ -774,8 +863,15 @@ class CLogLog(Logit):
         -----
         g'(p) = - 1 / ((p-1)*log(1-p))
         """
-        p = self._clean(p)
-        return 1.0 / ((p - 1) * (np.log(1 - p)))
+        if out is None:
+            p = self._clean(p)
+            return 1.0 / ((p - 1) * (np.log(1 - p)))
+        p = self._clean(p, out=work)
+        np.subtract(1, p, out=out)
+        np.log(out, out=out)
+        np.subtract(p, 1, out=p)
+        np.multiply(p, out, out=out)
+        return np.divide(1.0, out, out=out)
 
     def deriv2(self, p):
         """
@@ -868,7 +964,7 @@ class NegativeBinomial:
         p = self._clean(p)
         return np.log(p / (p + 1 / self.alpha))
 
-    def inverse(self, z):
+    def inverse(self, z, out=None):
         """
         Inverse of the negative binomial transform
 
@@ -876,6 +972,8 @@ class NegativeBinomial:
         -----------
         z : array-like
             The value of the inverse of the negative binomial link at `p`.
+        out : array, optional
+            Array of the same shape as `z` to write the result into.
 
         Returns
         -------
@@ -886,9 +984,9 @@ class NegativeBinomial:
         -----
         g^(-1)(z) = exp(z)/(alpha*(1-exp(z)))
         """
-        return -1 / (self.alpha * (1 - np.exp(-z)))
+        return _into(-1 / (self.alpha * (1 - np.exp(-z))), out)
 
-    def deriv(self, p):
+    def deriv(self, p, out=None, work=None):  # noqa: ARG002 - work is unused
         """
         Derivative of the negative binomial transform
 
@@ -896,6 +994,10 @@ class NegativeBinomial:
         ----------
         p : array-like
             Mean parameters
+        out : array, optional
+            Array of the same shape as `p` to write the result into.
+        work : array, optional
+            Scratch array of the same shape as `p`; allocated if not given.
 
         Returns
         -------
@@ -906,7 +1008,7 @@ class NegativeBinomial:
         -----
         g'(x) = 1/(x+alpha*x^2)
         """
-        return 1 / (p + self.alpha * p**2)
+        return _into(1 / (p + self.alpha * p**2), out)
 
     def deriv2(self, p):
         """
@@ -0,0 +1,209 @@
+"""
+GLM estimation by quasi-Newton and trust-region minimisation of the deviance.
+
+For designs with many columns, iwls forms and factorises the k*k X'WX on
+every iteration at a cost of O(nk^2 + k^3). The routines here minimise the
+deviance with scipy.optimize instead, and touch X only through the products
+X b and X'r, so an iteration costs O(nk) (O(nnz) for a sparse X): L-BFGS
+uses the gradient alone, and the truncated Newton-CG trust-region method
+adds Hessian-vector products X'(W (X p)) with the observed information
+weights. The k*k information matrix is formed only if the covariance of the
+estimates is asked for.
+"""
+
+import numpy as np
+from scipy import optimize
+from scipy import sparse as sp
+
+from .iwls import _deviance, _link_betas, _monitor, _valid_mu
+
+# GLM.fit solve option: scipy.optimize.minimize method
+METHODS = {"lbfgs": "L-BFGS-B", "trust-ncg": "trust-ncg"}
+
+
+class _Stop(Exception):  # noqa: N818 - control flow, not an error
+    """
+    Raised from the minimize callback when the user callback asks to stop.
+    """
+
+
+class _Objective:
+    """
+    Deviance / 2n of a GLM and its derivatives in the betas. The fitted
+    values of the last betas evaluated are kept, as scipy asks for the value,
+    the gradient and the Hessian products at the same point.
+    """
+
+    def __init__(self, y, x, family, offset):
+        self.y = y
+        self.x = x
+        self.family = family
+        self.offset = offset
+        self.kernel = family.iwls_kernel()
+        self.n = x.shape[0]
+        self.betas = None
+
+    def _update(self, betas):
+        if self.betas is not None and np.array_equal(betas, self.betas):
+            return
+        with np.errstate(all="ignore"):
+            self.v = self.x @ betas
+            self.mu = self.kernel.fitted(self.v, self.offset)
+        self.betas = betas.copy()
+
+    def fun(self, betas):
+        self._update(betas)
+        if not _valid_mu(self.family, self.mu):
+            return np.inf
+        with np.errstate(all="ignore"):
+            deviance = _deviance(self.family, self.y, self.mu)
+        return deviance / (2 * self.n) if np.isfinite(deviance) else np.inf
+
+    def jac(self, betas):
+        # -X'W(z - v) / n, minus the score of iwls
+        self._update(betas)
+        w, z = self.kernel.working(self.y, self.v, self.mu)
+        return -(self.x.T @ (w * (z - self.v))) / self.n
+
+    def hessp(self, betas, p):
+        self._update(betas)
+        w, _ = self.kernel.observed(self.y, self.v, self.mu)
+        return self.x.T @ (w * (self.x @ p)) / self.n
+
+
+def optimize_glm(
+    y,
+    x,
+    family,
+    offset,
+    ini_betas=None,
+    tol=1.0e-8,
+    max_iter=200,
+    method="lbfgs",
+    info=None,
+    callback=None,
+    trace=False,
+):
+    """
+    Estimate a GLM by direct minimisation of its deviance.
+
+    Parameters
+    ----------
+    y           : array
+                  n*1, dependent variable
+
+    x           : array or sparse matrix
+                  n*k, design matrix of k independent variables
+
+    family      : family object
+                  probability models: Gaussian, Poisson, or Binomial
+
+    offset      : array
+                  n*1, the offset variable for each observation
+
+    ini_betas   : array
+                  k*1, starting values for the betas. Default is None, which
+                  starts from the least squares fit (by LSQR) of the
+                  linear predictor iwls starts from
+
+    tol         : float
+                  tolerance on the largest entry of the score X'W(z - v) / n,
+                  the 'gradient' criterion of iwls. For 'trust-ncg' it bounds
+                  the Euclidean norm of the score
+
+    max_iter    : integer maximum number of iterations if convergence not met
+
+    method      : string
+                  'lbfgs' (default), limited memory BFGS, which uses the
+                  gradient only; or 'trust-ncg', a Newton-CG trust-region
+                  method on Hessian-vector products with the observed
+                  information, which needs fewer iterations
+
+    info        : dict
+                  if given, filled with the 'criterion' ('gradient'), its
+                  final 'value' and whether the fit 'converged' as reported
+                  by scipy.optimize
+
+    callback    : callable
+                  called after every iteration as in iwls; the fit stops if
+                  it returns True
+
+    trace       : boolean
+                  if True, info['trace'] holds the per-iteration records as
+                  in iwls, with 'conv_value' the largest entry of the score
+                  and 'solver' the method
+
+    Returns
+    -------
+    betas       : array
+                  k*1, estimated coefficients
+
+    mu          : array
+                  n*1, predicted y values
+
+    wx          : array or sparse matrix
+                  n*k, the design weighted by the square root of the final
+                  iwls weights, from which the covariance is computed
+
+    n_iter      : integer
+                  number of iterations
+    """
+    if method not in METHODS:
+        raise ValueError(f"method should be 'lbfgs' or 'trust-ncg'. (got {method})")
+    n = x.shape[0]
+    y = np.asarray(y, dtype=float).reshape(n)
+    offset = np.asarray(offset, dtype=float).reshape(n)
+    if ini_betas is None:
+        betas = _link_betas(y, x, family, offset).ravel()
+    else:
+        betas = np.asarray(ini_betas, dtype=float).reshape(-1)
+    objective = _Objective(y, x, family, offset)
+    if not np.isfinite(objective.fun(betas)):
+        raise ValueError("the starting values give invalid fitted values")
+    if method == "lbfgs":
+        options = {"maxiter": max_iter, "gtol": tol, "ftol": 0.0}
+        hessp = None
+    else:
+        options = {"maxiter": max_iter, "gtol": tol}
+        hessp = objective.hessp
+    monitor = _monitor(trace, callback, method, family, y)
+    if monitor is not None:
+        previous = [betas, 0]
+
+        # callback(xk), as scipy < 1.11 does not pass an OptimizeResult nor
+        # handle StopIteration
+        def iterated(xk):
+            n_betas = xk
+            previous[1] += 1
+            diff = np.max(np.abs(objective.jac(n_betas)))
+            deviance = 2 * objective.n * objective.fun(n_betas)
+            stop = monitor(previous[1], previous[0], n_betas, diff, deviance)
+            previous[0] = n_betas.copy()
+            if stop:
+                raise _Stop
+
+    try:
+        res = optimize.minimize(
+            objective.fun,
+            betas,
+            method=METHODS[method],
+            jac=objective.jac,
+            hessp=hessp,
+            options=options,
+            callback=None if monitor is None else iterated,
+        )
+    except _Stop:
+        res = optimize.OptimizeResult(x=previous[0], nit=previous[1], success=False)
+    betas = res.x
+    score = objective.jac(betas)
+    if info is not None:
+        info["criterion"] = "gradient"
+        info["value"] = float(np.max(np.abs(score)))
+        info["converged"] = bool(res.success)
+        if monitor is not None:
+            monitor.record(info)
+    objective._update(betas)
+    w, _ = objective.kernel.working(y, objective.v, objective.mu)
+    sqrt_w = np.sqrt(w)
+    wx = sp.diags(sqrt_w) @ x if sp.issparse(x) else x * sqrt_w[:, None]
+    return betas.reshape((-1, 1)), objective.mu.reshape((-1, 1)), wx, res.nit
@@ -0,0 +1,347 @@
+"""
+Stage-level profiling of GLM estimation.
+
+GLM, iwls and GLMResults mark their stages (input validation, weights, Gram
+build, solve, prediction and each lazy diagnostic) with `stage`. While
+profiling is on, every stage that runs sends one record to the active sink:
+
+    stage   : name of the stage, e.g. 'gram' or 'GLMResults.aic'
+    parent  : name of the enclosing stage, or None
+    time    : wall seconds spent in the stage, its children included
+    self    : wall seconds spent in the stage less its children
+    bytes   : net bytes allocated by the stage and still held on exit
+    peak    : most bytes held at once by the stage above those held on entry
+
+bytes and peak are measured with tracemalloc, which NumPy reports its array
+buffers to; they are None if profiling was turned on with memory=False.
+
+Profiling is turned on for a block of code with `profile`, or for the whole
+process with the SPGLM_PROFILE environment variable: '1' collects the
+records in a MemorySink (see `get_sink`) and any other value is the path of
+a JSON-lines file they are appended to. When it is off a stage costs a
+function call and a global lookup.
+
+Examples
+--------
+>>> from spglm import profiling
+>>> with profiling.profile() as sink:
+...     results = GLM(y, X).fit()
+...     aic = results.aic
+>>> totals = sink.summary()
+>>> totals["gram"]["count"] == results.fit_params["n_iter"]
+True
+"""
+
+import atexit
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+__all__ = [
+    "MemorySink",
+    "JSONLinesSink",
+    "CallbackSink",
+    "profile",
+    "stage",
+    "profiled",
+    "enabled",
+    "get_sink",
+]
+
+ENVIRON = "SPGLM_PROFILE"
+
+_sink = None
+_memory = False
+_lock = threading.Lock()
+_local = threading.local()
+_NULL = contextlib.nullcontext()
+
+
+class Sink:
+    """
+    A destination for stage records.
+
+    `Sink` does nothing, but lays out the methods expected of any subclass.
+    `write` is called under a lock, so a sink need not be thread safe.
+    """
+
+    def write(self, record):
+        """
+        Take one stage record, a dict; see the module docstring.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Release any resources held by the sink.
+        """
+
+
+class MemorySink(Sink):
+    """
+    Keeps the records in a list.
+
+    Attributes
+    ----------
+    records     : list
+                  the stage records, in the order the stages ended
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+    def summary(self):
+        """
+        Totals of the records by stage.
+
+        Returns
+        -------
+        summary     : dict
+                      maps each stage name to a dict of its 'count' and its
+                      summed 'time', 'self' and 'bytes', in order of
+                      decreasing self time
+        """
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(
+                record["stage"], {"count": 0, "time": 0.0, "self": 0.0, "bytes": 0}
+            )
+            total["count"] += 1
+            total["time"] += record["time"]
+            total["self"] += record["self"]
+            total["bytes"] += record["bytes"] or 0
+        return dict(sorted(totals.items(), key=lambda item: -item[1]["self"]))
+
+    def clear(self):
+        self.records = []
+
+
+class JSONLinesSink(Sink):
+    """
+    Appends each record as a line of JSON to a file.
+
+    Parameters
+    ----------
+    path        : string
+                  file the records are appended to; opened on the first
+                  record and kept open until `close`
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def write(self, record):
+        if self._file is None:
+            self._file = open(self.path, "a")  # noqa: SIM115 - closed by close
+        self._file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CallbackSink(Sink):
+    """
+    Calls a function with each record.
+
+    Parameters
+    ----------
+    func        : callable
+                  called as func(record)
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def write(self, record):
+        self.func(record)
+
+
+def _as_sink(sink):
+    if sink is None:
+        return MemorySink()
+    if isinstance(sink, Sink):
+        return sink
+    if isinstance(sink, (str, os.PathLike)):
+        return JSONLinesSink(sink)
+    if callable(sink):
+        return CallbackSink(sink)
+    raise TypeError(
+        f"sink should be a Sink, a path or a callable. (got {type(sink).__name__})"
+    )
+
+
+class _Stage:
+    __slots__ = ("name", "parent", "start", "child", "current", "peak")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1] if stack else None
+        self.child = 0.0
+        if _memory and tracemalloc.is_tracing():
+            self.current, peak = tracemalloc.get_traced_memory()
+            if self.parent is not None and self.parent.peak is not None:
+                # the peak is reset for this stage; keep the parent's so far
+                self.parent.peak = max(self.parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.peak = self.current
+        else:
+            self.current = self.peak = None
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        _local.stack.pop()
+        nbytes = peak = None
+        if self.peak is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            nbytes = current - self.current
+            peak = self.peak - self.current
+        parent = self.parent
+        if parent is not None:
+            parent.child += elapsed
+            if self.peak is not None and parent.peak is not None:
+                parent.peak = max(parent.peak, self.peak)
+        record = {
+            "stage": self.name,
+            "parent": None if parent is None else parent.name,
+            "time": elapsed,
+            "self": elapsed - self.child,
+            "bytes": nbytes,
+            "peak": peak,
+        }
+        sink = _sink
+        if sink is not None:
+            with _lock:
+                sink.write(record)
+        return False
+
+
+def stage(name):
+    """
+    Context manager marking a stage of the estimation; a no-op unless
+    profiling is on.
+
+    Parameters
+    ----------
+    name        : string
+                  name of the stage in its records
+    """
+    if _sink is None:
+        return _NULL
+    return _Stage(name)
+
+
+def profiled(name):
+    """
+    Decorator marking a whole function as a stage; see `stage`.
+    """
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _sink is None:
+                return func(*args, **kwargs)
+            with _Stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def enabled():
+    """
+    Whether profiling is on.
+    """
+    return _sink is not None
+
+
+def get_sink():
+    """
+    The active sink, or None if profiling is off.
+    """
+    return _sink
+
+
+def _start(sink, memory):
+    global _sink, _memory
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _sink, _memory = sink, memory
+    return started
+
+
+@contextlib.contextmanager
+def profile(sink=None, memory=True):
+    """
+    Turn profiling on for the enclosed code.
+
+    Parameters
+    ----------
+    sink        : Sink, string or callable
+                  where the stage records go: a Sink; a path, for a
+                  JSONLinesSink that is closed on exit; or a callable, for a
+                  CallbackSink. Default is None, a new MemorySink.
+    memory      : boolean
+                  if True (default) bytes allocated are measured with
+                  tracemalloc, which is started for the block if it is not
+                  tracing already. Tracing slows allocation down, so
+                  memory=False is cheaper when only the times are of
+                  interest.
+
+    Yields
+    ------
+    sink        : Sink
+                  the sink receiving the records
+
+    The previous sink, if any, is restored on exit. The stages of all
+    threads go to the sink while the block runs.
+    """
+    owned = isinstance(sink, (str, os.PathLike))
+    sink = _as_sink(sink)
+    previous = (_sink, _memory)
+    started = _start(sink, memory)
+    try:
+        yield sink
+    finally:
+        _start(*previous)
+        if started:
+            tracemalloc.stop()
+        if owned:
+            sink.close()
+
+
+def _from_environ(value):
+    """
+    The sink for a value of SPGLM_PROFILE, or None if it is empty or '0'.
+    """
+    if not value or value == "0":
+        return None
+    if value == "1":
+        return MemorySink()
+    return JSONLinesSink(value)
+
+
+_environ_sink = _from_environ(os.environ.get(ENVIRON, ""))
+if _environ_sink is not None:
+    _start(_environ_sink, True)
+    atexit.register(_environ_sink.close)
@@ -0,0 +1,651 @@
+"""
+Linear solvers for the weighted least squares step of the IWLS routine.
+
+Each solver solves X'WX b = X'Wz for the current (square-root) weighted design
+and keeps the factorization of the final step, so that [X'WX]^-1 can be
+recovered after estimation without inverting X'WX again. The iterative LSMR
+and sketch-preconditioned LSQR solvers keep the final weighted design
+instead.
+"""
+
+import warnings
+
+import numpy as np
+from scipy import fft, linalg
+from scipy import sparse as sp
+from scipy.sparse import linalg as spla
+from spreg.utils import spdot
+
+from .profiling import stage
+
+FLOAT_EPS = np.finfo(float).eps
+# share of nonzero rows above which Schur treats a column of X as dense
+DENSE_FRACTION = 0.1
+
+
+class Solver:
+    """
+    A generic solver for the IWLS normal equations.
+
+    `Solver` does nothing, but lays out the methods expected of any subclass.
+    A solver instance is stateful: `solve` replaces the stored factorization
+    on every call and `inv` reuses the most recent one.
+    """
+
+    name = None
+
+    def solve(self, wz, wx):
+        """
+        Solve the weighted least squares problem min ||wz - wx b||.
+
+        Parameters
+        ----------
+        wz : array
+            n*1, square-root weighted working response
+        wx : array or sparse matrix
+            n*k, square-root weighted design matrix
+
+        Returns
+        -------
+        betas : array
+            k*1, estimated coefficients
+        """
+        raise NotImplementedError
+
+    def solve_normal(self, xtx, xtz):
+        """
+        Solve X'WX b = X'Wz from the accumulated cross-products, for when the
+        design is never held in memory in full (e.g. streamed by blocks).
+
+        Parameters
+        ----------
+        xtx : array or sparse matrix
+            k*k, weighted cross-product X'WX
+        xtz : array
+            k*1, weighted cross-product X'Wz
+
+        Returns
+        -------
+        betas : array
+            k*1, estimated coefficients
+        """
+        raise ValueError(
+            f"The {self.name} solver works on the design itself and cannot "
+            "solve from X'WX; use solver='cholesky', 'splu' or 'svd'."
+        )
+
+    def inv(self):
+        """
+        [X'WX]^-1 computed from the factorization of the last `solve` call.
+
+        Returns
+        -------
+        xtx_inv : array
+            k*k, inverse (or pseudo-inverse) of the weighted cross-product
+        """
+        raise NotImplementedError
+
+    def rank(self):
+        """
+        Numerical rank of the weighted design found by the last `solve` call.
+
+        Returns
+        -------
+        rank : integer or None
+            number of columns not aliased, or None for a solver that assumes
+            a full rank design
+        """
+        return None
+
+    def _check_solved(self):
+        if getattr(self, "_factor", None) is None:
+            raise ValueError("solve must be called before inv")
+
+    def _check_dense(self, wx):
+        if sp.issparse(wx):
+            raise ValueError(
+                f"The {self.name} solver requires a dense design; use "
+                "solver='cholesky' or solver='splu' for sparse X."
+            )
+
+
+class Cholesky(Solver):
+    """
+    Cholesky factorization of the normal equations X'WX = R'R.
+
+    The fastest backend and the default. Requires X'WX to be positive
+    definite, so it fails on rank deficient designs; use `QR` or `SVD` for
+    those.
+    """
+
+    name = "cholesky"
+
+    def solve(self, wz, wx):
+        xT = wx.T
+        with stage("gram"):
+            xtx, xtz = spdot(xT, wx), spdot(xT, wz)
+        return self.solve_normal(xtx, xtz)
+
+    def solve_normal(self, xtx, xtz):
+        try:
+            self._factor = linalg.cho_factor(xtx, check_finite=False)
+        except linalg.LinAlgError as e:
+            raise linalg.LinAlgError(
+                "X'WX is not positive definite; the design may be rank "
+                "deficient. Use solver='qr' or solver='svd'."
+            ) from e
+        return linalg.cho_solve(self._factor, np.asarray(xtz), check_finite=False)
+
+    def inv(self):
+        self._check_solved()
+        k = self._factor[0].shape[0]
+        return linalg.cho_solve(self._factor, np.eye(k), check_finite=False)
+
+
+class SparseLU(Solver):
+    """
+    Sparse LU factorization of the normal equations X'WX.
+
+    For sparse designs with many columns: X'WX is accumulated as a sparse
+    matrix and factored with SuperLU, so neither X nor X'WX is densified.
+    Only [X'WX]^-1, when requested through `inv`, is dense.
+    """
+
+    name = "splu"
+
+    def solve(self, wz, wx):
+        xT = wx.T
+        with stage("gram"):
+            xtx, xtz = xT @ wx, xT @ wz
+        return self.solve_normal(xtx, xtz)
+
+    def solve_normal(self, xtx, xtz):
+        self._factor = spla.splu(sp.csc_matrix(xtx), permc_spec="MMD_AT_PLUS_A")
+        return self._factor.solve(np.asarray(xtz))
+
+    def inv(self):
+        self._check_solved()
+        return self._factor.solve(np.eye(self._factor.shape[0]))
+
+
+class Schur(Solver):
+    """
+    Block elimination of the normal equations of a design with a few dense
+    columns and many sparse ones, e.g. continuous covariates next to a large
+    set of indicators.
+
+    With D the dense and S the sparse columns, X'WX = [[A, B], [B', C]] with
+    A = D'WD, B = D'WS and C = S'WS. C is factored sparse, or just inverted
+    if it is diagonal, as for indicators of a single factor, and the small
+    Schur complement A - B C^-1 B' is factored with dense Cholesky. Nothing
+    is densified but the p*q block C^-1 B', and nothing is solved
+    iteratively. [X'WX]^-1 is exact; its block for the dense columns is the
+    inverse of the Schur complement, which `inv_dense` returns without
+    forming the q*q block of the sparse columns.
+
+    Parameters
+    ----------
+    dense : integer or array
+        the dense columns of X: the number of leading columns, or their
+        indices. Default is None, which takes the columns with nonzeros in
+        more than DENSE_FRACTION of the rows, found on the first `solve` (or
+        from the rows of X'WX on a first `solve_normal`).
+    """
+
+    name = "schur"
+
+    def __init__(self, dense=None):
+        self.dense = dense
+        self._index = None
+
+    def _split(self, k, density):
+        # the dense and sparse column indices, fixed on the first call
+        if self._index is None:
+            if self.dense is None:
+                dense = np.flatnonzero(density() > DENSE_FRACTION)
+            elif np.isscalar(self.dense):
+                dense = np.arange(int(self.dense))
+            else:
+                dense = np.asarray(self.dense)
+            sparse_ = np.setdiff1d(np.arange(k), dense)
+            self._index = (dense, sparse_)
+        return self._index
+
+    def solve(self, wz, wx):
+        n, k = wx.shape
+
+        def density():
+            if sp.issparse(wx):
+                return np.diff(sp.csc_matrix(wx).indptr) / n
+            return np.count_nonzero(wx, axis=0) / n
+
+        self._split(k, density)
+        xT = wx.T
+        with stage("gram"):
+            xtx, xtz = xT @ wx, xT @ wz
+        return self.solve_normal(xtx, xtz)
+
+    def solve_normal(self, xtx, xtz):
+        xtx = sp.csr_matrix(xtx)
+        k = xtx.shape[0]
+        dense, sparse_ = self._split(k, lambda: np.diff(xtx.indptr) / k)
+        xtz = np.asarray(xtz).reshape((k, -1))
+        a = xtx[dense][:, dense].toarray()
+        b = xtx[dense][:, sparse_].toarray()
+        c = sp.csc_matrix(xtx[sparse_][:, sparse_])
+        diag = c.diagonal()
+        if c.nnz == np.count_nonzero(diag):
+            # a diagonal block, e.g. the indicators of a single factor
+            if not diag.all():
+                raise linalg.LinAlgError(
+                    "The block of X'WX of the sparse columns is singular; a "
+                    "column may have no nonzero weights."
+                )
+
+            def c_solve(r):
+                return r / diag[:, None]
+
+        else:
+            c_solve = spla.splu(c, permc_spec="MMD_AT_PLUS_A").solve
+        cinv_bt = c_solve(b.T)
+        try:
+            s_factor = linalg.cho_factor(a - np.dot(b, cinv_bt), check_finite=False)
+        except linalg.LinAlgError as e:
+            raise linalg.LinAlgError(
+                "The Schur complement of X'WX is not positive definite; the "
+                "design may be rank deficient."
+            ) from e
+        self._factor = (dense, sparse_, c_solve, cinv_bt, s_factor)
+        z_s = c_solve(xtz[sparse_])
+        betas = np.empty_like(xtz, dtype=float)
+        betas[dense] = linalg.cho_solve(
+            s_factor, xtz[dense] - np.dot(b, z_s), check_finite=False
+        )
+        betas[sparse_] = z_s - np.dot(cinv_bt, betas[dense])
+        return betas
+
+    def inv_dense(self):
+        """
+        The block of [X'WX]^-1 of the dense columns, i.e. the inverse of the
+        Schur complement.
+
+        Returns
+        -------
+        xtx_inv : array
+            p*p, in the order of the dense columns
+        """
+        self._check_solved()
+        s_factor = self._factor[-1]
+        p = s_factor[0].shape[0]
+        return linalg.cho_solve(s_factor, np.eye(p), check_finite=False)
+
+    def inv(self):
+        self._check_solved()
+        dense, sparse_, c_solve, cinv_bt, _ = self._factor
+        q = len(sparse_)
+        s_inv = self.inv_dense()
+        k = len(dense) + q
+        xtx_inv = np.empty((k, k))
+        cross = -np.dot(cinv_bt, s_inv)
+        xtx_inv[np.ix_(dense, dense)] = s_inv
+        xtx_inv[np.ix_(sparse_, dense)] = cross
+        xtx_inv[np.ix_(dense, sparse_)] = cross.T
+        xtx_inv[np.ix_(sparse_, sparse_)] = c_solve(np.eye(q)) - np.dot(
+            cross, cinv_bt.T
+        )
+        return xtx_inv
+
+
+class QR(Solver):
+    """
+    Column pivoted QR factorization of the weighted design W^1/2 X = QRP'.
+
+    Works on the design itself rather than on X'WX, so the condition number is
+    not squared. Columns that are numerically linearly dependent on earlier
+    ones are aliased: their coefficients are set to 0 and their covariance
+    entries to NaN, as in R's lm/glm.
+    """
+
+    name = "qr"
+
+    def solve(self, wz, wx):
+        self._check_dense(wx)
+        n, k = wx.shape
+        q, r, piv = linalg.qr(wx, mode="economic", pivoting=True, check_finite=False)
+        diag = np.abs(np.diag(r))
+        rank = int(np.sum(diag > diag[0] * max(n, k) * FLOAT_EPS)) if k else 0
+        self._factor = (r[:rank, :rank], piv, rank, k)
+        betas = np.zeros((k, 1))
+        qtz = np.dot(q[:, :rank].T, wz)
+        betas[piv[:rank]] = linalg.solve_triangular(
+            r[:rank, :rank], qtz, check_finite=False
+        )
+        return betas
+
+    def inv(self):
+        self._check_solved()
+        r, piv, rank, k = self._factor
+        r_inv = linalg.solve_triangular(r, np.eye(rank), check_finite=False)
+        xtx_inv = np.full((k, k), np.nan)
+        keep = piv[:rank]
+        xtx_inv[np.ix_(keep, keep)] = np.dot(r_inv, r_inv.T)
+        return xtx_inv
+
+    def rank(self):
+        self._check_solved()
+        return self._factor[2]
+
+
+class SVD(Solver):
+    """
+    Singular value decomposition of the weighted design W^1/2 X = USV'.
+
+    The most robust (and most expensive) backend. Singular values below
+    max(n, k) * eps * s_max are treated as zero, giving the minimum norm
+    least squares solution and the pseudo-inverse of X'WX.
+    """
+
+    name = "svd"
+
+    def solve(self, wz, wx):
+        self._check_dense(wx)
+        u, s, vt = linalg.svd(wx, full_matrices=False, check_finite=False)
+        cutoff = max(wx.shape) * FLOAT_EPS * (s[0] if s.size else 0.0)
+        s_inv = np.zeros_like(s)
+        s_inv[s > cutoff] = 1.0 / s[s > cutoff]
+        self._factor = (vt, s_inv)
+        return np.dot(vt.T, s_inv[:, None] * np.dot(u.T, wz))
+
+    def solve_normal(self, xtx, xtz):
+        # eigendecomposition of X'WX = VS^2V'; the condition number is squared
+        # so the cutoff is applied to the eigenvalues
+        lam, v = linalg.eigh(xtx, check_finite=False)
+        lam, v = lam[::-1], v[:, ::-1]
+        cutoff = len(lam) * FLOAT_EPS * (lam[0] if lam.size else 0.0)
+        s_inv = np.zeros_like(lam)
+        s_inv[lam > cutoff] = 1.0 / np.sqrt(lam[lam > cutoff])
+        self._factor = (v.T, s_inv)
+        return np.dot(v, s_inv[:, None] ** 2 * np.dot(v.T, xtz))
+
+    def inv(self):
+        self._check_solved()
+        vt, s_inv = self._factor
+        return np.dot(vt.T * s_inv**2, vt)
+
+    def rank(self):
+        self._check_solved()
+        return int(np.count_nonzero(self._factor[1]))
+
+
+class LSMR(Solver):
+    """
+    Iterative least squares on the weighted design with LSMR.
+
+    For large sparse designs with many columns: only products with W^1/2 X
+    and its transpose are needed, so X'WX is never formed and its condition
+    number is not squared. Each solve starts from the betas of the previous
+    one and is inexact: it stops once the normal equation residual
+    X'W(z - Xb) has been reduced by a forcing factor from its value at the
+    starting betas. The factor is `forcing` at first and shrinks with the
+    reduction of that residual between successive solves, so the inner
+    tolerance tightens as the iwls iterations converge. [X'WX]^-1 is formed
+    from the last weighted design only when `inv` is called.
+
+    Parameters
+    ----------
+    forcing : float
+        fraction of its starting value to which a solve reduces the normal
+        equation residual, at most. Default is 0.1.
+    atol : float
+        floor of the LSMR tolerance, below which rounding dominates. Default
+        is 1e-12.
+    max_iter : integer
+        maximum LSMR iterations per solve. Default is None, which is
+        min(n, k) as in scipy.
+    """
+
+    name = "lsmr"
+
+    def __init__(self, forcing=0.1, atol=1e-12, max_iter=None):
+        self.forcing = forcing
+        self.atol = atol
+        self.max_iter = max_iter
+        self._betas = None
+        self._gradient = None
+        # total LSMR iterations over all solves
+        self.n_inner = 0
+
+    def solve(self, wz, wx):
+        n, k = wx.shape
+        wz = np.asarray(wz, dtype=float).reshape(n)
+        self._factor = wx
+        betas = self._betas
+        if betas is None or betas.shape[0] != k:
+            betas, self._gradient = np.zeros(k), None
+        r = wz - wx @ betas
+        gradient = np.linalg.norm(wx.T @ r)
+        if gradient == 0.0:
+            return betas.reshape((-1, 1))
+        forcing = self.forcing
+        if self._gradient:
+            forcing = min(forcing, gradient / self._gradient)
+        self._gradient = gradient
+        # lsmr stops on |A'r| <= atol |A| |r|, with |A| the Frobenius norm
+        norm = spla.norm(wx) if sp.issparse(wx) else np.linalg.norm(wx)
+        atol = max(forcing * gradient / (norm * np.linalg.norm(r)), self.atol)
+        res = spla.lsmr(wx, r, atol=atol, btol=atol, maxiter=self.max_iter)
+        self.n_inner += res[2]
+        self._betas = betas + res[0]
+        return self._betas.reshape((-1, 1))
+
+    def inv(self):
+        self._check_solved()
+        wx = self._factor
+        xtx = wx.T @ wx
+        return linalg.pinvh(xtx.toarray() if sp.issparse(xtx) else xtx)
+
+
+class Sketch(Solver):
+    """
+    LSQR on the weighted design, preconditioned from a random sketch.
+
+    For tall designs (n >> k): the weighted design W^1/2 X is compressed to
+    m = oversampling * k rows by a random embedding S, and the R factor of
+    the QR decomposition of S W^1/2 X preconditions LSQR, so that W^1/2 X R^-1
+    is well conditioned and LSQR converges to full precision in a few
+    iterations that each cost O(nk) (O(nnz) for a sparse X). Forming the
+    sketch costs O(nk) as well, and is only repeated when the weights have
+    changed enough to slow LSQR down: if a solve on an old preconditioner
+    needs more than `refresh` times the iterations of the first solve after
+    the last sketch, the next solve sketches again. A solve on an old
+    preconditioner that reaches max_iter sketches again at once, and one
+    that reaches it on a fresh sketch warns. Each solve starts from the
+    betas of the previous one.
+
+    Parameters
+    ----------
+    embedding : string
+        'sparse' (default), a sparse sign embedding with `nnz` random +/-1
+        entries per column of S, for dense or sparse X; or 'srht', a
+        subsampled randomized trigonometric (DCT) transform, for dense X.
+    oversampling : integer
+        rows of the sketch per column of X. Default is 8.
+    nnz : integer
+        nonzeros per column of the sparse sign embedding. Default is 8.
+    tol : float
+        LSQR tolerance. Default is 1e-14, i.e. full precision.
+    refresh : float
+        growth of the LSQR iteration count that triggers a new sketch.
+        Default is 2.
+    seed : integer or Generator
+        seed of the random embeddings. Default is 0.
+    max_iter : integer
+        maximum LSQR iterations per solve. Default is None, which is 2k
+        (LSQR needs far fewer on a well conditioned problem).
+    """
+
+    name = "sketch"
+
+    def __init__(
+        self,
+        embedding="sparse",
+        oversampling=8,
+        nnz=8,
+        tol=1e-14,
+        refresh=2.0,
+        seed=0,
+        max_iter=None,
+    ):
+        if embedding not in ("sparse", "srht"):
+            raise ValueError(
+                f"embedding should be 'sparse' or 'srht'. (got {embedding})"
+            )
+        self.embedding = embedding
+        self.oversampling = oversampling
+        self.nnz = nnz
+        self.tol = tol
+        self.refresh = refresh
+        self.max_iter = max_iter
+        self._rng = np.random.default_rng(seed)
+        self._r = None
+        self._betas = None
+        self._stale = True
+        self._fresh_iter = 0
+        # number of sketches and total LSQR iterations over all solves
+        self.n_sketch = 0
+        self.n_inner = 0
+
+    def _sketch(self, wx):
+        n, k = wx.shape
+        m = self.oversampling * k
+        if m >= n:
+            sketch = wx
+        elif self.embedding == "srht":
+            self._check_dense(wx)
+            signs = self._rng.choice([-1.0, 1.0], n)
+            mixed = fft.dct(wx * signs[:, None], norm="ortho", axis=0)
+            rows = self._rng.choice(n, m, replace=False)
+            sketch = mixed[rows] * np.sqrt(n / m)
+        else:
+            # one random +/-1 per column of S at a time, so that the n*nnz
+            # embedding is never held in memory
+            sketch = np.zeros((m, k))
+            cols = np.arange(n)
+            scale = 1.0 / np.sqrt(self.nnz)
+            for _ in range(self.nnz):
+                rows = self._rng.integers(0, m, n)
+                signs = self._rng.choice([-scale, scale], n)
+                s = sp.csr_matrix((signs, (rows, cols)), shape=(m, n))
+                sketch += s @ wx
+        if sp.issparse(sketch):
+            sketch = sketch.toarray()
+        r = linalg.qr(sketch, mode="r", check_finite=False)[0][:k]
+        diag = np.abs(np.diag(r))
+        if not diag.size or diag.min() <= diag.max() * max(m, k) * FLOAT_EPS:
+            raise linalg.LinAlgError(
+                "The sketch of the weighted design is rank deficient; the "
+                "design may be rank deficient. Use solver='qr' or solver='svd'."
+            )
+        self._r = r
+        self.n_sketch += 1
+
+    def _lsqr(self, wz, wx, betas, iter_lim):
+        """
+        LSQR on W^1/2 X R^-1, started from betas.
+        """
+        n, k = wx.shape
+        r = self._r
+        precond = spla.LinearOperator(
+            (n, k),
+            matvec=lambda y: wx @ linalg.solve_triangular(r, np.ravel(y)),
+            rmatvec=lambda u: linalg.solve_triangular(r, wx.T @ np.ravel(u), trans="T"),
+        )
+        x0 = None if betas is None else r @ betas
+        return spla.lsqr(
+            precond, wz, atol=self.tol, btol=self.tol, iter_lim=iter_lim, x0=x0
+        )
+
+    def solve(self, wz, wx):
+        n, k = wx.shape
+        wz = np.asarray(wz, dtype=float).reshape(n)
+        iter_lim = 2 * k if self.max_iter is None else self.max_iter
+        fresh = self._stale or self._r is None or self._r.shape[0] != k
+        if fresh:
+            self._sketch(wx)
+        betas = self._betas
+        if betas is not None and betas.shape[0] != k:
+            betas = None
+        while True:
+            res = self._lsqr(wz, wx, betas, iter_lim)
+            self.n_inner += res[2]
+            betas = linalg.solve_triangular(self._r, res[0])
+            # istop 7: LSQR hit the iteration limit before the tolerance, most
+            # likely on an old preconditioner, so sketch again and carry on
+            if res[1] != 7 or fresh:
+                break
+            self._sketch(wx)
+            fresh = True
+        if res[1] == 7:
+            warnings.warn(
+                f"LSQR reached its iteration limit ({iter_lim}) before tol="
+                f"{self.tol} on a fresh sketch; the step may be inexact. "
+                "Increase max_iter or use solver='qr'.",
+                RuntimeWarning,
+                stacklevel=2,
+            )
+        n_inner = res[2]
+        if fresh:
+            self._fresh_iter = n_inner
+        self._stale = n_inner > self.refresh * max(self._fresh_iter, 1)
+        self._betas = betas
+        self._factor = (wx, self._r)
+        return betas.reshape((-1, 1))
+
+    def inv(self):
+        # [X'WX]^-1 = R^-1 [A'A]^-1 R^-T with A = W^1/2 X R^-1 well
+        # conditioned
+        self._check_solved()
+        wx, r = self._factor
+        k = r.shape[0]
+        r_inv = linalg.solve_triangular(r, np.eye(k))
+        a = wx @ r_inv
+        ata = a.T @ a
+        return r_inv @ linalg.pinvh(np.asarray(ata)) @ r_inv.T
+
+
+solvers = {
+    Cholesky.name: Cholesky,
+    QR.name: QR,
+    SVD.name: SVD,
+    SparseLU.name: SparseLU,
+    Schur.name: Schur,
+    LSMR.name: LSMR,
+    Sketch.name: Sketch,
+}
+
+
+def get_solver(solver):
+    """
+    Return a fresh solver instance.
+
+    Parameters
+    ----------
+    solver : string, Solver class or Solver instance
+        Name of a registered solver ('cholesky', 'splu', 'schur', 'qr', 'svd',
+        'lsmr', 'sketch'), a `Solver` subclass, or an instance, which is returned
+        unchanged.
+
+    Returns
+    -------
+    solver : Solver
+    """
+    if isinstance(solver, Solver):
+        return solver
+    if isinstance(solver, type) and issubclass(solver, Solver):
+        return solver()
+    try:
+        return solvers[solver.lower()]()
+    except (KeyError, AttributeError):
+        raise ValueError(
+            f"Invalid solver, should be one of {sorted(solvers)}. (got {solver})"
+        ) from None
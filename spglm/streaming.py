@@ -0,0 +1,504 @@
+"""
+Out-of-core GLM estimation for data that does not fit in memory.
+
+The design is read block by block, from (memory-mapped) arrays or from an
+iterable of chunks, and the IWLS normal equations X'WX b = X'Wz are
+accumulated over the blocks on every iteration. Only k*k and k*1 quantities
+persist between blocks.
+"""
+
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import family
+from .glm import GLM, GLMResults
+from .iwls import (
+    _block_normal_eq,
+    _check_criterion,
+    _conv_value,
+    _deviance,
+    _n_jobs,
+    _record,
+    _reduce_blocks,
+)
+from .links import Power
+from .solvers import get_solver
+from .utils import cache_readonly
+
+__all__ = ["StreamingGLM", "StreamingGLMResults", "stream_iwls"]
+
+
+def _is_ols(fam):
+    link = fam.link
+    return (
+        isinstance(fam, family.Gaussian) and isinstance(link, Power) and link.power == 1
+    )
+
+
+def _ols_loglike(ssr, n):
+    """
+    The Gaussian identity loglikelihood from the sum of squared residuals.
+    """
+    nobs2 = n / 2.0
+    return -np.log(ssr) * nobs2 - (1 + np.log(np.pi / nobs2)) * nobs2
+
+
+class _Blocks:
+    """
+    Re-iterable source of (y, X, offset) row blocks.
+
+    Parameters
+    ----------
+    y, X, offset : array
+        n*1, n*k and n*1 arrays, typically np.memmap; ignored if chunks is given
+    chunks : callable
+        returns a fresh iterable of (y, X) or (y, X, offset) chunks every time
+        it is called
+    constant : boolean
+        prepend a column of ones to every block
+    memory : int
+        approximate working-memory budget in bytes for one block; larger
+        chunks are split
+    null : boolean
+        yield the intercept-only design instead of X
+    """
+
+    def __init__(
+        self,
+        y=None,
+        X=None,  # noqa: N803 - Argument name should be lowercase
+        offset=None,
+        chunks=None,
+        constant=True,
+        memory=2**28,
+        null=False,
+    ):
+        if chunks is None and (y is None or X is None):
+            raise ValueError("either y and X or chunks must be given")
+        self.y = y
+        self.X = X
+        self.offset = offset
+        self.chunks = chunks
+        self.constant = constant
+        self.memory = memory
+        self.null = null
+
+    def null_model(self):
+        return _Blocks(
+            self.y,
+            self.X,
+            self.offset,
+            self.chunks,
+            self.constant,
+            self.memory,
+            null=True,
+        )
+
+    def _raw(self):
+        if self.chunks is not None:
+            yield from self.chunks()
+        else:
+            n = self.X.shape[0]
+            rows = self._rows(self.X.shape[1])
+            for start in range(0, n, rows):
+                stop = min(start + rows, n)
+                offset = None if self.offset is None else self.offset[start:stop]
+                yield self.y[start:stop], self.X[start:stop], offset
+
+    def _rows(self, k):
+        # the block, its weighted copy and ~10 n-length working arrays
+        return max(1, int(self.memory // (8 * (2 * (k + 1) + 10))))
+
+    def __iter__(self):
+        for chunk in self._raw():
+            y, X = chunk[0], chunk[1]
+            offset = chunk[2] if len(chunk) > 2 else None
+            X = np.asarray(X)
+            if X.ndim == 1:
+                X = X.reshape((-1, 1))
+            rows = self._rows(X.shape[1])
+            for start in range(0, X.shape[0], rows):
+                stop = start + rows
+                y_b = np.asarray(y[start:stop], dtype=float).reshape((-1, 1))
+                if offset is None:
+                    off_b = np.ones_like(y_b)
+                else:
+                    off_b = np.asarray(offset[start:stop], dtype=float)
+                    off_b = off_b.reshape((-1, 1))
+                if self.null:
+                    x_b = np.ones_like(y_b)
+                else:
+                    x_b = np.asarray(X[start:stop], dtype=float)
+                    if self.constant:
+                        x_b = np.hstack([np.ones_like(y_b), x_b])
+                yield y_b, x_b, off_b
+
+
+def stream_iwls(
+    data,
+    family,
+    y_means,
+    ini_betas=None,
+    tol=1.0e-8,
+    max_iter=200,
+    solver=None,
+    n_jobs=1,
+    criterion="min_diff",
+    info=None,
+):
+    """
+    Iteratively re-weighted least squares over a block source
+
+    Follows iwls step for step, but X'WX and X'Wz are accumulated block by
+    block and the blocks are re-read on every iteration.
+
+    Parameters
+    ----------
+    data        : iterable
+                  re-iterable source of (y, x, offset) blocks
+    family      : family object
+                  probability models: Gaussian, Poisson, or Binomial
+    y_means     : tuple
+                  means of y and y / offset over the full data
+    ini_betas   : array
+                  k*1, starting values for the betas
+    tol         : float
+                  tolerance for estimation convergence
+    max_iter    : integer maximum number of iterations if convergence not met
+    solver      : Solver
+                  solver for the accumulated normal equations; holds the final
+                  factorization on return. Default is Cholesky
+    n_jobs      : integer
+                  number of threads processing blocks; at most 2 * n_jobs
+                  blocks are read ahead. -1 uses all cores
+    criterion   : string
+                  convergence criterion; see iwls. The deviance is summed in
+                  the same pass as X'WX, at the betas entering each iteration
+    info        : dict
+                  if given, filled with the criterion and its final value as
+                  by iwls
+
+    Returns
+    -------
+    betas       : array
+                  k*1, estimated coefficients
+    n_iter      : integer
+                  number of iterations that when iwls algorithm terminates
+    """
+    _check_criterion(criterion)
+    solver = get_solver("cholesky" if solver is None else solver)
+    n_iter = 0
+    diff = 1.0e6
+    betas = None if ini_betas is None else np.asarray(ini_betas).reshape((-1, 1))
+    n_jobs = _n_jobs(n_jobs)
+
+    def step(y_b, x_b, off_b):
+        xtwx, xtwz, mu = _block_normal_eq(
+            y_b, x_b, family, off_b, betas, y_means, return_mu=True
+        )
+        deviance = _deviance(family, y_b, mu) if criterion == "deviance" else 0.0
+        return xtwx, xtwz, deviance, y_b.shape[0]
+
+    deviance = None
+    with ThreadPoolExecutor(n_jobs) if n_jobs > 1 else contextlib.nullcontext() as pool:
+        while diff > tol and n_iter < max_iter:
+            n_iter += 1
+            xtwx, xtwz, new_deviance, n = _reduce_blocks(step, data, pool, 2 * n_jobs)
+            old_deviance, deviance = deviance, new_deviance
+            score = None if betas is None else xtwz - np.dot(xtwx, betas)
+            n_betas = solver.solve_normal(xtwx, xtwz)
+            diff = _conv_value(
+                criterion, betas, n_betas, deviance, old_deviance, score, n
+            )
+            betas = n_betas
+    _record(info, criterion, diff, tol)
+    return betas, n_iter
+
+
+class StreamingGLM(GLM):
+    """
+    Generalised linear models for data that does not fit in memory. The
+    design is streamed in blocks from memory-mapped arrays or from chunk
+    iterators; fit returns a StreamingGLMResults whose n-length diagnostics
+    are computed by streaming as well.
+
+    Parameters
+    ----------
+        y             : array
+                        n*1, dependent variable; may be an np.memmap.
+        X             : array
+                        n*k, independent variable, exlcuding the constant;
+                        may be an np.memmap.
+        family        : family instance
+                        Model type: Gaussian, Poisson, Binomial
+        offset        : array
+                        n*1, the offset variable; see GLM. Default is None
+                        where Ni becomes 1.0 for all locations.
+        constant      : boolean
+                        If True (default) a column of ones is prepended to
+                        every block. Unlike GLM, X is not checked for
+                        existing constant columns.
+        chunks        : callable
+                        Alternative to y, X and offset: returns a fresh
+                        iterable of (y, X) or (y, X, offset) chunks each time
+                        it is called, as the data is re-read every iteration.
+        memory        : integer
+                        Approximate working-memory budget in bytes for one
+                        block; larger chunks are split. Default is 256MB.
+
+    Attributes
+    ----------
+        n             : integer
+                        Number of observations
+        k             : integer
+                        Number of independent variables, including constant
+        df_model      : float
+                        k-1
+        df_residual   : float
+                        n-k
+        mean_y        : float
+                        Mean of y
+        std_y         : float
+                        Standard deviation of y
+        fit_params    : dict
+                        Parameters passed into fit method to define estimation
+                        routine.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from spglm.family import Poisson
+    >>> rng = np.random.default_rng(0)
+    >>> X = rng.normal(size=(10000, 2))
+    >>> y = rng.poisson(np.exp(0.5 + X @ [0.2, -0.3])).reshape((-1, 1))
+    >>> def chunks():
+    ...     for start in range(0, 10000, 1000):
+    ...         yield y[start:start + 1000], X[start:start + 1000]
+    >>> results = StreamingGLM(chunks=chunks, family=Poisson()).fit()
+    >>> results.params.round(2)
+    array([ 0.5 ,  0.2 , -0.29])
+
+    """
+
+    def __init__(
+        self,
+        y=None,
+        X=None,  # noqa: N803 - Argument name should be lowercase
+        family=family.Gaussian(),
+        offset=None,
+        constant=True,
+        chunks=None,
+        memory=2**28,
+    ):
+        """
+        Initialize class
+        """
+        self.data = _Blocks(y, X, offset, chunks, constant, memory)
+        self.y = y
+        self.X = X
+        self.offset = offset
+        self.family = family
+        self.constant = constant
+        self.n = 0
+        k = None
+        sum_y = sum_y2 = sum_yoff = 0.0
+        for y_b, x_b, off_b in self.data:
+            if k is None:
+                k = x_b.shape[1]
+            elif x_b.shape[1] != k:
+                raise ValueError("all chunks must have the same number of columns")
+            self.n += y_b.shape[0]
+            sum_y += y_b.sum()
+            sum_y2 += (y_b**2).sum()
+            sum_yoff += (y_b / off_b).sum()
+        if not self.n:
+            raise ValueError("no observations")
+        self.nobs = self.n
+        self.k = k
+        self._mean_y = sum_y / self.n
+        self._var_y = (sum_y2 - self.n * self._mean_y**2) / (self.n - 1)
+        self._y_means = (self._mean_y, sum_yoff / self.n)
+        self.fit_params = {}
+
+    def fit(
+        self,
+        ini_betas=None,
+        tol=1.0e-6,
+        max_iter=200,
+        solver="cholesky",
+        n_jobs=1,
+        criterion="min_diff",
+    ):
+        """
+        Method that fits a model by streaming iwls.
+
+        Parameters
+        ----------
+
+        ini_betas     : array
+                        k*1, initial coefficient values, including constant.
+        tol:            float
+                        Tolerence for estimation convergence.
+        max_iter       : integer
+                        Maximum number of iterations if convergence not
+                        achieved.
+        solver        : string
+                        Linear solver for the accumulated normal equations:
+                        'cholesky' (default), 'splu' or 'svd'.
+        n_jobs        : integer
+                        Number of threads processing blocks; -1 uses all
+                        cores.
+        criterion     : string
+                        Convergence criterion; see GLM.fit. The deviance is
+                        that of the betas entering each iteration, so
+                        'deviance' stops one iteration later than in GLM.
+        """
+        self.fit_params["ini_betas"] = ini_betas
+        self.fit_params["tol"] = tol
+        self.fit_params["max_iter"] = max_iter
+        self.fit_params["solve"] = "iwls"
+        self.fit_params["solver"] = solver
+        self.fit_params["n_jobs"] = n_jobs
+        self.fit_params["criterion"] = criterion
+        solver = get_solver(solver)
+        info = {}
+        params, n_iter = stream_iwls(
+            self.data,
+            self.family,
+            self._y_means,
+            ini_betas,
+            tol,
+            max_iter,
+            solver,
+            n_jobs,
+            criterion,
+            info,
+        )
+        self.fit_params["n_iter"] = n_iter
+        self.fit_params["conv_value"] = info["value"]
+        self.fit_params["converged"] = info["converged"]
+        return StreamingGLMResults(self, params.flatten(), solver)
+
+    @cache_readonly
+    def df_model(self):
+        return self.k - 1
+
+    @cache_readonly
+    def mean_y(self):
+        return self._mean_y
+
+    @cache_readonly
+    def std_y(self):
+        return np.sqrt(self._var_y)
+
+
+class StreamingGLMResults(GLMResults):
+    """
+    Results of a StreamingGLM. Has the attributes of GLMResults; scalar
+    diagnostics (deviance, llf, pearson_chi2, scale, ...) are reductions
+    computed by streaming over the data on first access, and n-length ones
+    (mu, y, residuals) are assembled from the blocks on first access.
+
+    Parameters
+    ----------
+        model         : StreamingGLM object
+                        Pointer to the model with estimation parameters.
+        params        : array
+                        k*1, estimated coefficients
+        solver        : Solver
+                        solver holding the factorization of the final iwls
+                        step
+    """
+
+    def __init__(self, model, params, solver):
+        self.model = model
+        self.n = model.n
+        self.nobs = model.nobs
+        self.X = model.X
+        self.k = model.k
+        self.offset = model.offset
+        self.family = model.family
+        self.fit_params = model.fit_params
+        self.params = params
+        self.w = None
+        self.solver = solver
+        self._cache = {}
+
+    def _fitted(self, null=False):
+        """
+        Yield (y, mu) by block for the fitted or the null model.
+        """
+        if null:
+            data, params = self.model.data.null_model(), self._null_params
+        else:
+            data, params = self.model.data, self.params
+        for y_b, x_b, off_b in data:
+            mu = self.family.fitted(np.dot(x_b, params))
+            if isinstance(self.family, family.Poisson):
+                mu = mu * off_b.ravel()
+            yield y_b.ravel(), mu
+
+    def _reduce(self, func, null=False):
+        return sum(func(y, mu) for y, mu in self._fitted(null))
+
+    @cache_readonly
+    def _null_params(self):
+        null_data = self.model.data.null_model()
+        params, _ = stream_iwls(null_data, self.family, self.model._y_means, tol=1e-6)
+        return params.flatten()
+
+    @cache_readonly
+    def y(self):
+        return np.concatenate([y for y, _ in self._fitted()])
+
+    @cache_readonly
+    def mu(self):
+        return np.concatenate([mu for _, mu in self._fitted()])
+
+    @cache_readonly
+    def null(self):
+        return np.concatenate([mu for _, mu in self._fitted(null=True)])
+
+    @cache_readonly
+    def pearson_chi2(self):
+        return self._reduce(
+            lambda y, mu: np.sum((y - mu) ** 2 / self.family.variance(mu))
+        )
+
+    @cache_readonly
+    def scale(self):
+        if isinstance(self.family, (family.Binomial, family.Poisson)):
+            return 1.0
+        return self.pearson_chi2 / self.df_resid
+
+    @cache_readonly
+    def deviance(self):
+        return self._reduce(self.family.deviance)
+
+    @cache_readonly
+    def null_deviance(self):
+        return self._reduce(self.family.deviance, null=True)
+
+    def _loglike(self, null=False):
+        if _is_ols(self.family):
+            # the OLS loglikelihood is not a sum over observations
+            ssr = self._reduce(lambda y, mu: np.sum((y - mu) ** 2), null=null)
+            return _ols_loglike(ssr, self.n)
+        return self._reduce(
+            lambda y, mu: self.family.loglike(y, mu, scale=self.scale), null=null
+        )
+
+    @cache_readonly
+    def llf(self):
+        return self._loglike()
+
+    @cache_readonly
+    def llnull(self):
+        return self._loglike(null=True)
+
+    @cache_readonly
+    def tr_S(self):
+        # tr(X [X'X]^-1 X') = tr([X'X]^-1 X'X) = k
+        return self.model.k
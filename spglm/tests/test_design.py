@@ -0,0 +1,153 @@
+"""
+Tests for the structured design matrices.
+"""
+
+import numpy
+import pytest
+from scipy import sparse
+
+from ..design import CategoricalDesign, ODDesign
+from ..family import Binomial, Gaussian, Poisson
+from ..glm import GLM
+from ..streaming import StreamingGLM
+
+
+class TestCategorical:
+    def setup_method(self):
+        rng = numpy.random.default_rng(6)
+        n = 5000
+        self.a = rng.integers(0, 12, n).astype(numpy.int8)
+        self.b = rng.integers(0, 300, n).astype(numpy.int16)
+        self.X = rng.normal(size=(n, 2))
+        eta = 0.3 * self.X[:, 0] + 0.1 * (self.a % 3) - 0.002 * self.b
+        self.data = {
+            "gaussian": (Gaussian(), eta + rng.normal(size=n)),
+            "poisson": (Poisson(), rng.poisson(numpy.exp(eta)) * 1.0),
+            "binomial": (Binomial(), (rng.random(n) < 1 / (1 + numpy.exp(-eta))) * 1.0),
+        }
+        self.dummies = (
+            numpy.hstack(
+                [
+                    self.a[:, None] == numpy.arange(1, 12),
+                    self.b[:, None] == numpy.arange(1, 300),
+                ]
+            )
+            * 1.0
+        )
+
+    def test_products(self):
+        design = CategoricalDesign(self.X, [self.a, self.b])
+        dense = numpy.hstack([self.X, self.dummies])
+        assert design.shape == dense.shape
+        numpy.testing.assert_array_equal(design.toarray(), dense)
+        rng = numpy.random.default_rng(0)
+        w = rng.random((len(self.a), 1))
+        z = rng.normal(size=(len(self.a), 1))
+        b = rng.normal(size=(dense.shape[1], 1))
+        xtx, xtz = design.normal_eq(w, z)
+        numpy.testing.assert_allclose(xtx, dense.T @ (w * dense), atol=1e-10)
+        numpy.testing.assert_allclose(xtz, dense.T @ (w * z), atol=1e-10)
+        numpy.testing.assert_allclose(design.dot(b), dense @ b, atol=1e-12)
+        # the codes keep their dtype
+        assert design.codes[0].dtype == numpy.int8
+
+    @pytest.mark.parametrize("fam", ["gaussian", "poisson", "binomial"])
+    def test_matches_dummies(self, fam):
+        family, y = self.data[fam]
+        y = y.reshape((-1, 1))
+        results = GLM(y, self.X, family=family, categorical=[self.a, self.b]).fit(
+            tol=1e-10
+        )
+        ref = GLM(y, numpy.hstack([self.X, self.dummies]), family=family).fit(tol=1e-10)
+        numpy.testing.assert_allclose(results.params, ref.params, atol=1e-10)
+        numpy.testing.assert_allclose(results.bse, ref.bse, rtol=1e-8)
+        assert pytest.approx(results.aic) == ref.aic
+        assert pytest.approx(results.tr_S) == ref.tr_S
+
+    def test_no_constant(self):
+        family, y = self.data["poisson"]
+        y = y.reshape((-1, 1))
+        codes = numpy.column_stack([self.a, self.b])
+        results = GLM(y, None, family=family, categorical=codes, constant=False).fit()
+        full = (
+            numpy.hstack([self.a[:, None] == numpy.arange(12), self.dummies[:, 11:]])
+            * 1.0
+        )
+        ref = GLM(y, full, family=family, constant=False).fit()
+        numpy.testing.assert_allclose(results.params, ref.params, atol=1e-8)
+
+    def test_invalid(self):
+        family, y = self.data["poisson"]
+        y = y.reshape((-1, 1))
+        with pytest.raises(ValueError):
+            CategoricalDesign(self.X, [self.a * 1.0])
+        with pytest.raises(ValueError):
+            CategoricalDesign(self.X, [self.a - 1])
+        model = GLM(y, self.X, family=family, categorical=self.a)
+        with pytest.raises(ValueError):
+            model.fit(solver="qr")
+        with pytest.raises(ValueError):
+            model.fit(solve="lbfgs")
+        with pytest.raises(ValueError):
+            model.fit(block_size=100)
+        with pytest.raises(ValueError):
+            GLM(y, self.X, categorical=self.a, fixed_effects=self.b)
+
+
+class TestOD:
+    def setup_method(self):
+        rng = numpy.random.default_rng(7)
+        n_o, n_d = 40, 30
+        xy_o, xy_d = rng.random((n_o, 2)), rng.random((n_d, 2))
+
+        def decay(i):
+            diff = xy_o[i, None, :] - xy_d[None, :, :]
+            return numpy.log(numpy.sqrt((diff**2).sum(-1)) + 0.05)
+
+        self.origins = numpy.log(rng.integers(100, 1000, (n_o, 2)))
+        self.destinations = numpy.log(rng.integers(100, 1000, n_d))
+        self.decay = decay
+        self.dense = numpy.column_stack(
+            [
+                numpy.ones(n_o * n_d),
+                numpy.repeat(self.origins, n_d, axis=0),
+                numpy.tile(self.destinations, n_o),
+                decay(numpy.arange(n_o)).ravel(),
+            ]
+        )
+        eta = self.dense @ [-10.0, 0.5, 0.4, 0.6, -1.2]
+        self.flows = rng.poisson(numpy.exp(eta)).reshape((n_o, n_d)) * 1.0
+
+    @pytest.mark.parametrize("constant", [True, False])
+    def test_products(self, constant):
+        # a small memory budget, for several blocks of origins
+        design = ODDesign(
+            self.origins, self.destinations, self.decay, constant, memory=10000
+        )
+        dense = self.dense if constant else self.dense[:, 1:]
+        assert design.shape == dense.shape
+        numpy.testing.assert_allclose(design.toarray(), dense)
+        rng = numpy.random.default_rng(0)
+        w = rng.random((dense.shape[0], 1))
+        z = rng.normal(size=(dense.shape[0], 1))
+        xtx, xtz = design.normal_eq(w, z)
+        numpy.testing.assert_allclose(xtx, dense.T @ (w * dense), rtol=1e-10)
+        numpy.testing.assert_allclose(xtz, dense.T @ (w * z), rtol=1e-10)
+
+    def test_fit(self):
+        design = ODDesign(self.origins, self.destinations, self.decay)
+        y = self.flows.reshape((-1, 1))
+        assert (y == 0).any()
+        ref = GLM(y, self.dense, family=Poisson(), constant=False).fit(tol=1e-10)
+        results = GLM(y, design, family=Poisson()).fit(tol=1e-10)
+        numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-8)
+        numpy.testing.assert_allclose(results.bse, ref.bse, rtol=1e-8)
+        assert pytest.approx(results.tr_S) == ref.tr_S
+        # streamed by blocks of origins from the non-zero flows only
+        chunks = design.chunks(sparse.csr_matrix(self.flows))
+        streamed = StreamingGLM(chunks=chunks, family=Poisson(), constant=False)
+        streamed = streamed.fit(tol=1e-10)
+        numpy.testing.assert_allclose(streamed.params, ref.params, rtol=1e-8)
+        assert pytest.approx(streamed.deviance) == ref.deviance
+        with pytest.raises(ValueError):
+            design.chunks(self.flows.T)
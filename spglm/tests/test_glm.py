@@ -11,8 +11,9 @@ import libpysal
 import numpy
 import pytest
 
-from ..family import Binomial, Gaussian, Poisson, QuasiPoisson
+from ..family import Binomial, Gamma, Gaussian, Poisson, QuasiPoisson
 from ..glm import GLM
+from ..links import log
 
 
 class TestGaussian:
@@ -4265,3 +4266,136 @@ class TestBinomial:
         )
         assert pytest.approx(results.D2) == 0.200712816165
         assert pytest.approx(results.adj_D2) == 0.19816731557930456
+
+
+class TestWeights:
+    """
+    Tests for frequency and variance weights and row compression
+    """
+
+    stats = ("params", "bse", "deviance", "llf", "aic", "bic", "scale")
+    stats += ("null_deviance", "llnull", "pearson_chi2")
+
+    def setup_method(self):
+        rng = numpy.random.default_rng(3)
+        n = 3000
+        self.a = rng.integers(0, 5, n).astype(numpy.int8)
+        self.b = rng.integers(0, 7, n).astype(numpy.int16)
+        self.X = (rng.integers(0, 3, n) * 0.5).reshape((-1, 1))
+        self.freq_weights = rng.integers(1, 4, n)
+        self.offset = numpy.exp(rng.integers(0, 2, (n, 1)) * 0.3)
+        eta = 0.2 + 0.3 * self.X[:, 0] + 0.1 * self.a - 0.05 * self.b
+        p = 1 / (1 + numpy.exp(-eta))
+        self.data = {
+            "gaussian": (Gaussian(), eta + rng.normal(size=n)),
+            "poisson": (Poisson(), rng.poisson(numpy.exp(eta)) * 1.0),
+            "binomial": (Binomial(), (rng.random(n) < p) * 1.0),
+            "gamma": (Gamma(log), rng.gamma(2.0, numpy.exp(eta) / 2.0)),
+            "quasi": (QuasiPoisson(), rng.poisson(numpy.exp(eta)) * 1.0),
+        }
+        self.trials = rng.integers(1, 5, n)
+        self.successes = rng.binomial(self.trials, p)
+
+    def check(self, results, ref):
+        for stat in self.stats:
+            numpy.testing.assert_allclose(
+                getattr(results, stat), getattr(ref, stat), rtol=1e-9, err_msg=stat
+            )
+
+    @pytest.mark.parametrize("fam", ["gaussian", "poisson", "binomial", "gamma"])
+    def test_freq_weights(self, fam):
+        family, y = self.data[fam]
+        y = y.reshape((-1, 1))
+        X = numpy.hstack([self.X, self.a[:, None]])
+        results = GLM(y, X, family=family, freq_weights=self.freq_weights)
+        results = results.fit(tol=1e-12)
+        rows = numpy.repeat(numpy.arange(len(y)), self.freq_weights)
+        ref = GLM(y[rows], X[rows], family=family).fit(tol=1e-12)
+        self.check(results, ref)
+        assert results.nobs == len(rows)
+
+    def test_var_weights(self):
+        _, y = self.data["gaussian"]
+        y = y.reshape((-1, 1))
+        w = self.freq_weights.reshape((-1, 1)) / 2.0
+        results = GLM(y, self.X, var_weights=w).fit()
+        X = numpy.hstack([numpy.ones_like(self.X), self.X])
+        betas = numpy.linalg.solve(X.T @ (w * X), X.T @ (w * y))
+        numpy.testing.assert_allclose(results.params, betas.ravel())
+        resid = y - X @ betas
+        scale = (w * resid**2).sum() / (len(y) - 2)
+        assert pytest.approx(results.scale) == scale
+        numpy.testing.assert_allclose(
+            results.resid_pearson, (resid * numpy.sqrt(w)).ravel()
+        )
+
+    def test_trials(self):
+        y = numpy.column_stack([self.successes, self.trials - self.successes])
+        results = GLM(y, self.X, family=Binomial()).fit(tol=1e-12)
+        # one Bernoulli row per trial
+        rows = numpy.repeat(numpy.arange(len(y)), self.trials)
+        start = numpy.repeat(numpy.cumsum(self.trials) - self.trials, self.trials)
+        # the first trials of a row are its successes
+        bernoulli = (numpy.arange(len(rows)) - start < self.successes[rows]) * 1.0
+        ref = GLM(bernoulli.reshape((-1, 1)), self.X[rows], family=Binomial())
+        ref = ref.fit(tol=1e-12)
+        numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-10)
+        numpy.testing.assert_allclose(results.bse, ref.bse, rtol=1e-10)
+        # the family is not changed by the trials
+        assert results.family.n == 1
+        with pytest.raises(ValueError):
+            GLM(numpy.zeros((len(y), 2)), self.X, family=Binomial())
+
+    @pytest.mark.parametrize("fam", ["gaussian", "poisson", "binomial", "quasi"])
+    def test_compress(self, fam):
+        family, y = self.data[fam]
+        y = y.reshape((-1, 1))
+        kwargs = {"offset": self.offset} if fam == "poisson" else {}
+        codes = [self.a, self.b]
+        ref = GLM(y, self.X, family=family, categorical=codes, **kwargs)
+        ref = ref.fit(tol=1e-12)
+        model = GLM(
+            y, self.X, family=family, categorical=codes, compress=True, **kwargs
+        )
+        assert model.n == len(numpy.unique(model.inverse)) <= 3 * 5 * 7 * 2
+        results = model.fit(tol=1e-12)
+        self.check(results, ref)
+        # the residuals are those of the original rows
+        for resid in ("response", "pearson", "deviance", "working", "anscombe"):
+            numpy.testing.assert_allclose(
+                getattr(results, "resid_" + resid), getattr(ref, "resid_" + resid)
+            )
+        numpy.testing.assert_allclose(results.expand(results.mu), ref.mu)
+
+    def test_compress_weighted(self):
+        family, y = self.data["poisson"]
+        y = y.reshape((-1, 1))
+        X = numpy.hstack([self.X, self.a[:, None]])
+        kwargs = {"family": family, "freq_weights": self.freq_weights}
+        ref = GLM(y, X, **kwargs).fit(tol=1e-12)
+        results = GLM(y, X, compress=True, **kwargs).fit(tol=1e-12)
+        self.check(results, ref)
+        assert results.nobs == self.freq_weights.sum()
+
+        y = numpy.column_stack([self.successes, self.trials - self.successes])
+        ref = GLM(y, self.X, family=Binomial()).fit(tol=1e-12)
+        model = GLM(y, self.X, family=Binomial(), compress=True)
+        assert model.n == 3
+        self.check(model.fit(tol=1e-12), ref)
+
+    def test_invalid(self):
+        family, y = self.data["poisson"]
+        y = y.reshape((-1, 1))
+        with pytest.raises(ValueError):
+            GLM(y, self.X, family=family, freq_weights=-self.freq_weights)
+        with pytest.raises(ValueError):
+            GLM(y, self.X, family=family, var_weights=self.freq_weights[1:])
+        with pytest.raises(ValueError):
+            GLM(y, self.X, compress=True, fixed_effects=self.a)
+        model = GLM(y, self.X, family=family, freq_weights=self.freq_weights)
+        with pytest.raises(ValueError):
+            model.fit(solve="lbfgs")
+        with pytest.raises(ValueError):
+            model.fit(block_size=100)
+        with pytest.raises(ValueError):
+            model.fit(step_halving=True)
@@ -0,0 +1,802 @@
+"""
+Tests for the IWLS estimation routines.
+"""
+
+import libpysal
+import numpy
+import pytest
+from scipy import sparse as sp
+
+from .. import _numba
+from .. import varfuncs as V  # noqa: N812
+from ..family import (
+    Binomial,
+    Gamma,
+    Gaussian,
+    IdentityKernel,
+    InverseKernel,
+    IWLSKernel,
+    LogitKernel,
+    LogKernel,
+    Poisson,
+    QuasiPoisson,
+)
+from ..glm import GLM
+from ..iwls import (
+    SUBSAMPLE_ROWS,
+    TRACE_DTYPE,
+    Workspace,
+    _subsample,
+    batch_iwls,
+    initial_betas,
+    iwls,
+    local_iwls,
+)
+from ..links import cloglog, identity, log, probit
+from ..solvers import Cholesky
+from ..utils import hilbert_order
+
+
+class TestLocalIWLS:
+    def setup_method(self):
+        db = libpysal.io.open(libpysal.examples.get_path("columbus.dbf"), "r")
+        y = numpy.array(db.by_col("HOVAL")).reshape((-1, 1))
+        self.X = numpy.hstack(
+            [numpy.ones((49, 1)), numpy.array([db.by_col("INC"), db.by_col("CRIME")]).T]
+        )
+        self.offset = numpy.ones((49, 1))
+        coords = numpy.array([db.by_col("X"), db.by_col("Y")]).T
+        d = numpy.sqrt(((coords[:, None] - coords[None]) ** 2).sum(-1))
+        self.W = numpy.exp(-0.5 * (d / 3.0) ** 2)
+        self.data = {
+            "gaussian": (Gaussian(), y),
+            "poisson": (Poisson(), numpy.round(y)),
+            "binomial": (Binomial(), (y > numpy.median(y)) * 1.0),
+        }
+
+    @pytest.mark.parametrize("fam", ["gaussian", "poisson", "binomial"])
+    def test_batch_matches_loop(self, fam):
+        family, y = self.data[fam]
+        betas, n_iter, converged = batch_iwls(
+            y, self.X, family, self.offset, self.W, block_size=10
+        )
+        for i in range(49):
+            res = iwls(
+                y, self.X, family, self.offset, None, wi=self.W[i].reshape((-1, 1))
+            )
+            numpy.testing.assert_allclose(betas[i], res[0].ravel(), rtol=1e-8)
+            assert n_iter[i] == res[-1]
+            assert converged[i] == (res[-1] < 200)
+
+    def test_batch_callable_weights(self):
+        family, y = self.data["poisson"]
+        expected = batch_iwls(y, self.X, family, self.offset, self.W)
+        result = batch_iwls(
+            y,
+            self.X,
+            family,
+            self.offset,
+            lambda start, stop: self.W[start:stop],
+            m=49,
+            block_size=16,
+        )
+        numpy.testing.assert_allclose(result[0], expected[0], rtol=1e-10)
+        numpy.testing.assert_array_equal(result[1], expected[1])
+        with pytest.raises(ValueError):
+            batch_iwls(y, self.X, family, self.offset, lambda s, e: self.W[s:e])
+
+    @pytest.mark.parametrize("fam", ["gaussian", "poisson"])
+    def test_influence(self, fam):
+        family, y = self.data[fam]
+        batch = batch_iwls(
+            y, self.X, family, self.offset, self.W, block_size=10, influence=True
+        )
+        for i in range(0, 49, 6):
+            wi = self.W[i].reshape((-1, 1))
+            full = iwls(y, self.X, family, self.offset, None, wi=wi)
+            xtx_inv_xt, w = full[5], full[3][i][0]
+            Si = numpy.dot(self.X[i], xtx_inv_xt) * w
+            CCT = numpy.diag(numpy.dot(xtx_inv_xt, xtx_inv_xt.T))
+            influ, tr_STS, cct = iwls(
+                y, self.X, family, self.offset, None, wi=wi, hat="influence", i=i
+            )[5]
+            assert pytest.approx(influ) == Si[i]
+            assert pytest.approx(tr_STS) == numpy.sum(Si**2)
+            numpy.testing.assert_allclose(cct, CCT)
+            assert pytest.approx(batch[3][i]) == Si[i]
+            assert pytest.approx(batch[4][i]) == numpy.sum(Si**2)
+            numpy.testing.assert_allclose(batch[5][i], CCT)
+
+
+class TestWarmStart:
+    def setup_method(self):
+        rng = numpy.random.default_rng(0)
+        n = 200
+        self.coords = rng.uniform(0, 10, (n, 2))
+        self.X = numpy.hstack([numpy.ones((n, 1)), rng.normal(size=(n, 2))])
+        betas = numpy.c_[
+            0.5 + 0.05 * self.coords[:, 0],
+            0.3 + 0.03 * self.coords[:, 1],
+            -0.2 * numpy.ones(n),
+        ]
+        eta = (self.X * betas).sum(1)
+        self.y = {
+            "poisson": rng.poisson(numpy.exp(eta)).reshape((-1, 1)) * 1.0,
+            "binomial": rng.binomial(1, 1 / (1 + numpy.exp(-eta))).reshape((-1, 1))
+            * 1.0,
+        }
+        d = numpy.sqrt(((self.coords[:, None] - self.coords[None]) ** 2).sum(-1))
+        self.W = numpy.exp(-0.5 * (d / 2.0) ** 2)
+        self.offset = numpy.ones((n, 1))
+
+    def test_hilbert_order(self):
+        grid = numpy.array([[i, j] for i in range(8) for j in range(8)])
+        order = hilbert_order(grid, p=3)
+        assert sorted(order) == list(range(64))
+        steps = numpy.abs(numpy.diff(grid[order], axis=0)).sum(1)
+        assert (steps == 1).all()
+
+    def test_ini_betas(self):
+        y = self.y["poisson"]
+        cold = iwls(y, self.X, Poisson(), self.offset, None)
+        warm = iwls(y, self.X, Poisson(), self.offset, None, ini_betas=cold[0])
+        numpy.testing.assert_allclose(warm[0], cold[0])
+        assert warm[-1] < cold[-1]
+
+    @pytest.mark.parametrize(
+        "family,fam", [(Poisson(), "poisson"), (Binomial(), "binomial")]
+    )
+    def test_local_iwls(self, family, fam):
+        y = self.y[fam]
+        betas, n_iter, info = local_iwls(
+            y, self.X, family, self.offset, self.W, coords=self.coords, compare=True
+        )
+        cold = batch_iwls(y, self.X, family, self.offset, self.W)
+        numpy.testing.assert_allclose(betas, cold[0], atol=1e-6)
+        assert info["n_iter"] == n_iter.sum()
+        assert info["n_iter"] < info["n_iter_cold"]
+        assert info["saved"] > 0.1
+
+
+class TestBlocked:
+    def setup_method(self):
+        rng = numpy.random.default_rng(1)
+        n = 5000
+        self.X = rng.normal(size=(n, 4)) * 0.3
+        self.y = rng.poisson(numpy.exp(0.5 + self.X @ [0.2, -0.3, 0.1, 0.4]))
+        self.y = self.y.reshape((-1, 1)) * 1.0
+
+    def test_blocked_matches_unblocked(self):
+        ref = GLM(self.y, self.X, family=Poisson()).fit()
+        results = GLM(self.y, self.X, family=Poisson()).fit(block_size=333)
+        assert results.w is None
+        assert results.fit_params["n_iter"] == ref.fit_params["n_iter"]
+        numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-10)
+        numpy.testing.assert_allclose(results.mu, ref.mu, rtol=1e-10)
+        numpy.testing.assert_allclose(results.bse, ref.bse, rtol=1e-10)
+
+    def test_deterministic_threads(self):
+        one = GLM(self.y, self.X, family=Poisson()).fit(n_jobs=1, block_size=256)
+        four = GLM(self.y, self.X, family=Poisson()).fit(n_jobs=4, block_size=256)
+        numpy.testing.assert_array_equal(one.params, four.params)
+        numpy.testing.assert_array_equal(
+            one.normalized_cov_params, four.normalized_cov_params
+        )
+
+    def test_blocked_dense_glm_only(self):
+        with pytest.raises(ValueError):
+            iwls(
+                self.y,
+                self.X,
+                Poisson(),
+                numpy.ones_like(self.y),
+                None,
+                wi=numpy.ones_like(self.y),
+                n_jobs=2,
+            )
+
+
+class TestSinglePrecision:
+    def setup_method(self):
+        rng = numpy.random.default_rng(2)
+        n = 5000
+        self.X = (rng.normal(size=(n, 3)) * 0.3).astype(numpy.float32)
+        eta = 0.5 + self.X @ [0.2, -0.3, 0.4]
+        self.offset = rng.uniform(1, 3, (n, 1))
+        self.y = {
+            "gaussian": eta + rng.normal(size=n),
+            "poisson": rng.poisson(numpy.exp(eta) * self.offset.ravel()),
+            "binomial": rng.binomial(1, 1 / (1 + numpy.exp(-eta))),
+        }
+
+    @pytest.mark.parametrize(
+        "fam", [("gaussian", Gaussian), ("poisson", Poisson), ("binomial", Binomial)]
+    )
+    def test_matches_double(self, fam):
+        y = self.y[fam[0]].reshape((-1, 1)) * 1.0
+        # double precision fit to the same (float32 representable) design
+        ref = GLM(y, self.X.astype(float), family=fam[1](), offset=self.offset)
+        ref = ref.fit(tol=1e-8)
+        model = GLM(y, self.X, family=fam[1](), offset=self.offset, precision="single")
+        assert model.X.dtype == numpy.float32
+        assert model.offset.dtype == numpy.float32
+        results = model.fit(tol=1e-8)
+        assert results.mu.dtype == numpy.float64
+        numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-6)
+        numpy.testing.assert_allclose(results.bse, ref.bse, rtol=1e-5)
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            GLM(self.y["poisson"].reshape((-1, 1)), self.X, precision="half")
+        with pytest.raises(ValueError):
+            GLM(
+                self.y["poisson"].reshape((-1, 1)),
+                sp.csr_matrix(self.X),
+                precision="single",
+            )
+
+
+class TestWorkspace:
+    def setup_method(self):
+        rng = numpy.random.default_rng(3)
+        n = 300
+        self.X = numpy.hstack([numpy.ones((n, 1)), rng.normal(size=(n, 2)) * 0.3])
+        self.y = rng.poisson(numpy.exp(self.X @ [0.5, 0.2, -0.3])).reshape((-1, 1))
+        self.wi = rng.uniform(size=(3, n, 1))
+
+    @pytest.mark.parametrize("fam", [Gaussian, Poisson, Binomial, Gamma])
+    def test_out_matches(self, fam):
+        family = fam()
+        rng = numpy.random.default_rng(0)
+        mu = rng.uniform(0.01, 0.99, (50, 1))
+        mu[:2] = [[0.0], [1.0]]
+        out, work = numpy.empty_like(mu), numpy.empty((2, 50, 1))
+        with numpy.errstate(all="ignore"):
+            expected = family.weights(mu)
+            assert family.weights(mu, out=out, work=work) is out
+            numpy.testing.assert_array_equal(out, expected)
+            expected = family.link.deriv(mu)
+            family.link.deriv(mu, out=out, work=work[0])
+            numpy.testing.assert_array_equal(out, expected)
+        eta = rng.normal(size=(50, 1))
+        numpy.testing.assert_array_equal(
+            family.fitted(eta, out=out), family.fitted(eta)
+        )
+
+    def test_reused(self):
+        y = self.y * 1.0
+        offset = numpy.ones_like(y)
+        workspace = Workspace(*self.X.shape)
+        for wi in self.wi:
+            ref = iwls(y, self.X, Poisson(), offset, None, wi=wi)
+            rslt = iwls(y, self.X, Poisson(), offset, None, wi=wi, workspace=workspace)
+            numpy.testing.assert_array_equal(rslt[0], ref[0])
+            numpy.testing.assert_array_equal(rslt[1], ref[1])
+            assert rslt[1] is workspace.mu
+        with pytest.raises(ValueError):
+            iwls(y, self.X[:, :2], Poisson(), offset, None, workspace=workspace)
+
+
+class TestKernels:
+    @pytest.mark.parametrize(
+        "family, kernel",
+        [
+            (Gaussian(), IdentityKernel),
+            (Poisson(), LogKernel),
+            (QuasiPoisson(), LogKernel),
+            (Binomial(), LogitKernel),
+            (Gamma(), InverseKernel),
+            (Gaussian(log), IWLSKernel),
+            (Binomial(probit), IWLSKernel),
+            (Binomial(cloglog), IWLSKernel),
+        ],
+    )
+    def test_selection(self, family, kernel):
+        assert type(family.iwls_kernel()) is kernel
+
+    @pytest.mark.parametrize("family", [Gaussian(), Poisson(), Binomial(), Gamma()])
+    def test_fused_matches_generic(self, family):
+        rng = numpy.random.default_rng(4)
+        v = rng.normal(size=(200, 1))
+        if isinstance(family, Gamma):
+            v = v + 3
+        offset = rng.uniform(1, 2, (200, 1))
+        generic, fused = IWLSKernel(family), family.iwls_kernel()
+        mu = generic.fitted(v, offset)
+        numpy.testing.assert_array_equal(fused.fitted(v, offset), mu)
+        y = rng.poisson(numpy.abs(mu)) * 1.0
+        if isinstance(family, Binomial):
+            y = (y > 0) * 1.0
+            mu[:2] = [[0.0], [1.0]]  # clipped by the link
+        w, z = generic.working(y, v, mu)
+        for rslt in (
+            fused.working(y, v, mu),
+            fused.working(
+                y, v, mu, *numpy.empty((2, 200, 1)), work=numpy.empty((2, 200, 1))
+            ),
+        ):
+            numpy.testing.assert_allclose(rslt[0], w, rtol=1e-14)
+            numpy.testing.assert_allclose(rslt[1], z, rtol=1e-14)
+
+    def test_custom_variance(self):
+        class Constant:
+            # a user-defined variance function, taking mu alone
+            def __call__(self, mu):
+                return numpy.ones_like(mu)
+
+        rng = numpy.random.default_rng(5)
+        X = rng.normal(size=(300, 2))
+        y = numpy.exp(1 + X @ [0.3, -0.2]) + rng.normal(scale=0.1, size=300)
+        y = y.reshape((-1, 1))
+        family = Gaussian(log)
+        family.variance = Constant()
+        assert not family._inplace()
+        ref = GLM(y, X, family=Gaussian(log)).fit()
+        results = GLM(y, X, family=family).fit()
+        numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-10)
+
+
+class TestNumbaEngine:
+    def setup_method(self):
+        rng = numpy.random.default_rng(5)
+        n = 400
+        self.X = rng.normal(size=(n, 3)) * 0.3
+        eta = 1.0 + self.X @ [0.2, -0.3, 0.4]
+        self.offset = rng.uniform(1, 2, (n, 1))
+        self.y = {
+            "gaussian": eta + rng.normal(size=n),
+            "poisson": rng.poisson(numpy.exp(eta) * self.offset.ravel()),
+            "binomial": rng.binomial(1, 1 / (1 + numpy.exp(-eta))),
+            "gamma": rng.gamma(2.0, 0.5 / eta),
+        }
+        self.wi = rng.uniform(size=(n, 1))
+
+    @pytest.mark.parametrize(
+        "fam",
+        [
+            ("gaussian", Gaussian()),
+            ("poisson", Poisson()),
+            ("poisson", QuasiPoisson()),
+            ("binomial", Binomial()),
+            ("gamma", Gamma()),
+            ("poisson", Gaussian(log)),
+        ],
+    )
+    def test_matches_numpy(self, fam):
+        pytest.importorskip("numba")
+        y = self.y[fam[0]].reshape((-1, 1)) * 1.0
+        model = GLM(y, self.X, family=fam[1], offset=self.offset)
+        ref = model.fit()
+        n_iter = ref.fit_params["n_iter"]
+        results = model.fit(engine="numba")
+        assert results.fit_params["engine"] == "numba"
+        assert results.fit_params["n_iter"] == n_iter
+        numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-10)
+        numpy.testing.assert_allclose(results.bse, ref.bse, rtol=1e-10)
+
+        X = model.X
+        ref = iwls(y, X, fam[1], self.offset, None, wi=self.wi)
+        rslt = iwls(y, X, fam[1], self.offset, None, wi=self.wi, engine="numba")
+        for a, b in zip(rslt, ref):
+            numpy.testing.assert_allclose(a, b, rtol=1e-8, atol=1e-12)
+
+    def test_cho_solve(self):
+        rng = numpy.random.default_rng(6)
+        a = rng.normal(size=(30, 6))
+        a, b = a.T @ a, rng.normal(size=6)
+        numpy.testing.assert_allclose(
+            _numba._cho_solve(a, b), numpy.linalg.solve(a, b), rtol=1e-10
+        )
+        with pytest.raises(numpy.linalg.LinAlgError):
+            _numba._cho_solve(-a, b)
+
+    def test_fallback(self, monkeypatch):
+        y = self.y["binomial"].reshape((-1, 1)) * 1.0
+        model = GLM(y, self.X, family=Binomial(probit))
+        results = model.fit(engine="numba")
+        assert results.fit_params["engine"] == "numpy"
+        monkeypatch.setattr(_numba, "HAS_NUMBA", False)
+        model = GLM(y, self.X, family=Binomial())
+        assert model.fit(engine="numba").fit_params["engine"] == "numpy"
+        monkeypatch.undo()
+        model = GLM(y, sp.csr_matrix(self.X), family=Binomial())
+        assert model.fit(engine="numba").fit_params["engine"] == "numpy"
+        model = GLM(y, self.X, family=Binomial())
+        for solver in ("qr", "svd", "splu"):
+            results = model.fit(engine="numba", solver=solver)
+            assert results.fit_params["engine"] == "numpy"
+        with pytest.raises(ValueError):
+            model.fit(engine="cython")
+
+    @pytest.mark.parametrize(
+        "options",
+        [{"block_size": 10}, {"n_jobs": 2}, {"precision": "single"}],
+    )
+    def test_blocked_fallback(self, monkeypatch, options):
+        # the blocked pass falls back to numpy whether or not numba is there
+        monkeypatch.setattr(_numba, "HAS_NUMBA", True)
+        y = self.y["binomial"].reshape((-1, 1)) * 1.0
+        precision = options.pop("precision", "double")
+        model = GLM(y, self.X, family=Binomial(), precision=precision)
+        results = model.fit(engine="numba", **options)
+        assert results.fit_params["engine"] == "numpy"
+        rslt = iwls(
+            y, model.X, Binomial(), model.offset, None, engine="numba", **options
+        )
+        numpy.testing.assert_allclose(rslt[0], results.params.reshape((-1, 1)))
+
+
+class TestCriterion:
+    def setup_method(self):
+        rng = numpy.random.default_rng(7)
+        n = 500
+        self.X = rng.normal(size=(n, 3)) * 0.5
+        eta = 0.5 + self.X @ [0.8, -0.5, 0.3]
+        self.data = {
+            "poisson": (Poisson(), rng.poisson(numpy.exp(eta)).reshape((-1, 1))),
+            "binomial": (
+                Binomial(),
+                rng.binomial(1, 1 / (1 + numpy.exp(-eta))).reshape((-1, 1)),
+            ),
+        }
+
+    @pytest.mark.parametrize("fam", ["poisson", "binomial"])
+    def test_criteria(self, fam):
+        family, y = self.data[fam]
+        model = GLM(y, self.X, family=family)
+        ref = model.fit(tol=1e-10)
+        n_iter = ref.fit_params["n_iter"]
+        assert ref.fit_params["criterion"] == "min_diff"
+        assert ref.fit_params["converged"]
+        assert ref.fit_params["conv_value"] <= 1e-10
+        for criterion in ("max_diff", "rel_diff", "deviance", "gradient"):
+            results = model.fit(tol=1e-10, criterion=criterion)
+            assert results.fit_params["criterion"] == criterion
+            assert results.fit_params["converged"]
+            numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-7)
+        # the deviance settles long before the smallest change reaches 1e-10
+        results = model.fit(tol=1e-8, criterion="deviance")
+        assert results.fit_params["n_iter"] <= n_iter
+
+    def test_max_diff_not_premature(self):
+        family, y = self.data["poisson"]
+        model = GLM(y, self.X, family=family)
+        min_diff = model.fit(tol=1e-4)
+        max_diff = model.fit(tol=1e-4, criterion="max_diff")
+        assert max_diff.fit_params["n_iter"] >= min_diff.fit_params["n_iter"]
+
+    @pytest.mark.parametrize("criterion", ["max_diff", "rel_diff", "gradient"])
+    def test_numba(self, criterion):
+        pytest.importorskip("numba")
+        family, y = self.data["binomial"]
+        model = GLM(y, self.X, family=family)
+        ref = model.fit(criterion=criterion)
+        n_iter, value = ref.fit_params["n_iter"], ref.fit_params["conv_value"]
+        results = model.fit(criterion=criterion, engine="numba")
+        assert results.fit_params["engine"] == "numba"
+        assert results.fit_params["n_iter"] == n_iter
+        numpy.testing.assert_allclose(
+            results.fit_params["conv_value"], value, rtol=1e-6, atol=1e-12
+        )
+        assert (
+            model.fit(criterion="deviance", engine="numba").fit_params["engine"]
+            == "numpy"
+        )
+
+    @pytest.mark.parametrize("criterion", ["deviance", "gradient"])
+    def test_blocked(self, criterion):
+        family, y = self.data["poisson"]
+        model = GLM(y, self.X, family=family)
+        ref = model.fit(tol=1e-10, criterion=criterion)
+        results = model.fit(tol=1e-10, criterion=criterion, block_size=128)
+        numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-9)
+        assert results.fit_params["converged"]
+
+    def test_invalid(self):
+        family, y = self.data["poisson"]
+        with pytest.raises(ValueError):
+            GLM(y, self.X, family=family).fit(criterion="loglike")
+
+
+class TestSafeguarded:
+    def setup_method(self):
+        rng = numpy.random.default_rng(3)
+        n = 1000
+        self.X = rng.normal(size=(n, 2))
+        eta = self.X @ [0.3, -0.2]
+        self.data = {
+            "gamma": (Gamma(log), rng.gamma(2.0, numpy.exp(0.5 + eta) / 2.0)),
+            "probit": (
+                Binomial(probit),
+                (rng.normal(size=n) < 0.3 + self.X @ [0.8, -0.5]) * 1.0,
+            ),
+            # the fitted values of the MLE are near zero, where plain
+            # Fisher scoring overshoots to negative mu
+            "poisson": (
+                Poisson(identity),
+                rng.poisson(numpy.abs(3 + self.X @ [1.5, 1.0])) * 1.0,
+            ),
+        }
+
+    def test_derivatives(self):
+        mu = numpy.linspace(0.05, 0.95, 7)
+        h = 1e-6
+        for func in (V.VarianceFunction(), V.Power(), V.Power(2.0), V.Binomial()):
+            numpy.testing.assert_allclose(
+                func.deriv(mu), (func(mu + h) - func(mu - h)) / (2 * h), atol=1e-8
+            )
+        link = probit()
+        numpy.testing.assert_allclose(
+            link.deriv2(mu),
+            (link.deriv(mu + h) - link.deriv(mu - h)) / (2 * h),
+            rtol=1e-6,
+            atol=1e-8,
+        )
+
+    @pytest.mark.parametrize("fam", ["gamma", "probit"])
+    def test_newton(self, fam):
+        family, y = self.data[fam]
+        model = GLM(y.reshape((-1, 1)), self.X, family=family)
+        ref = model.fit(tol=1e-12, criterion="max_diff")
+        # fit_params is the model's, overwritten by the next fit
+        n_iter = ref.fit_params["n_iter"]
+        results = model.fit(tol=1e-12, criterion="max_diff", information="observed")
+        assert results.fit_params["information"] == "observed"
+        assert results.fit_params["n_iter"] < n_iter
+        numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-8)
+        # the observed and expected information agree at the optimum up to
+        # sampling error
+        numpy.testing.assert_allclose(results.bse, ref.bse, rtol=0.05)
+        halved = model.fit(tol=1e-12, criterion="max_diff", step_halving=True)
+        numpy.testing.assert_allclose(halved.params, ref.params, rtol=1e-10)
+        assert halved.fit_params["n_halving"] == 0
+
+    def test_canonical(self):
+        y = self.data["gamma"][1].reshape((-1, 1))
+        model = GLM(numpy.round(y), self.X, family=Poisson())
+        ref = model.fit()
+        n_iter = ref.fit_params["n_iter"]
+        results = model.fit(information="observed")
+        assert results.fit_params["n_iter"] == n_iter
+        numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-12)
+
+    def test_divergent(self):
+        family, y = self.data["poisson"]
+        model = GLM(y.reshape((-1, 1)), self.X, family=family)
+        ref = model.fit()
+        assert ref.fit_params["n_iter"] == 200
+        assert not ref.fit_params["converged"]
+        results = model.fit(information="observed", step_halving=True)
+        assert results.fit_params["converged"]
+        assert results.fit_params["n_iter"] < 20
+        assert results.fit_params["n_halving"] > 0
+        assert results.mu.min() >= 0
+        trace = model.fit(information="observed", step_halving=True, trace=True).trace
+        assert len(trace) == results.fit_params["n_iter"]
+        assert (trace["step"] < 1).any()
+        # the halved steps never increase the deviance
+        assert (numpy.diff(trace["deviance"]) <= 1e-8).all()
+
+    def test_invalid(self):
+        family, y = self.data["gamma"]
+        model = GLM(y.reshape((-1, 1)), self.X, family=family)
+        with pytest.raises(ValueError):
+            model.fit(information="hessian")
+        with pytest.raises(ValueError):
+            model.fit(information="observed", solver="qr")
+        with pytest.raises(ValueError):
+            model.fit(step_halving=True, block_size=100)
+
+
+class TestInit:
+    def setup_method(self):
+        rng = numpy.random.default_rng(4)
+        n = 50000
+        self.X = rng.normal(size=(n, 5))
+        eta = self.X @ [0.3, -0.2, 0.1, 0.4, -0.3]
+        self.data = {
+            "poisson": (Poisson(), rng.poisson(numpy.exp(1 + eta)) * 1.0),
+            "binomial": (
+                Binomial(),
+                (rng.random(n) < 1 / (1 + numpy.exp(3 - eta))) * 1.0,
+            ),
+            "gamma": (Gamma(), rng.gamma(2.0, 1 / (2 * (2 + 0.1 * eta)))),
+        }
+
+    @pytest.mark.parametrize("fam", ["poisson", "binomial", "gamma"])
+    def test_subsample(self, fam):
+        family, y = self.data[fam]
+        model = GLM(y.reshape((-1, 1)), self.X, family=family)
+        ref = model.fit(tol=1e-10)
+        params, n_iter = ref.params, ref.fit_params["n_iter"]
+        results = model.fit(tol=1e-10, init="subsample", frac=0.05)
+        assert results.fit_params["init"] == "subsample"
+        assert results.fit_params["n_iter"] < n_iter
+        assert results.fit_params["n_iter_diff"] > 0
+        assert results.fit_params["n_iter_diff"] == (
+            results.fit_params["n_iter_init"] - results.fit_params["n_iter"]
+        )
+        numpy.testing.assert_allclose(results.params, params, rtol=1e-8)
+
+    def test_solver_instance(self):
+        class Tagged(Cholesky):
+            # a configured solver, which cannot be rebuilt from its class alone
+            def __init__(self, tag):
+                self.tag = tag
+
+            def solve(self, wz, wx):
+                assert self.tag == "caller"
+                return super().solve(wz, wx)
+
+        family, y = self.data["poisson"]
+        model = GLM(y.reshape((-1, 1)), self.X, family=family)
+        ref = model.fit(tol=1e-10, init="subsample")
+        solver = Tagged("caller")
+        results = model.fit(tol=1e-10, init="subsample", solver=solver)
+        assert results.fit_params["n_iter_init"] == ref.fit_params["n_iter_init"]
+        numpy.testing.assert_allclose(results.params, ref.params)
+        # the full fit keeps the instance; the subsample fit ran on a copy
+        assert results.solver is solver
+
+    def test_link(self):
+        family, y = self.data["gamma"]
+        model = GLM(y.reshape((-1, 1)), self.X, family=family)
+        ref = model.fit(tol=1e-10).params
+        results = model.fit(tol=1e-10, init="link")
+        assert results.fit_params["n_iter_diff"] is None
+        numpy.testing.assert_allclose(results.params, ref, rtol=1e-8)
+        results = model.fit(init="subsample", solve="lbfgs")
+        assert results.fit_params["n_iter_diff"] is None
+
+    def test_stratified(self):
+        y = numpy.zeros(100000)
+        y[:SUBSAMPLE_ROWS] = 1.0
+        rows = _subsample(y, 0.01, 3, numpy.random.default_rng(0))
+        # the rare outcome is kept beyond its share of a 1% sample
+        assert (y[rows] == 1).sum() == SUBSAMPLE_ROWS
+        assert len(rows) < 0.02 * len(y)
+
+    def test_fallback(self):
+        family, y = self.data["poisson"]
+        X = numpy.hstack([self.X, numpy.zeros((len(y), 1))])
+        X[0, -1] = 1.0
+        betas, n_iter = initial_betas(
+            y.reshape((-1, 1)), X, family, numpy.ones((len(y), 1)), "subsample"
+        )
+        assert betas is None
+        results = GLM(y.reshape((-1, 1)), X, family=family).fit(init="subsample")
+        assert results.fit_params["n_iter_diff"] is None
+
+    def test_invalid(self):
+        family, y = self.data["poisson"]
+        model = GLM(y.reshape((-1, 1)), self.X, family=family)
+        with pytest.raises(ValueError):
+            model.fit(init="ols")
+        with pytest.raises(ValueError):
+            model.fit(init="subsample", frac=0.0)
+        with pytest.raises(ValueError):
+            model.fit(init="subsample", ini_betas=numpy.zeros((6, 1)))
+
+
+class TestTrace:
+    def setup_method(self):
+        rng = numpy.random.default_rng(5)
+        n = 2000
+        self.X = rng.normal(size=(n, 3))
+        eta = self.X @ [0.5, -1.0, 0.3]
+        self.y = (rng.random(n) < 1 / (1 + numpy.exp(-eta))).reshape((-1, 1)) * 1.0
+        self.model = GLM(self.y, self.X, family=Binomial())
+
+    @pytest.mark.parametrize(
+        "kwargs", [{}, {"block_size": 500}, {"step_halving": True}, {"solve": "lbfgs"}]
+    )
+    def test_trace(self, kwargs):
+        assert self.model.fit().trace is None
+        results = self.model.fit(trace=True, **kwargs)
+        trace = results.trace
+        assert trace.dtype == TRACE_DTYPE
+        assert len(trace) == results.fit_params["n_iter"]
+        numpy.testing.assert_array_equal(
+            trace["iteration"], numpy.arange(len(trace)) + 1
+        )
+        if "solve" not in kwargs:
+            # iwls starts from fitted values rather than betas
+            assert numpy.isnan(trace["change"][0])
+        assert (trace["time"] > 0).all()
+        assert trace["conv_value"][-1] == results.fit_params["conv_value"]
+        if "block_size" not in kwargs:
+            # the blocked pass records the deviance of the entering betas
+            assert trace["deviance"][-1] == pytest.approx(results.deviance)
+        assert not results.fit_params["stopped"]
+
+    def test_solver(self):
+        trace = self.model.fit(trace=True, solver="qr").trace
+        assert (trace["solver"] == "qr").all()
+        trace = self.model.fit(trace=True, solve="trust-ncg").trace
+        assert (trace["solver"] == "trust-ncg").all()
+
+    @pytest.mark.parametrize("solve", ["iwls", "lbfgs"])
+    def test_callback_stops(self, solve):
+        records = []
+
+        def callback(record, betas):
+            records.append((record, betas))
+            return record["iteration"] == 2
+
+        results = self.model.fit(solve=solve, callback=callback, tol=1e-12)
+        assert len(records) == 2
+        assert results.fit_params["stopped"]
+        assert not results.fit_params["converged"]
+        numpy.testing.assert_allclose(results.params, numpy.ravel(records[-1][1]))
+        assert set(records[0][0]) == set(TRACE_DTYPE.names)
+
+    def test_numba_fallback(self):
+        results = self.model.fit(engine="numba", trace=True)
+        assert results.fit_params["engine"] == "numpy"
+        assert len(results.trace) == results.fit_params["n_iter"]
+
+
+class TestFixedEffects:
+    def setup_method(self):
+        rng = numpy.random.default_rng(5)
+        n, self.N = 3000, 30
+        self.o = rng.integers(0, self.N, n)
+        self.d = rng.integers(0, self.N, n) + 100
+        self.X = rng.normal(size=(n, 2))
+        eta = self.X @ [0.3, -0.2] + 0.05 * (self.o % 7) - 0.03 * (self.d % 5)
+        self.y = rng.poisson(numpy.exp(eta)).reshape((-1, 1)) * 1.0
+        self.y_gaus = (eta + rng.normal(size=n)).reshape((-1, 1))
+        o_dummies = self.o[:, None] == numpy.arange(self.N)
+        d_dummies = (self.d - 100)[:, None] == numpy.arange(1, self.N)
+        self.D = numpy.hstack([o_dummies, d_dummies]) * 1.0
+
+    @pytest.mark.parametrize("fam, y", [(Poisson(), "y"), (Gaussian(), "y_gaus")])
+    def test_matches_dummies(self, fam, y):
+        y = getattr(self, y)
+        fe = numpy.column_stack([self.o, self.d])
+        results = GLM(y, self.X, family=fam, fixed_effects=fe).fit(tol=1e-10)
+        ref = GLM(y, numpy.hstack([self.X, self.D]), family=fam, constant=False).fit(
+            tol=1e-10
+        )
+        numpy.testing.assert_allclose(results.params, ref.params[:2], rtol=1e-8)
+        numpy.testing.assert_allclose(results.mu, ref.mu, rtol=1e-7)
+        numpy.testing.assert_allclose(
+            results.normalized_cov_params,
+            ref.normalized_cov_params[:2, :2],
+            rtol=1e-6,
+        )
+        assert results.df_model == ref.df_model
+        assert results.tr_S == ref.tr_S == ref.k
+        assert pytest.approx(results.aic) == ref.aic
+        # the effects add up to the absorbed part of the linear predictor
+        codes = results.model.fixed_effects
+        effects = results.fixed_effects
+        numpy.testing.assert_allclose(
+            effects[0][codes[:, 0]] + effects[1][codes[:, 1]],
+            results.absorbed.ravel(),
+            atol=1e-8,
+        )
+        numpy.testing.assert_array_equal(
+            results.model.fe_levels[1], numpy.unique(self.d)
+        )
+
+    def test_one_factor(self):
+        results = GLM(self.y_gaus, self.X, fixed_effects=self.o).fit()
+        ref = GLM(
+            self.y_gaus, numpy.hstack([self.X, self.D[:, : self.N]]), constant=False
+        ).fit()
+        numpy.testing.assert_allclose(results.params, ref.params[:2])
+        numpy.testing.assert_allclose(results.fixed_effects[0], ref.params[2:])
+
+    def test_invalid(self):
+        model = GLM(self.y, self.X, family=Poisson(), fixed_effects=self.o)
+        with pytest.raises(ValueError):
+            model.fit(init="link")
+        with pytest.raises(ValueError):
+            model.fit(solve="lbfgs")
+        with pytest.raises(ValueError):
+            model.fit(block_size=100)
+        with pytest.raises(ValueError):
+            GLM(self.y, self.X, fixed_effects=self.o * 1.0)
+        with pytest.raises(ValueError):
+            GLM(self.y, sp.csr_matrix(self.X), fixed_effects=self.o)
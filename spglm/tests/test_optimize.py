@@ -0,0 +1,89 @@
+"""
+Tests for GLM estimation by quasi-Newton and trust-region minimisation.
+"""
+
+import numpy
+import pytest
+from scipy import sparse as sp
+
+from ..family import Binomial, Gamma, Gaussian, Poisson
+from ..glm import GLM
+from ..optimize import optimize_glm
+
+
+class TestOptimize:
+    def setup_method(self):
+        rng = numpy.random.default_rng(0)
+        n, k = 2000, 40
+        self.X = rng.normal(size=(n, k)) * 0.2
+        b = rng.normal(size=k) * 0.5
+        eta = self.X @ b
+        self.offset = rng.uniform(1, 3, (n, 1))
+        self.data = {
+            "gaussian": (Gaussian(), eta + rng.normal(size=n)),
+            "poisson": (
+                Poisson(),
+                rng.poisson(numpy.exp(0.5 + eta) * self.offset.ravel()) * 1.0,
+            ),
+            "binomial": (Binomial(), (rng.random(n) < 1 / (1 + numpy.exp(-eta))) * 1.0),
+            "gamma": (Gamma(), rng.gamma(2.0, 1 / (2 * (2 + 0.2 * eta)))),
+        }
+
+    @pytest.mark.parametrize("fam", ["gaussian", "poisson", "binomial", "gamma"])
+    @pytest.mark.parametrize("solve", ["lbfgs", "trust-ncg"])
+    def test_matches_iwls(self, fam, solve):
+        family, y = self.data[fam]
+        offset = self.offset if fam == "poisson" else None
+        model = GLM(y.reshape((-1, 1)), self.X, family=family, offset=offset)
+        ref = model.fit(tol=1e-10)
+        params, bse, llf = ref.params, ref.bse, ref.llf
+        res = model.fit(solve=solve, tol=1e-8)
+        assert res.fit_params["converged"]
+        assert res.fit_params["criterion"] == "gradient"
+        assert res.fit_params["conv_value"] <= 1e-8
+        numpy.testing.assert_allclose(res.params, params, rtol=1e-5, atol=1e-5)
+        numpy.testing.assert_allclose(res.bse, bse, rtol=1e-5)
+        numpy.testing.assert_allclose(res.llf, llf, rtol=1e-8)
+
+    def test_trust_ncg_fewer_iterations(self):
+        family, y = self.data["binomial"]
+        model = GLM(y.reshape((-1, 1)), self.X, family=family)
+        n_lbfgs = model.fit(solve="lbfgs").fit_params["n_iter"]
+        n_trust = model.fit(solve="trust-ncg").fit_params["n_iter"]
+        assert n_trust < n_lbfgs
+
+    def test_sparse(self):
+        family, y = self.data["poisson"]
+        X = numpy.hstack([numpy.ones((len(y), 1)), self.X])
+        X[numpy.abs(X) < 0.15] = 0.0
+        betas, mu, wx, _ = optimize_glm(
+            y, sp.csr_matrix(X), family, self.offset, tol=1e-10, method="trust-ncg"
+        )
+        ref, ref_mu, ref_wx, _ = optimize_glm(
+            y, X, family, self.offset, tol=1e-10, method="trust-ncg"
+        )
+        assert sp.issparse(wx)
+        numpy.testing.assert_allclose(betas, ref, rtol=1e-8, atol=1e-10)
+        numpy.testing.assert_allclose(mu, ref_mu, rtol=1e-8)
+        numpy.testing.assert_allclose(wx.toarray(), ref_wx, rtol=1e-8, atol=1e-12)
+
+    def test_ini_betas(self):
+        family, y = self.data["binomial"]
+        model = GLM(y.reshape((-1, 1)), self.X, family=family)
+        ref = model.fit(tol=1e-10).params
+        res = model.fit(solve="lbfgs", ini_betas=ref.reshape((-1, 1)))
+        assert res.fit_params["n_iter"] <= 1
+        numpy.testing.assert_allclose(res.params, ref, rtol=1e-8, atol=1e-10)
+
+    def test_invalid(self):
+        family, y = self.data["gaussian"]
+        model = GLM(y.reshape((-1, 1)), self.X, family=family)
+        with pytest.raises(ValueError):
+            model.fit(solve="newton")
+        with pytest.raises(ValueError):
+            optimize_glm(y, self.X, family, numpy.ones(len(y)), method="bfgs")
+        family, y = self.data["gamma"]
+        with pytest.raises(ValueError):
+            optimize_glm(
+                y, self.X, family, numpy.ones(len(y)), ini_betas=-numpy.ones(40)
+            )
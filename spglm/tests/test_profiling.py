@@ -0,0 +1,94 @@
+"""
+Tests for the stage-level profiling hooks.
+"""
+
+import json
+
+import libpysal
+import numpy
+import pytest
+
+from .. import profiling
+from ..family import Poisson
+from ..glm import GLM
+
+
+class TestProfiling:
+    def setup_method(self):
+        db = libpysal.io.open(libpysal.examples.get_path("columbus.dbf"), "r")
+        self.y = numpy.array(db.by_col("HOVAL")).reshape((-1, 1))
+        self.X = numpy.array([db.by_col("INC"), db.by_col("CRIME")]).T
+        self.y_pois = numpy.round(self.y).astype(float)
+
+    def test_disabled(self):
+        assert not profiling.enabled()
+        assert profiling.stage("gram") is profiling.stage("solve")
+        GLM(self.y, self.X).fit()
+        assert profiling.get_sink() is None
+
+    def test_stages(self):
+        with profiling.profile() as sink:
+            model = GLM(self.y_pois, self.X, family=Poisson())
+            results = model.fit()
+            aic = results.aic
+        assert not profiling.enabled()
+        totals = sink.summary()
+        n_iter = results.fit_params["n_iter"]
+        for name in ("weights", "solve", "predict"):
+            assert totals[name]["count"] == n_iter
+        assert totals["check_arrays"]["count"] == 1
+        assert totals["check_constant"]["count"] == 1
+        assert "GLMResults.aic" in totals
+        assert "GLMResults.llf" in totals
+        records = {r["stage"]: r for r in sink.records}
+        assert records["gram"]["parent"] == "solve"
+        assert records["iwls"]["parent"] == "fit"
+        assert records["GLMResults.llf"]["parent"] == "GLMResults.aic"
+        fit = records["fit"]
+        assert fit["time"] >= fit["self"] >= 0
+        # the fitted values and weights of the fit stay allocated
+        assert records["iwls"]["peak"] >= records["iwls"]["bytes"] > 0
+        # cached diagnostics are not recomputed
+        with profiling.profile() as sink:
+            assert results.aic == aic
+        assert sink.records == []
+
+    def test_blocked(self):
+        with profiling.profile(memory=False) as sink:
+            results = GLM(self.y, self.X).fit(block_size=16)
+        totals = sink.summary()
+        assert totals["gram"]["count"] == results.fit_params["n_iter"]
+        assert totals["predict"]["count"] == 1
+        assert all(r["bytes"] is None for r in sink.records)
+
+    def test_sinks(self, tmp_path):
+        path = tmp_path / "profile.jsonl"
+        with profiling.profile(str(path)):
+            GLM(self.y, self.X).fit()
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        assert lines[-1]["stage"] == "fit"
+        assert set(lines[0]) == {"stage", "parent", "time", "self", "bytes", "peak"}
+
+        seen = []
+        with profiling.profile(seen.append):
+            GLM(self.y, self.X).fit()
+        assert [r["stage"] for r in seen] == [r["stage"] for r in lines]
+
+        with pytest.raises(TypeError), profiling.profile(1):
+            pass
+
+    def test_nested(self):
+        outer = profiling.MemorySink()
+        with profiling.profile(outer):
+            with profiling.profile() as inner:
+                GLM(self.y, self.X).fit()
+            assert profiling.get_sink() is outer
+        assert outer.records == []
+        assert inner.records
+
+    def test_environ(self, tmp_path):
+        assert profiling._from_environ("") is None
+        assert profiling._from_environ("0") is None
+        assert isinstance(profiling._from_environ("1"), profiling.MemorySink)
+        sink = profiling._from_environ(str(tmp_path / "profile.jsonl"))
+        assert isinstance(sink, profiling.JSONLinesSink)
@@ -0,0 +1,207 @@
+"""
+Tests for the linear solvers used by the IWLS routine.
+"""
+
+import libpysal
+import numpy
+import pytest
+from scipy import linalg, sparse
+
+from ..family import Binomial, Gaussian, Poisson
+from ..glm import GLM
+from ..solvers import LSMR, QR, SVD, Cholesky, Schur, Sketch, get_solver
+
+
+class TestSolvers:
+    def setup_method(self):
+        db = libpysal.io.open(libpysal.examples.get_path("columbus.dbf"), "r")
+        self.y = numpy.array(db.by_col("HOVAL")).reshape((-1, 1))
+        self.X = numpy.array([db.by_col("INC"), db.by_col("CRIME")]).T
+        self.y_pois = numpy.round(self.y).astype(float)
+        self.y_bin = (self.y > numpy.median(self.y)).astype(float)
+
+    @pytest.mark.parametrize("solver", ["cholesky", "qr", "svd"])
+    def test_solvers_agree(self, solver):
+        for fam, y in [
+            (Gaussian(), self.y),
+            (Poisson(), self.y_pois),
+            (Binomial(), self.y_bin),
+        ]:
+            ref = GLM(y, self.X, family=fam).fit()
+            results = GLM(y, self.X, family=fam).fit(solver=solver)
+            assert results.fit_params["solver"] == solver
+            numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-8)
+            expected = linalg.inv(numpy.dot(results.w.T, results.w))
+            numpy.testing.assert_allclose(
+                results.normalized_cov_params, expected, rtol=1e-8
+            )
+
+    def test_rank_deficient(self):
+        X = numpy.hstack([self.X, self.X[:, :1] * 2.0])
+        qr = GLM(self.y, X).fit(solver="qr")
+        ref = GLM(self.y, self.X).fit()
+        assert numpy.isnan(qr.normalized_cov_params).any()
+        numpy.testing.assert_allclose(qr.mu, ref.mu)
+        svd = GLM(self.y, X).fit(solver="svd")
+        numpy.testing.assert_allclose(svd.mu, ref.mu)
+        assert numpy.isfinite(svd.normalized_cov_params).all()
+        # the aliased column does not count towards the trace of the hat matrix
+        assert qr.tr_S == svd.tr_S == ref.tr_S == ref.k
+
+    def test_get_solver(self):
+        assert isinstance(get_solver("QR"), QR)
+        assert isinstance(get_solver(SVD), SVD)
+        assert isinstance(get_solver("lsmr"), LSMR)
+        assert isinstance(get_solver("sketch"), Sketch)
+        chol = Cholesky()
+        assert get_solver(chol) is chol
+        with pytest.raises(ValueError):
+            get_solver("inverse")
+        with pytest.raises(ValueError):
+            Cholesky().inv()
+
+
+class TestSketch:
+    def setup_method(self):
+        rng = numpy.random.default_rng(0)
+        n = 20000
+        self.X = rng.normal(size=(n, 8)) * rng.uniform(0.1, 10.0, 8)
+        eta = self.X @ (rng.normal(size=8) / rng.uniform(0.1, 10.0, 8) / 4)
+        self.y = (rng.random(n) < 1 / (1 + numpy.exp(-eta))).reshape((-1, 1)) * 1.0
+
+    @pytest.mark.parametrize("embedding", ["sparse", "srht"])
+    def test_matches_cholesky(self, embedding):
+        model = GLM(self.y, self.X, family=Binomial())
+        ref = model.fit(tol=1e-10, criterion="max_diff")
+        params, cov = ref.params, ref.normalized_cov_params
+        solver = Sketch(embedding=embedding)
+        results = model.fit(solver=solver, tol=1e-10, criterion="max_diff")
+        numpy.testing.assert_allclose(results.params, params, rtol=1e-10)
+        numpy.testing.assert_allclose(results.normalized_cov_params, cov, rtol=1e-8)
+        # the preconditioner outlives the iterations
+        assert solver.n_sketch < results.fit_params["n_iter"]
+
+    def test_sparse_design(self):
+        X = sparse.csr_matrix(numpy.where(self.X > 0, self.X, 0.0))
+        wx = X.multiply(numpy.linspace(0.5, 2.0, X.shape[0])[:, None]).tocsr()
+        expected = Cholesky().solve(self.y, wx)
+        numpy.testing.assert_allclose(Sketch().solve(self.y, wx), expected, rtol=1e-10)
+        with pytest.raises(ValueError):
+            Sketch(embedding="srht").solve(self.y, wx)
+
+    def test_refresh(self):
+        rng = numpy.random.default_rng(1)
+        wx = rng.normal(size=(len(self.y), 40))
+        solver = Sketch()
+        solver.solve(self.y, wx)
+        # weights spread over orders of magnitude slow LSQR down on the old
+        # preconditioner, so the next solve sketches again
+        wx *= numpy.exp(rng.normal(scale=2.0, size=(len(self.y), 1)))
+        solver.solve(self.y, wx)
+        assert solver.n_sketch == 1
+        numpy.testing.assert_allclose(
+            solver.solve(self.y, wx), Cholesky().solve(self.y, wx), rtol=1e-10
+        )
+        assert solver.n_sketch == 2
+
+    def test_iteration_limit(self):
+        rng = numpy.random.default_rng(2)
+        wx = rng.normal(size=(len(self.y), 40))
+        solver = Sketch(max_iter=2)
+        with pytest.warns(RuntimeWarning):
+            solver.solve(self.y, wx)
+        assert solver.n_sketch == 1
+        # on an old preconditioner the limit first triggers a new sketch
+        wx *= rng.uniform(0.5, 2.0, size=(len(self.y), 1))
+        with pytest.warns(RuntimeWarning):
+            solver.solve(self.y, wx)
+        assert solver.n_sketch == 2
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            Sketch(embedding="gaussian")
+        X = numpy.hstack([self.X, self.X[:, :1]])
+        with pytest.raises(linalg.LinAlgError):
+            Sketch().solve(self.y, X)
+
+
+class TestSparse:
+    def setup_method(self):
+        rng = numpy.random.default_rng(0)
+        n = 2000
+        codes = rng.integers(0, 40, n)
+        D = sparse.csr_matrix((numpy.ones(n), (numpy.arange(n), codes)), shape=(n, 40))
+        D = D[:, 1:]
+        x = rng.normal(size=(n, 1))
+        self.X = sparse.hstack([sparse.csr_matrix(x), D]).tocsr()
+        eta = 0.5 + 0.3 * x[:, 0] + rng.normal(scale=0.3, size=40)[codes]
+        self.y = rng.poisson(numpy.exp(eta)).reshape((-1, 1)).astype(float)
+
+    @pytest.mark.parametrize("solver", ["cholesky", "splu", "schur"])
+    def test_sparse_matches_dense(self, solver):
+        dense = GLM(self.y, self.X.toarray(), family=Poisson()).fit()
+        model = GLM(self.y, self.X, family=Poisson())
+        assert sparse.issparse(model.X)
+        results = model.fit(solver=solver)
+        assert sparse.issparse(results.w)
+        numpy.testing.assert_allclose(results.params, dense.params, rtol=1e-8)
+        numpy.testing.assert_allclose(
+            results.normalized_cov_params, dense.normalized_cov_params, rtol=1e-8
+        )
+        assert pytest.approx(results.tr_S) == dense.tr_S
+        assert pytest.approx(results.deviance) == dense.deviance
+
+    def test_dense_only_solvers(self):
+        with pytest.raises(ValueError):
+            GLM(self.y, self.X, family=Poisson()).fit(solver="qr")
+        with pytest.raises(ValueError):
+            GLM(self.y, self.X, family=Poisson()).fit(solver="lsmr", block_size=500)
+
+    def test_lsmr(self):
+        model = GLM(self.y, self.X, family=Poisson())
+        ref = model.fit(solver="splu", tol=1e-12, criterion="max_diff")
+        params, cov = ref.params, ref.normalized_cov_params
+        solver = LSMR()
+        results = model.fit(solver=solver, tol=1e-10, criterion="max_diff")
+        assert results.fit_params["converged"]
+        assert solver.n_inner > results.fit_params["n_iter"]
+        numpy.testing.assert_allclose(results.params, params, rtol=1e-8, atol=1e-10)
+        numpy.testing.assert_allclose(results.normalized_cov_params, cov, rtol=1e-8)
+
+    def test_lsmr_least_squares(self):
+        wx = self.X.multiply(numpy.linspace(0.5, 2.0, self.X.shape[0])[:, None])
+        wx = wx.tocsr()
+        expected = Cholesky().solve(self.y, wx)
+        solver = LSMR(forcing=1e-12, atol=1e-14)
+        numpy.testing.assert_allclose(solver.solve(self.y, wx), expected, rtol=1e-8)
+        # a warm start at the solution takes few iterations
+        n_inner = solver.n_inner
+        solver.forcing = 0.1
+        numpy.testing.assert_allclose(solver.solve(self.y, wx), expected, rtol=1e-8)
+        assert solver.n_inner - n_inner < n_inner / 2
+
+    def test_schur(self):
+        ref = GLM(self.y, self.X, family=Poisson()).fit(solver="splu")
+        solver = Schur()
+        results = GLM(self.y, self.X, family=Poisson()).fit(solver=solver)
+        # the constant and x are found dense; the indicators are diagonal
+        numpy.testing.assert_array_equal(solver._index[0], [0, 1])
+        numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-10)
+        numpy.testing.assert_allclose(
+            solver.inv_dense(), ref.normalized_cov_params[:2, :2], rtol=1e-10
+        )
+        # dense columns given by index, with a second, non-diagonal factor
+        rng = numpy.random.default_rng(1)
+        codes = rng.integers(0, 5, self.X.shape[0])
+        D = sparse.csr_matrix(
+            (numpy.ones(len(codes)), (numpy.arange(len(codes)), codes))
+        )[:, 1:]
+        X = sparse.hstack([D, self.X]).tocsr()
+        ref = GLM(self.y, X, family=Poisson()).fit(solver="splu")
+        results = GLM(self.y, X, family=Poisson()).fit(solver=Schur(dense=[4, 5]))
+        numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-10)
+        numpy.testing.assert_allclose(
+            results.normalized_cov_params, ref.normalized_cov_params, rtol=1e-8
+        )
+        with pytest.raises(linalg.LinAlgError):
+            Schur(dense=1).solve_normal(numpy.diag([1.0, 0.0]), numpy.ones((2, 1)))
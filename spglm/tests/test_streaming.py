@@ -0,0 +1,94 @@
+"""
+Tests for out-of-core GLM estimation.
+"""
+
+import numpy
+import pytest
+
+from ..family import Binomial, Gaussian, Poisson
+from ..glm import GLM
+from ..streaming import StreamingGLM
+
+DIAGNOSTICS = [
+    "deviance",
+    "null_deviance",
+    "llf",
+    "llnull",
+    "aic",
+    "bic",
+    "scale",
+    "pearson_chi2",
+    "D2",
+    "pseudoR2",
+    "tr_S",
+]
+
+
+class TestStreaming:
+    def setup_method(self):
+        rng = numpy.random.default_rng(0)
+        n = 3000
+        self.X = rng.normal(size=(n, 2))
+        eta = 0.5 + self.X @ [0.2, -0.3]
+        self.offset = rng.uniform(1, 3, (n, 1))
+        self.data = {
+            "gaussian": (Gaussian(), (eta + rng.normal(size=n)).reshape((-1, 1))),
+            "poisson": (
+                Poisson(),
+                rng.poisson(numpy.exp(eta) * self.offset.ravel()).reshape((-1, 1))
+                * 1.0,
+            ),
+            "binomial": (
+                Binomial(),
+                rng.binomial(1, 1 / (1 + numpy.exp(-eta))).reshape((-1, 1)) * 1.0,
+            ),
+        }
+
+    @pytest.mark.parametrize("fam", ["gaussian", "poisson", "binomial"])
+    def test_memmap(self, fam, tmp_path):
+        family, y = self.data[fam]
+        offset = self.offset if fam == "poisson" else None
+        X = numpy.lib.format.open_memmap(
+            tmp_path / "X.npy", mode="w+", shape=self.X.shape
+        )
+        X[:] = self.X
+        ref = GLM(y, self.X, family=family, offset=offset).fit()
+        model = StreamingGLM(y, X, family=family, offset=offset, memory=8 * 3000)
+        assert model.n == 3000
+        assert pytest.approx(model.std_y) == ref.model.std_y
+        results = model.fit()
+        assert results.fit_params["n_iter"] == ref.fit_params["n_iter"]
+        numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-10)
+        numpy.testing.assert_allclose(results.bse, ref.bse, rtol=1e-10)
+        for attr in DIAGNOSTICS:
+            assert pytest.approx(getattr(results, attr), rel=1e-8) == getattr(ref, attr)
+        numpy.testing.assert_allclose(results.mu, ref.mu, rtol=1e-10)
+        numpy.testing.assert_allclose(
+            results.resid_pearson, ref.resid_pearson, rtol=1e-8
+        )
+
+    def test_chunks(self):
+        family, y = self.data["poisson"]
+
+        def chunks():
+            for start in range(0, 3000, 700):
+                stop = start + 700
+                yield y[start:stop], self.X[start:stop], self.offset[start:stop]
+
+        ref = GLM(y, self.X, family=family, offset=self.offset).fit()
+        results = StreamingGLM(chunks=chunks, family=family, memory=2**14).fit()
+        numpy.testing.assert_allclose(results.params, ref.params, rtol=1e-10)
+        assert pytest.approx(results.deviance) == ref.deviance
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            StreamingGLM(self.data["gaussian"][1])
+        with pytest.raises(ValueError):
+            StreamingGLM(self.data["gaussian"][1], self.X).fit(solver="qr")
+
+    def test_threads(self):
+        family, y = self.data["poisson"]
+        model = StreamingGLM(y, self.X, family=family, memory=2**14)
+        one = model.fit()
+        four = model.fit(n_jobs=4)
+        numpy.testing.assert_array_equal(one.params, four.params)
@@ -3,6 +3,8 @@ import warnings
 
 import numpy as np
 
+from . import profiling
+
 
 def _bit_length_26(x):
     if x == 0:
@@ -359,8 +361,12 @@ class CachedAttribute:
         _cachedval = _cache.get(name, None)
         # print("[_cachedval=%s]" % _cachedval)
         if _cachedval is None:
-            # Call the "fget" function
-            _cachedval = self.fget(obj)
+            # Call the "fget" function, as a stage if profiling
+            if profiling.enabled():
+                with profiling.stage(f"{type(obj).__name__}.{name}"):
+                    _cachedval = self.fget(obj)
+            else:
+                _cachedval = self.fget(obj)
             # Set the attribute in obj
             # print("Setting %s in cache to %s" % (name, _cachedval))
             try:
@@ -396,3 +402,45 @@ class _cache_readonly:
 
 
 cache_readonly = _cache_readonly()
+
+
+def hilbert_order(coords, p=16):
+    """
+    Order of points along a Hilbert curve
+
+    Consecutive points in the returned order are close in space, which makes
+    it a good visiting order for fits that reuse the previous solution.
+
+    Parameters
+    ----------
+    coords : array
+        n*2, point coordinates
+    p : int
+        order of the curve; coordinates are snapped to a 2**p * 2**p grid
+
+    Returns
+    -------
+    order : array
+        n, indices that sort the points along the curve
+    """
+    coords = np.asarray(coords, dtype=float)
+    lo = coords.min(axis=0)
+    span = np.ptp(coords, axis=0)
+    span[span == 0] = 1.0
+    side = 2**p
+    xy = ((coords - lo) / span * (side - 1)).astype(np.int64)
+    x, y = xy[:, 0].copy(), xy[:, 1].copy()
+    d = np.zeros(len(coords), dtype=np.int64)
+    s = side // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant so the curve stays continuous
+        flip = ~ry & rx
+        x[flip] = side - 1 - x[flip]
+        y[flip] = side - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap].copy()
+        s //= 2
+    return np.argsort(d, kind="stable")
@@ -30,7 +30,7 @@ class VarianceFunction:
     statsmodels.family.family
     """
 
-    def __call__(self, mu):
+    def __call__(self, mu, out=None, work=None):  # noqa: ARG002 - work is unused
         """
         Default variance function
 
@@ -38,12 +38,19 @@ class VarianceFunction:
         -----------
         mu : array-like
             mean parameters
+        out : array, optional
+            Array of the same shape as `mu` to write the result into.
+        work : array, optional
+            Scratch array of the same shape as `mu`; allocated if not given.
 
         Returns
         -------
         v : array
             ones(mu.shape)
         """
+        if out is not None:
+            out.fill(1.0)
+            return out
         mu = np.asarray(mu)
         return np.ones(mu.shape, np.float64)
 
@@ -51,10 +58,7 @@ class VarianceFunction:
         """
         Derivative of the variance function v'(mu)
         """
-        from statsmodels.tools.numdiff import approx_fprime_cs
-
-        # TODO: diag workaround proplem with numdiff for 1d
-        return np.diag(approx_fprime_cs(mu, self))
+        return np.zeros(np.shape(mu))
 
 
 constant = VarianceFunction()
@@ -94,7 +98,7 @@ class Power:
     def __init__(self, power=1.0):
         self.power = power
 
-    def __call__(self, mu):
+    def __call__(self, mu, out=None, work=None):  # noqa: ARG002 - work is unused
         """
         Power variance function
 
@@ -102,30 +106,28 @@ class Power:
         ----------
         mu : array-like
             mean parameters
+        out : array, optional
+            Array of the same shape as `mu` to write the result into.
+        work : array, optional
+            Scratch array of the same shape as `mu`; allocated if not given.
 
         Returns
         -------
         variance : array
             numpy.fabs(mu)**self.power
         """
-        return np.power(np.fabs(mu), self.power)
+        if out is None:
+            return np.power(np.fabs(mu), self.power)
+        np.fabs(mu, out=out)
+        return np.power(out, self.power, out=out)
 
     def deriv(self, mu):
         """
         Derivative of the variance function v'(mu)
-        """
-
-        ########################################################################
-        # `approx_fprime_cs` is imported by unused
-        from statsmodels.tools.numdiff import approx_fprime_cs  # noqa: F401, I001
 
-        # return approx_fprime_cs(mu, self)  # TODO fix breaks in `fabs
-        ########################################################################
-
-        from statsmodels.tools.numdiff import approx_fprime
-
-        # TODO: diag is workaround problem with numdiff for 1d
-        return np.diag(approx_fprime(mu, self))
+        power * numpy.sign(mu) * numpy.fabs(mu)**(power - 1)
+        """
+        return self.power * np.sign(mu) * np.power(np.fabs(mu), self.power - 1)
 
 
 mu = Power()
@@ -187,10 +189,10 @@ class Binomial:
     def __init__(self, n=1):
         self.n = n
 
-    def _clean(self, p):
-        return np.clip(p, FLOAT_EPS, 1 - FLOAT_EPS)
+    def _clean(self, p, out=None):
+        return np.clip(p, FLOAT_EPS, 1 - FLOAT_EPS, out=out)
 
-    def __call__(self, mu):
+    def __call__(self, mu, out=None, work=None):
         """
         Binomial variance function
 
@@ -198,24 +200,32 @@ class Binomial:
         -----------
         mu : array-like
             mean parameters
+        out : array, optional
+            Array of the same shape as `mu` to write the result into.
+        work : array, optional
+            Scratch array of the same shape as `mu`; allocated if not given.
 
         Returns
         -------
         variance : array
            variance = mu/n * (1 - mu/n) * self.n
         """
-        p = self._clean(mu / self.n)
-        return p * (1 - p) * self.n
+        if out is None:
+            p = self._clean(mu / self.n)
+            return p * (1 - p) * self.n
+        p = self._clean(np.divide(mu, self.n, out=work), out=work)
+        np.subtract(1, p, out=out)
+        np.multiply(p, out, out=out)
+        return np.multiply(out, self.n, out=out)
 
-    # TODO: inherit from super
     def deriv(self, mu):
         """
         Derivative of the variance function v'(mu)
-        """
-        from statsmodels.tools.numdiff import approx_fprime_cs
 
-        # TODO: diag workaround proplem with numdiff for 1d
-        return np.diag(approx_fprime_cs(mu, self))
+        1 - 2 * mu / n, with mu / n clipped as in the call method
+        """
+        p = self._clean(mu / self.n)
+        return 1 - 2 * p
 
 
 binary = Binomial()
@@ -259,10 +269,10 @@ class NegativeBinomial:
     def __init__(self, alpha=1.0):
         self.alpha = alpha
 
-    def _clean(self, p):
-        return np.clip(p, FLOAT_EPS, np.inf)
+    def _clean(self, p, out=None):
+        return np.clip(p, FLOAT_EPS, np.inf, out=out)
 
-    def __call__(self, mu):
+    def __call__(self, mu, out=None, work=None):
         """
         Negative binomial variance function
 
@@ -270,14 +280,23 @@ class NegativeBinomial:
         ----------
         mu : array-like
             mean parameters
+        out : array, optional
+            Array of the same shape as `mu` to write the result into.
+        work : array, optional
+            Scratch array of the same shape as `mu`; allocated if not given.
 
         Returns
         -------
         variance : array
             variance = mu + alpha*mu**2
         """
-        p = self._clean(mu)
-        return p + self.alpha * p**2
+        if out is None:
+            p = self._clean(mu)
+            return p + self.alpha * p**2
+        p = self._clean(mu, out=work)
+        np.square(p, out=out)
+        np.multiply(self.alpha, out, out=out)
+        return np.add(p, out, out=out)
 
     def deriv(self, mu):
         """